@@ -0,0 +1,167 @@
+from __future__ import annotations
+import asyncio
+import random
+import threading
+from typing import Any
+
+
+"""
+An in-process SMTP stand-in server for benchmarks.
+It runs an asyncio server in a background thread and speaks just enough SMTP for smtplib and the async client.
+Messages are counted, not stored.
+
+latency:          seconds to wait before answering the end of DATA
+reject_rate:      probability that a recipient is refused with 550
+greylist:         the first time an address is given, it is refused with 451
+disconnect_rate:  probability that the connection is dropped instead of answering the end of DATA
+max_recipients:   recipients beyond this number in one transaction get 452
+max_size:         the SIZE announced in reply to EHLO (not enforced)
+max_messages:     messages per session, after which the server answers 421 and drops the connection
+smtputf8:         whether SMTPUTF8 is announced (addresses are accepted as UTF-8 either way)
+"""
+
+class FakeSMTPServer:
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 latency: float = 0,
+                 reject_rate: float = 0,
+                 greylist: bool = False,
+                 disconnect_rate: float = 0,
+                 max_recipients: int = 0,
+                 max_size: int = 52428800,
+                 max_messages: int = 0,
+                 smtputf8: bool = True,
+                 seed: int = 0
+                 ) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.reject_rate = reject_rate
+        self.greylist = greylist
+        self.greylisted: set[bytes] = set()
+        self.disconnect_rate = disconnect_rate
+        self.max_recipients = max_recipients
+        self.max_size = max_size
+        self.max_messages = max_messages
+        self.smtputf8 = smtputf8
+        self.random = random.Random(seed)
+
+        self.sessions = 0
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.disconnects = 0
+        self.noops = 0
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any):
+        self.stop()
+
+    def start(self):
+        ready = threading.Event()
+
+        async def serve():
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            async with self._server:
+                try:
+                    await self._server.serve_forever()
+                except asyncio.CancelledError:
+                    pass
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(serve())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.sessions += 1
+        writer.write(b'220 fake ESMTP\r\n')
+        rcpts = 0
+        messages = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                cmd = line[:4].upper()
+
+                if cmd == b'EHLO':
+                    writer.write(b'250-fake\r\n250-PIPELINING\r\n250-SIZE %d\r\n250-8BITMIME\r\n%s250 AUTH PLAIN LOGIN\r\n' % (self.max_size, b'250-SMTPUTF8\r\n' if self.smtputf8 else b''))
+                elif cmd == b'HELO':
+                    writer.write(b'250 fake\r\n')
+                elif cmd == b'AUTH':
+                    writer.write(b'235 2.7.0 Authentication successful\r\n')
+                elif cmd == b'MAIL':
+                    if self.max_messages and messages >= self.max_messages:
+                        self.disconnects += 1
+                        writer.write(b'421 4.7.0 Too many messages in this session\r\n')
+                        await writer.drain()
+                        break
+                    rcpts = 0
+                    writer.write(b'250 OK\r\n')
+                elif cmd == b'RCPT':
+                    if self.max_recipients and rcpts >= self.max_recipients:
+                        writer.write(b'452 4.5.3 Too many recipients\r\n')
+                    elif self.greylist and line[8:].strip().lower() not in self.greylisted:
+                        self.greylisted.add(line[8:].strip().lower())
+                        writer.write(b'451 4.7.1 Greylisted, try again later\r\n')
+                    elif self.reject_rate and self.random.random() < self.reject_rate:
+                        writer.write(b'550 5.1.1 No such user\r\n')
+                    else:
+                        rcpts += 1
+                        writer.write(b'250 OK\r\n')
+                elif cmd == b'DATA':
+                    writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    await writer.drain()
+                    size = 0
+                    while True:
+                        data = await reader.readline()
+                        if not data or data == b'.\r\n':
+                            break
+                        size += len(data)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    if self.disconnect_rate and self.random.random() < self.disconnect_rate:
+                        self.disconnects += 1
+                        break
+                    self.messages += 1
+                    messages += 1
+                    self.recipients += rcpts
+                    self.bytes += size
+                    writer.write(b'250 OK queued\r\n')
+                elif cmd == b'QUIT':
+                    writer.write(b'221 Bye\r\n')
+                    await writer.drain()
+                    break
+                elif cmd == b'NOOP':
+                    self.noops += 1
+                    writer.write(b'250 OK\r\n')
+                elif cmd == b'RSET':
+                    writer.write(b'250 OK\r\n')
+                else:
+                    writer.write(b'502 Command not implemented\r\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,317 @@
+"""
+Benchmarks send_queue of the general and personal mailers against the in-process fake SMTP server.
+
+    python benchmarks/run.py --output bench.json
+    python benchmarks/run.py --output new.json --compare bench.json
+
+With --transport null, e-mails are built but discarded instead of sent, which measures how fast they are generated.
+With --dkim, e-mails are signed with a new 2048-bit RSA key (needs cryptography).
+The async scenarios send with AsyncMailer, which has no transports, retries, lookahead or signing; they need --transport smtp,
+and as AsyncMailer does not reconnect, they are left out with --disconnect-rate.
+
+CPU time is that of the whole process, so it includes the fake server.
+"""
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import logging
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+try:
+    import bulk_mailer
+except ModuleNotFoundError:
+    # allow running from a source checkout without installing
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from bulk_mailer.entities import Emailable, Person
+from bulk_mailer.general.mailer import Mailer, SMTP_CONFIG
+from bulk_mailer.general.async_mailer import AsyncMailer
+from bulk_mailer.general.envelope import Envelope
+from bulk_mailer.general.retry import RetryPolicy
+from bulk_mailer.general.transports import Transport, NullTransport
+from bulk_mailer.general.dkim import DkimSigner
+from bulk_mailer.general.metrics import Metrics
+from bulk_mailer.utils import create_plain_mail
+from bulk_mailer import personal
+
+if __package__:
+    from .fake_smtp import FakeSMTPServer
+else:
+    from fake_smtp import FakeSMTPServer
+
+
+SENDER = Emailable('sender@example.org', 'Sender')
+
+
+class Timer:
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        # the phases of the mailers of a scenario
+        self.metrics = Metrics()
+
+    # wraps a send function to record the duration of every call
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.latencies.append(time.perf_counter() - start)
+        return timed
+
+    def wrap_async(self, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        async def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.latencies.append(time.perf_counter() - start)
+        return timed
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {'p50': 0, 'p95': 0, 'p99': 0}
+    if len(values) == 1:
+        v = values[0] * 1000
+        return {'p50': v, 'p95': v, 'p99': v}
+    q = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p50': q[49] * 1000, 'p95': q[94] * 1000, 'p99': q[98] * 1000}
+
+
+# injected disconnects need reconnecting
+def retry_policy(args: argparse.Namespace) -> RetryPolicy | None:
+    return RetryPolicy(base_delay=0.01, max_delay=0.1) if args.disconnect_rate else None
+
+
+def dkim_signer(args: argparse.Namespace) -> DkimSigner | None:
+    if not args.dkim:
+        return None
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return DkimSigner('example.org', 'bench', pem)
+
+
+def mailer_args(args: argparse.Namespace, timer: Timer) -> dict[str, Any]:
+    return {
+        'detailed_log': False,
+        'connections': args.connections,
+        'retry': retry_policy(args),
+        'lookahead': args.lookahead,
+        'serializers': args.serializers,
+        'dkim': dkim_signer(args),
+        'metrics': timer.metrics,
+    }
+
+
+def make_mailer(args: argparse.Namespace, config: SMTP_CONFIG | Transport, timer: Timer) -> Mailer:
+    mailer = Mailer(config, SENDER, **mailer_args(args, timer))
+    mailer.send_envelope = timer.wrap(mailer.send_envelope)  # type: ignore[method-assign]
+    return mailer
+
+
+def general_single(args: argparse.Namespace, config: SMTP_CONFIG | Transport, timer: Timer, attachment: Path | None) -> tuple[int, int]:
+    queue = [
+        Envelope(create_plain_mail('Benchmark', 'Hello\n' * 20, attachment), Emailable(f'user{i}@example.org'))
+        for i in range(args.messages)
+    ]
+    with make_mailer(args, config, timer) as mailer:
+        mailer.send_queue(queue)
+    return args.messages, args.messages
+
+
+def general_bulk(args: argparse.Namespace, config: SMTP_CONFIG | Transport, timer: Timer, attachment: Path | None) -> tuple[int, int]:
+    bcc = [Emailable(f'user{i}@example.org') for i in range(args.recipients)]
+    queue = [Envelope(create_plain_mail('Benchmark', 'Hello\n' * 20, attachment), SENDER, bcc=bcc)]
+    with make_mailer(args, config, timer) as mailer:
+        mailer.send_queue(queue)
+    return 1, args.recipients + 1
+
+
+def personal_mails(args: argparse.Namespace, config: SMTP_CONFIG | Transport, timer: Timer, attachment: Path | None) -> tuple[int, int]:
+    people = [Person('First', f'Last{i}', f'user{i}@example.org') for i in range(args.messages)]
+    queue = personal.MailQueue(detailed_log=False)
+    queue.add_for(people, lambda p: create_plain_mail(f'Hello {p.first_name}', f'Dear {p.name},\n' + 'Hello\n' * 20, attachment))
+    with personal.Mailer(config, SENDER, **mailer_args(args, timer)) as mailer:
+        mailer.mailer.send_envelope = timer.wrap(mailer.mailer.send_envelope)  # type: ignore[method-assign]
+        mailer.send_queue(queue)
+    return args.messages, args.messages
+
+
+def personal_template(args: argparse.Namespace, config: SMTP_CONFIG | Transport, timer: Timer, attachment: Path | None) -> tuple[int, int]:
+    people = [Person('First', f'Last{i}', f'user{i}@example.org') for i in range(args.messages)]
+    template = personal.MessageTemplate('Hello {first_name}', 'Dear {name},\n' + 'Hello\n' * 20, attachment)
+    queue = personal.StreamingMailQueue(detailed_log=False)
+    queue.add_for(people, template)
+    with personal.Mailer(config, SENDER, **mailer_args(args, timer)) as mailer:
+        mailer.mailer.send_envelope = timer.wrap(mailer.mailer.send_envelope)  # type: ignore[method-assign]
+        mailer.send_queue(queue)
+    return args.messages, args.messages
+
+
+def general_async(args: argparse.Namespace, config: SMTP_CONFIG | Transport, timer: Timer, attachment: Path | None) -> tuple[int, int]:
+    assert isinstance(config, SMTP_CONFIG)
+    queue = [
+        Envelope(create_plain_mail('Benchmark', 'Hello\n' * 20, attachment), Emailable(f'user{i}@example.org'))
+        for i in range(args.messages)
+    ]
+
+    async def send():
+        async with AsyncMailer(config, SENDER, detailed_log=False, connections=args.connections) as mailer:
+            mailer.send_envelope = timer.wrap_async(mailer.send_envelope)  # type: ignore[method-assign]
+            await mailer.send_queue(queue)
+    asyncio.run(send())
+    return args.messages, args.messages
+
+
+def personal_async(args: argparse.Namespace, config: SMTP_CONFIG | Transport, timer: Timer, attachment: Path | None) -> tuple[int, int]:
+    assert isinstance(config, SMTP_CONFIG)
+    people = [Person('First', f'Last{i}', f'user{i}@example.org') for i in range(args.messages)]
+    queue = personal.MailQueue(detailed_log=False)
+    queue.add_for(people, lambda p: create_plain_mail(f'Hello {p.first_name}', f'Dear {p.name},\n' + 'Hello\n' * 20, attachment))
+
+    async def send():
+        async with personal.AsyncMailer(config, SENDER, detailed_log=False, connections=args.connections) as mailer:
+            mailer.send_envelope = timer.wrap_async(mailer.send_envelope)  # type: ignore[method-assign]
+            await mailer.send_queue(queue)
+    asyncio.run(send())
+    return args.messages, args.messages
+
+
+SCENARIOS: dict[str, Callable[[argparse.Namespace, SMTP_CONFIG | Transport, Timer, Path | None], tuple[int, int]]] = {
+    'general-single': general_single,
+    'general-bulk': general_bulk,
+    'personal': personal_mails,
+    'personal-template': personal_template,
+    'general-async': general_async,
+    'personal-async': personal_async,
+}
+
+# scenarios that can only send to the fake server, without injected disconnects
+ASYNC_SCENARIOS = ('general-async', 'personal-async')
+
+
+def run_scenario(name: str, args: argparse.Namespace, attachment: Path | None) -> dict[str, Any]:
+    scenario = SCENARIOS[name]
+    timer = Timer()
+    server = FakeSMTPServer(latency=args.latency, reject_rate=args.reject_rate, disconnect_rate=args.disconnect_rate, seed=args.seed)
+    with server:
+        config = SMTP_CONFIG(server.host, server.port, ssl=False) if args.transport == 'smtp' else NullTransport()
+        if args.memory:
+            tracemalloc.start()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        messages, recipients = scenario(args, config, timer, attachment)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        peak = tracemalloc.get_traced_memory()[1] if args.memory else 0
+        if args.memory:
+            tracemalloc.stop()
+
+    return {
+        'name': name + ('+attachment' if attachment else ''),
+        'messages': messages,
+        'recipients': recipients,
+        'wall_secs': wall,
+        'msgs_per_sec': messages / wall if wall else 0,
+        'latency_ms': percentiles(timer.latencies),
+        'cpu_secs': cpu,
+        'peak_mem_kb': peak // 1024,
+        'phase_secs': {name: stats.total for name, stats in timer.metrics.phases.items()},
+        'server': {'sessions': server.sessions, 'messages': server.messages, 'recipients': server.recipients, 'bytes': server.bytes, 'disconnects': server.disconnects},
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# the time spent signing is shown if any e-mails were signed
+def print_results(results: list[dict[str, Any]], baseline: dict[str, dict[str, Any]] | None):
+    signed = any('sign' in r.get('phase_secs', {}) for r in results)
+    print(f"{'scenario':<30} {'msgs/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'cpu s':>8} {'peak KB':>9}" + (f" {'sign s':>8}" if signed else ""))
+    for r in results:
+        lat = r['latency_ms']
+        line = f"{r['name']:<30} {r['msgs_per_sec']:>10.1f} {lat['p50']:>9.2f} {lat['p95']:>9.2f} {lat['p99']:>9.2f} {r['cpu_secs']:>8.2f} {r['peak_mem_kb']:>9}"
+        if signed:
+            line += f" {r.get('phase_secs', {}).get('sign', 0):>8.2f}"
+        if baseline and r['name'] in baseline and baseline[r['name']]['msgs_per_sec']:
+            line += f"   x{r['msgs_per_sec'] / baseline[r['name']]['msgs_per_sec']:.2f} throughput"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='run only these scenarios (default: all)')
+    parser.add_argument('--messages', type=int, default=1000, help='messages in the per-recipient scenarios')
+    parser.add_argument('--recipients', type=int, default=10000, help='recipients in the bulk scenario')
+    parser.add_argument('--connections', type=int, default=1)
+    parser.add_argument('--lookahead', type=int, default=0, help='e-mails to prepare ahead while sending')
+    parser.add_argument('--attachment-kb', type=int, default=100, help='size of the attachment in the +attachment variants, 0 to skip them')
+    parser.add_argument('--serializers', type=int, default=1, help='threads preparing e-mails ahead (with --lookahead)')
+    parser.add_argument('--dkim', action='store_true', help='DKIM-sign every e-mail')
+    parser.add_argument('--transport', choices=('smtp', 'null'), default='smtp', help='send to the fake server, or discard the e-mails')
+    parser.add_argument('--latency', type=float, default=0, help='server latency per message in seconds')
+    parser.add_argument('--reject-rate', type=float, default=0)
+    parser.add_argument('--disconnect-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='do not trace memory (tracing slows down the run)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON output of an earlier run to compare against')
+    args = parser.parse_args()
+    scenarios = args.scenario or list(SCENARIOS)
+    if args.transport != 'smtp' or args.disconnect_rate > 0:
+        if args.scenario and any(name in ASYNC_SCENARIOS for name in args.scenario):
+            parser.error('the async scenarios need --transport smtp and cannot be run with --disconnect-rate')
+        scenarios = [name for name in scenarios if name not in ASYNC_SCENARIOS]
+
+    logging.disable(logging.ERROR)
+
+    results: list[dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        attachments: list[Path | None] = [None]
+        if args.attachment_kb:
+            path = Path(tmp) / 'attachment.pdf'
+            path.write_bytes(os.urandom(args.attachment_kb * 1024))
+            attachments.append(path)
+
+        for name in scenarios:
+            for attachment in attachments:
+                results.append(run_scenario(name, args, attachment))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {r['name']: r for r in json.load(f)['results']}
+    print_results(results, baseline)
+
+    if args.output:
+        output = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
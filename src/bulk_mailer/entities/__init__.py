@@ -1,2 +1,2 @@
-
-from .entities import Person, Emailable
\ No newline at end of file
+from .entities import Person, Emailable, Recipient, normalize_address
+from .loaders import RecipientLoader, load_csv, load_jsonl, is_valid_address
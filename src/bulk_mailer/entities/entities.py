@@ -1,17 +1,73 @@
+from email.headerregistry import Address
 from email.utils import formataddr
+from typing import Any
+from collections.abc import Mapping
 
 
+# the form under which addresses are compared: surrounding whitespace removed, case-insensitive
+def normalize_address(email_address: str) -> str:
+    return email_address.strip().lower()
+
+
+# recipients are equal if their normalized addresses are equal, regardless of name
 class Emailable:
+    __slots__ = ('_email_address', '_name', '_key', '_header')
+
     def __init__(self, email_address:str, name:str='') -> None:
-        self.email_address = email_address
-        self.name = name
+        self._email_address = email_address
+        self._name = name
+        self._key = normalize_address(email_address)
+        self._header: str | None = None
+
+    @property
+    def email_address(self) -> str:
+        return self._email_address
+
+    @email_address.setter
+    def email_address(self, value: str):
+        self._email_address = value
+        self._key = normalize_address(value)
+        self._header = None
 
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, value: str):
+        self._name = value
+        self._header = None
+
+    @property
+    def key(self) -> str:
+        return self._key
+
+    # formataddr only accepts ASCII addresses; internationalized ones are left as they are, for SMTPUTF8
     @property
     def email_header_name(self) -> str:
-        return formataddr((self.name, self.email_address))
+        if self._header is None:
+            if self._email_address.isascii():
+                self._header = formataddr((self._name, self._email_address))
+            else:
+                username, _, domain = self._email_address.rpartition('@')
+                self._header = str(Address(self._name, username, domain))
+        return self._header
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Emailable):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self) -> int:
+        return hash(self._key)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._email_address!r}, {self._name!r})"
 
 
 class Person(Emailable):
+    __slots__ = ('first_name', 'last_name')
+
     def __init__(self, first_name:str, last_name:str, email_address:str) -> None:
         self.first_name = first_name
         self.last_name = last_name
@@ -20,6 +76,32 @@ class Person(Emailable):
     # @property
     # def full_name(self) -> str:
     #     return f"{self.first_name} {self.last_name}"
-    
+
     def __str__(self) -> str:
         return f"{self.name} ({self.email_address})"
+
+
+
+# a person with additional fields, e.g. for template placeholders; fields can be read like attributes
+class Recipient(Person):
+    __slots__ = ('fields',)
+
+    def __init__(self, first_name:str, last_name:str, email_address:str, fields:Mapping[str, Any]|None=None) -> None:
+        super().__init__(first_name, last_name, email_address)
+        self.name = self.name.strip()
+        self.fields: Mapping[str, Any] = fields if fields is not None else {}
+
+    # only called for attributes that do not exist otherwise
+    def __getattr__(self, key: str) -> Any:
+        if key.startswith('_') or key == 'fields':
+            raise AttributeError(key)
+        try:
+            return self.fields[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.first_name!r}, {self.last_name!r}, {self.email_address!r}, {dict(self.fields)!r})"
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.email_address})" if self.name else self.email_address
@@ -0,0 +1,173 @@
+from __future__ import annotations
+import re
+import csv
+import json
+import logging
+import sqlite3
+from collections.abc import Collection, Iterable, Iterator, Mapping
+from functools import lru_cache
+from pathlib import PurePath
+from typing import Any
+from .entities import Recipient, normalize_address
+
+
+log = logging.getLogger()
+
+_LOCAL_PART = re.compile(r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*")
+_LABEL = re.compile(r"(?!-)[A-Za-z0-9-]{1,63}(?<!-)")
+
+RECIPIENT_ATTRIBUTES = ('first_name', 'last_name', 'email_address')
+
+
+# lists usually contain few distinct domains, so the result is cached per domain
+@lru_cache(maxsize=2**16)
+def is_valid_domain(domain: str) -> bool:
+    if not domain.isascii():
+        try:
+            domain = domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            return False
+    labels = domain.split('.')
+    return (
+        len(domain) <= 253
+        and len(labels) >= 2
+        and all(_LABEL.fullmatch(label) for label in labels)
+        and not labels[-1].isdigit()
+    )
+
+
+# syntax check only: a dot-atom local part (without quoting) and a domain name
+def is_valid_address(address: str) -> bool:
+    local, at, domain = address.rpartition('@')
+    return bool(at) and len(local) <= 64 and _LOCAL_PART.fullmatch(local) is not None and is_valid_domain(domain.lower())
+
+
+
+"""
+A set of strings that is kept in a temporary SQLite database, so that it can grow beyond the available memory.
+At most about cache_kb of it is held in memory; the rest lives in a temporary file that is removed when the set is closed.
+"""
+
+class SpillingSet:
+    def __init__(self, cache_kb: int = 16384) -> None:
+        self._db = sqlite3.connect('')
+        self._db.execute(f'PRAGMA cache_size = -{int(cache_kb)}')
+        self._db.execute('CREATE TABLE items (item TEXT PRIMARY KEY) WITHOUT ROWID')
+        self._cursor = self._db.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
+
+    def __contains__(self, item: str) -> bool:
+        return self._cursor.execute('SELECT 1 FROM items WHERE item = ?', (item,)).fetchone() is not None
+
+    # adds the item; returns whether it was contained already
+    def add(self, item: str) -> bool:
+        self._cursor.execute('INSERT OR IGNORE INTO items VALUES (?)', (item,))
+        return self._cursor.rowcount == 0
+
+    def close(self):
+        self._db.close()
+
+
+
+"""
+Reads recipients from a CSV or JSONL file row by row, so that lists of any length can be streamed into e.g. StreamingMailQueue.add_for.
+
+`columns` maps the recipient attributes first_name, last_name and email_address to column names (by default, the columns have these names).
+The other columns, or only those in `fields`, become fields of the recipient, which templates can use as placeholders.
+Rows with an invalid address are skipped, and with dedupe also rows whose normalized address occurred before.
+Dedupe is exact; the seen addresses are kept in a SpillingSet, which holds at most dedupe_cache_kb in memory.
+
+Every iteration reads the file again. After an iteration, rows, invalid and duplicates hold the numbers of that pass.
+"""
+
+class RecipientLoader(Iterable[Recipient]):
+    def __init__(self,
+                 path: str | PurePath,
+                 format: str | None = None,
+                 columns: Mapping[str, str] | None = None,
+                 fields: Collection[str] | None = None,
+                 validate: bool = True,
+                 dedupe: bool = True,
+                 dedupe_cache_kb: int = 16384,
+                 encoding: str = 'utf-8-sig',
+                 delimiter: str = ','
+                 ) -> None:
+        self.path = PurePath(path)
+        if format is None:
+            format = 'jsonl' if self.path.suffix.lower() in ('.jsonl', '.ndjson') else 'csv'
+        if format not in ('csv', 'jsonl'):
+            raise ValueError(f"Unknown format: {format}")
+        columns = dict(columns or {})
+        unknown = set(columns) - set(RECIPIENT_ATTRIBUTES)
+        if unknown:
+            raise ValueError(f"Unknown recipient attributes: {', '.join(sorted(unknown))}")
+
+        self.format = format
+        self.columns = {attr: columns.get(attr, attr) for attr in RECIPIENT_ATTRIBUTES}
+        self.fields = fields
+        self.validate = validate
+        self.dedupe = dedupe
+        self.dedupe_cache_kb = dedupe_cache_kb
+        self.encoding = encoding
+        self.delimiter = delimiter
+
+        self.rows = 0
+        self.invalid = 0
+        self.duplicates = 0
+
+    def _read_rows(self) -> Iterator[Mapping[str, Any]]:
+        with open(self.path, newline='' if self.format == 'csv' else None, encoding=self.encoding) as f:
+            if self.format == 'csv':
+                yield from csv.DictReader(f, delimiter=self.delimiter)
+                return
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def __iter__(self) -> Iterator[Recipient]:
+        self.rows = self.invalid = self.duplicates = 0
+        seen = SpillingSet(self.dedupe_cache_kb) if self.dedupe else None
+        try:
+            yield from self._recipients(seen)
+        finally:
+            if seen is not None:
+                seen.close()
+
+        if self.invalid or self.duplicates:
+            log.warning(f"Read {self.rows} rows from {self.path.name}: skipped {self.invalid} invalid and {self.duplicates} duplicate addresses")
+        else:
+            log.info(f"Read {self.rows} rows from {self.path.name}")
+
+    def _recipients(self, seen: SpillingSet | None) -> Iterator[Recipient]:
+        first_col, last_col, address_col = (self.columns[attr] for attr in RECIPIENT_ATTRIBUTES)
+        own_cols = {first_col, last_col, address_col}
+
+        for row in self._read_rows():
+            self.rows += 1
+            address = str(row.get(address_col) or '').strip()
+            if self.validate and not is_valid_address(address):
+                self.invalid += 1
+                log.debug(f"Skipping row {self.rows}: invalid e-mail address '{address}'")
+                continue
+            if seen is not None and seen.add(normalize_address(address)):
+                self.duplicates += 1
+                log.debug(f"Skipping row {self.rows}: duplicate e-mail address '{address}'")
+                continue
+
+            if self.fields is None:
+                extra = {k: v for k, v in row.items() if k not in own_cols}
+            else:
+                extra = {k: row.get(k) for k in self.fields}
+            yield Recipient(str(row.get(first_col) or '').strip(), str(row.get(last_col) or '').strip(), address, extra)
+
+
+def load_csv(path: str | PurePath, **kwargs: Any) -> RecipientLoader:
+    return RecipientLoader(path, 'csv', **kwargs)
+
+def load_jsonl(path: str | PurePath, **kwargs: Any) -> RecipientLoader:
+    return RecipientLoader(path, 'jsonl', **kwargs)
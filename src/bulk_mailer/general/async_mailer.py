@@ -0,0 +1,198 @@
+from __future__ import annotations
+import asyncio
+import ssl
+import smtplib
+import logging
+from collections import deque
+from collections.abc import Collection, Iterable, AsyncIterator, Awaitable, Callable, Sized
+from typing import Any, TypeVar
+from bulk_mailer.entities import Emailable
+from bulk_mailer.utils import ask_mail_confirmation
+from .async_smtp import AsyncSMTP
+from .envelope import Envelope
+from .mailer import SMTP_CONFIG, SendCancelled, IncompleteLoginError, prepare_mail, map_failed, log_send_result, invalid_message_reply
+from .ratelimit import RateLimiter
+from .result import SendResult
+from .types import SendErrs, SendSuccs, Message
+
+
+log = logging.getLogger()
+
+_T = TypeVar('_T')
+_R = TypeVar('_R')
+
+
+async def connect_async(config: SMTP_CONFIG) -> AsyncSMTP:
+    if config.username is not None and config.password is None:
+        raise IncompleteLoginError("User provided but password missing")
+    if config.password is not None and config.username is None:
+        raise IncompleteLoginError("Password provided but user missing")
+
+    if config.ssl:
+        log.debug("Connecting to SMTP server securely (SSL on)")
+        server = AsyncSMTP(config.address, config.port, ssl_context=ssl.create_default_context())
+    else:
+        log.debug("Connecting to SMTP server insecurely (SSL off)")
+        server = AsyncSMTP(config.address, config.port)
+    await server.connect()
+
+    if config.username is not None and config.password is not None:
+        log.debug(f"Logging in: '{config.username}'@{config.address}:{config.port}")
+        await server.login(config.username, config.password)
+    else:
+        log.debug("Skipping login")
+    return server
+
+
+
+# works with 'async with' statement
+# all connections are served by the running event loop; `connections` is the number of concurrent SMTP sessions
+
+class AsyncMailer:
+    sender: Emailable
+    confirm_send: bool
+    delay_secs: float
+    rate_limit: RateLimiter | None
+
+    def __init__(self, config: SMTP_CONFIG, sender: Emailable, confirm_send:bool=False, delay_secs:float=0, detailed_log:bool=True, connections:int=1, rate_limit:RateLimiter|None=None) -> None:
+        if connections < 1:
+            raise ValueError('Number of connections must be at least 1')
+        self.config = config
+        self.sender = sender
+        self.confirm_send = confirm_send
+        self.delay_secs = delay_secs
+        self.detailed_log = detailed_log
+        if rate_limit is None and delay_secs > 0:
+            rate_limit = RateLimiter.fixed_delay(delay_secs)
+        self.rate_limit = rate_limit
+        self.size = connections
+        self.connections: list[AsyncSMTP] = []
+        self._idle: asyncio.Queue[AsyncSMTP] = asyncio.Queue()
+        self._confirm_lock = asyncio.Lock()
+
+    async def connect(self):
+        servers = await asyncio.gather(*(connect_async(self.config) for _ in range(self.size)))
+        for server in servers:
+            self.connections.append(server)
+            self._idle.put_nowait(server)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc_value: Any, tb: Any):
+        await self.quit()
+
+    async def quit(self):
+        log.debug("Disconnecting from SMTP server")
+        await asyncio.gather(*(server.quit() for server in self.connections))
+
+    # reserves the next send slot; the limits apply across all connections
+    async def wait(self, recipients: int = 1, size: int = 0):
+        if self.rate_limit is None:
+            return
+        delay = self.rate_limit.reserve(recipients, size)
+        if delay > 0:
+            log.debug(f"Waiting for {round(delay, 2)} seconds")
+            await asyncio.sleep(delay)
+
+
+    # returns tuple (succeeded, failed)
+    async def send_mail(self,
+             msg: Message,
+             to: Emailable | Collection[Emailable],
+             cc: Emailable | Collection[Emailable] | None = None,
+             bcc: Emailable | Collection[Emailable] | None = None,
+             confirm: bool | None = None
+             ) -> tuple[SendSuccs, SendErrs]:
+
+        log = logging.getLogger('send_mail')
+
+        env = Envelope(msg, to, cc, bcc)
+        del to, cc, bcc
+
+        if confirm is None:
+            confirm = self.confirm_send
+
+        try:
+            mail = prepare_mail(env, self.sender)
+        except ValueError as e:
+            # refused for every recipient instead of aborting the queue
+            log.error(f"E-mail not sent: {e}")
+            error = invalid_message_reply(e)
+            return set(), {p: error for p in dict.fromkeys(env.all_recipients)}
+
+        if confirm:
+            # the prompt blocks, so it runs in a thread to keep the other sessions going
+            async with self._confirm_lock:
+                log.debug("Awaiting e-mail confirmation")
+                if not await asyncio.to_thread(ask_mail_confirmation, Envelope(mail.data, env.to, env.cc, env.bcc), "Send", "Cancel"):
+                    log.debug(f"E-mail cancelled")
+                    raise SendCancelled()
+
+        await self.wait(len(mail.to_addrs), len(mail.data))
+
+        server = await self._idle.get()
+        try:
+            log.debug("Sending e-mail")
+            if not mail.international:
+                failed_addrs = await server.sendmail(mail.from_addr, mail.to_addrs, mail.data)
+            elif server.has_extn('smtputf8'):
+                failed_addrs = await server.sendmail(mail.from_addr, mail.to_addrs, mail.data, ['SMTPUTF8', 'BODY=8BITMIME'])
+            else:
+                log.error(f"E-mail not sent: it has non-ASCII addresses, but the server does not support SMTPUTF8")
+                failed_addrs = {addr: (553, b'5.6.7 Server does not support SMTPUTF8, needed for non-ASCII addresses') for addr in mail.to_addrs}
+        except smtplib.SMTPRecipientsRefused as e:
+            failed_addrs = e.recipients
+        finally:
+            self._idle.put_nowait(server)
+        if self.rate_limit is not None:
+            self.rate_limit.feedback(code for code, _ in failed_addrs.values())
+
+        succeeded, failed = map_failed(mail.to_people, failed_addrs)
+        log_send_result(succeeded, failed, mail.to_people, self.detailed_log)
+
+        return succeeded, failed
+
+
+    async def send_envelope(self, env: Envelope) -> SendResult:
+        cancelled = False
+        succeeded: SendSuccs
+        failed: SendErrs
+        try:
+            succeeded, failed = await self.send_mail(env.msg, env.to, env.cc, env.bcc)
+        except SendCancelled:
+            cancelled = True
+            succeeded = set()
+            failed = dict()
+        return SendResult(env, succeeded, failed, cancelled)
+
+    # results are yielded in queue order
+    async def send_queue_iter(self, queue: Iterable[Envelope]) -> AsyncIterator[SendResult]:
+        async for result in gather_ordered(self.send_envelope, queue, self.size):
+            yield result
+
+    async def send_queue(self, queue: Iterable[Envelope]) -> None:
+        if isinstance(queue, Sized):
+            log.info(f"Sending {len(queue)} queued e-mails")
+        else:
+            log.info(f"Sending queued e-mails")
+        async for _ in self.send_queue_iter(queue):
+            pass
+        log.info(f"Sending queue finished")
+
+
+
+# async counterpart of pool.imap_ordered: runs up to 2*workers coroutines at once, yields results in input order
+async def gather_ordered(func: Callable[[_T], Awaitable[_R]], items: Iterable[_T], workers: int) -> AsyncIterator[_R]:
+    pending: deque[asyncio.Future[_R]] = deque()
+    try:
+        for item in items:
+            pending.append(asyncio.ensure_future(func(item)))
+            if len(pending) >= 2 * workers:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
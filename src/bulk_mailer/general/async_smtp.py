@@ -0,0 +1,191 @@
+from __future__ import annotations
+import asyncio
+import base64
+import re
+import ssl
+import smtplib
+import logging
+from collections.abc import Sequence
+from .types import Reply
+
+
+log = logging.getLogger()
+
+CRLF = b'\r\n'
+
+
+"""
+A minimal SMTP client on top of asyncio streams.
+It supports what the mailers need: EHLO/HELO, AUTH PLAIN/LOGIN, PIPELINING and sending a message to multiple recipients.
+Errors are reported with the exception classes of smtplib, so that they can be handled the same way in the sync and async code.
+"""
+
+class AsyncSMTP:
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+
+    def __init__(self, host: str, port: int, ssl_context: ssl.SSLContext | None = None, timeout: float = 60) -> None:
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self.esmtp_features: dict[str, str] = {}
+        self.connected = False
+
+    async def connect(self) -> Reply:
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl_context),
+            self.timeout
+        )
+        self.connected = True
+        code, msg = await self.getreply()
+        if code != 220:
+            self.close()
+            raise smtplib.SMTPConnectError(code, msg)
+        await self.ehlo()
+        return code, msg
+
+    async def getreply(self) -> Reply:
+        lines: list[bytes] = []
+        while True:
+            try:
+                line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            except (asyncio.TimeoutError, ConnectionError) as e:
+                self.close()
+                raise smtplib.SMTPServerDisconnected(f"Connection unexpectedly closed: {e}")
+            if not line:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            try:
+                code = int(line[:3])
+            except ValueError:
+                raise smtplib.SMTPResponseException(-1, line)
+            lines.append(line[4:].strip(b' \t\r\n'))
+            if line[3:4] != b'-':
+                break
+        if code == 421:
+            self.close()
+        return code, b'\n'.join(lines)
+
+    def _write(self, data: bytes):
+        if not self.connected:
+            raise smtplib.SMTPServerDisconnected("Please run connect() first")
+        self.writer.write(data)
+
+    async def command(self, cmd: str, encoding: str = 'ascii') -> Reply:
+        self._write(cmd.encode(encoding) + CRLF)
+        await self.writer.drain()
+        return await self.getreply()
+
+    async def ehlo(self):
+        code, msg = await self.command('EHLO localhost')
+        if code != 250:
+            code, msg = await self.command('HELO localhost')
+            if code != 250:
+                raise smtplib.SMTPHeloError(code, msg)
+            return
+
+        self.esmtp_features = {}
+        # first line is the greeting, the others are extensions
+        for line in msg.decode('latin-1').split('\n')[1:]:
+            m = re.match(r'(?P<feature>[A-Za-z0-9][A-Za-z0-9\-]*) ?(?P<params>.*)', line)
+            if m:
+                self.esmtp_features[m.group('feature').lower()] = m.group('params').strip()
+
+    def has_extn(self, name: str) -> bool:
+        return name.lower() in self.esmtp_features
+
+    async def login(self, user: str, password: str):
+        if not self.has_extn('auth'):
+            raise smtplib.SMTPNotSupportedError("SMTP AUTH extension not supported by server.")
+        mechanisms = self.esmtp_features['auth'].upper().split()
+
+        if 'PLAIN' in mechanisms or 'LOGIN' not in mechanisms:
+            token = base64.b64encode(f"\0{user}\0{password}".encode()).decode('ascii')
+            code, msg = await self.command(f'AUTH PLAIN {token}')
+        else:
+            code, msg = await self.command('AUTH LOGIN')
+            if code == 334:
+                code, msg = await self.command(base64.b64encode(user.encode()).decode('ascii'))
+            if code == 334:
+                code, msg = await self.command(base64.b64encode(password.encode()).decode('ascii'))
+
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, msg)
+
+    async def rset(self):
+        try:
+            await self.command('RSET')
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    async def _abort(self, code: int):
+        if code == 421:
+            self.close()
+        else:
+            await self.rset()
+
+    # same semantics as smtplib.SMTP.sendmail: returns the refused recipients, raises if all of them were refused
+    # with the SMTPUTF8 option, addresses are sent as UTF-8
+    async def sendmail(self, from_addr: str, to_addrs: list[str], data: bytes, mail_options: Sequence[str] = ()) -> dict[str, Reply]:
+        options = ''.join(' ' + option for option in mail_options)
+        commands = [f'MAIL FROM:<{from_addr}>{options}'] + [f'RCPT TO:<{addr}>' for addr in to_addrs]
+        encoding = 'utf-8' if any(option.upper() == 'SMTPUTF8' for option in mail_options) else 'ascii'
+
+        replies: list[Reply] = []
+        if self.has_extn('pipelining'):
+            self._write(b''.join(cmd.encode(encoding) + CRLF for cmd in commands))
+            await self.writer.drain()
+            for _ in commands:
+                replies.append(await self.getreply())
+        else:
+            for cmd in commands:
+                replies.append(await self.command(cmd, encoding))
+                if replies[0][0] != 250:
+                    break
+
+        code, msg = replies[0]
+        if code != 250:
+            await self._abort(code)
+            raise smtplib.SMTPSenderRefused(code, msg, from_addr)
+
+        refused: dict[str, Reply] = {}
+        for addr, (code, msg) in zip(to_addrs, replies[1:]):
+            if code not in (250, 251):
+                refused[addr] = (code, msg)
+        if len(refused) == len(to_addrs):
+            await self._abort(next(iter(refused.values()))[0])
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        code, msg = await self.command('DATA')
+        if code != 354:
+            await self._abort(code)
+            raise smtplib.SMTPDataError(code, msg)
+
+        data = re.sub(br'(?:\r\n|\n|\r(?!\n))', CRLF, data)
+        data = re.sub(br'(?m)^\.', b'..', data)
+        if not data.endswith(CRLF):
+            data += CRLF
+        self._write(data + b'.' + CRLF)
+        await self.writer.drain()
+        code, msg = await self.getreply()
+        if code != 250:
+            await self._abort(code)
+            raise smtplib.SMTPDataError(code, msg)
+        return refused
+
+    async def noop(self) -> Reply:
+        return await self.command('NOOP')
+
+    async def quit(self):
+        try:
+            await self.command('QUIT')
+        except smtplib.SMTPServerDisconnected:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.connected:
+            self.connected = False
+            self.writer.close()
@@ -0,0 +1,160 @@
+from __future__ import annotations
+import re
+import time
+import base64
+import hashlib
+import logging
+from collections.abc import Sequence
+from functools import lru_cache
+from pathlib import PurePath
+from threading import Lock
+from typing import Any
+
+
+log = logging.getLogger()
+
+# the headers that are signed if the message has them
+DEFAULT_HEADERS = (
+    'From', 'Reply-To', 'Subject', 'Date', 'To', 'Cc', 'Message-ID', 'In-Reply-To', 'References',
+    'MIME-Version', 'Content-Type', 'Content-Transfer-Encoding', 'List-Unsubscribe', 'List-Unsubscribe-Post',
+)
+
+_WSP = re.compile(rb'[ \t]+')
+_TRAILING_WSP = re.compile(rb'[ \t]+(?=\r\n|$)')
+_FOLD = re.compile(rb'\r\n(?=[ \t])')
+
+
+# relaxed canonicalization of a header field (RFC 6376, 3.4.2), given as it appears in the message, with CRLF
+# static headers (e.g. the subject and content type of a template) recur in every message, so their canonical form is cached
+@lru_cache(maxsize=4096)
+def canonicalize_header(field: bytes) -> bytes:
+    name, _, value = field.partition(b':')
+    value = _WSP.sub(b' ', _FOLD.sub(b'', value)).strip(b' \r\n')
+    return name.strip(b' \t').lower() + b':' + value + b'\r\n'
+
+
+# relaxed canonicalization of a message body (RFC 6376, 3.4.4)
+def canonicalize_body(body: bytes) -> bytes:
+    body = _TRAILING_WSP.sub(b'', _WSP.sub(b' ', body))
+    body = body.rstrip(b'\r\n')
+    return body + b'\r\n' if body else b''
+
+
+# splits the header section into fields, including their folded continuation lines
+def split_headers(head: bytes) -> list[bytes]:
+    fields: list[bytes] = []
+    for line in head.split(b'\r\n'):
+        if line[:1] in (b' ', b'\t') and fields:
+            fields[-1] += b'\r\n' + line
+        elif line:
+            fields.append(line)
+    return fields
+
+
+def _load_key(pem: bytes, password: bytes | None) -> Any:
+    try:
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+    except ImportError:
+        raise ImportError("DKIM signing needs the 'cryptography' package (pip install bulk-mailer[dkim])") from None
+    return load_pem_private_key(pem, password)
+
+
+
+"""
+Adds a DKIM-Signature header (RFC 6376) to serialized messages, with relaxed/relaxed canonicalization and SHA-256.
+key is a PEM-encoded RSA or Ed25519 private key, or the path of a file holding one; it is parsed once, when the first message is signed.
+Of `headers`, those present in a message are signed. identity is the i= tag (the signing user or agent), if given.
+
+Needs the optional dependency cryptography. The signer can be pickled (without its parsed key), e.g. for the workers of a Campaign.
+"""
+
+class DkimSigner:
+    def __init__(self,
+                 domain: str,
+                 selector: str,
+                 key: bytes | str | PurePath,
+                 headers: Sequence[str] = DEFAULT_HEADERS,
+                 identity: str | None = None,
+                 password: bytes | None = None
+                 ) -> None:
+        if isinstance(key, bytes):
+            self.pem = key
+        else:
+            with open(key, 'rb') as f:
+                self.pem = f.read()
+        self.domain = domain
+        self.selector = selector
+        self.headers = [name.lower() for name in headers]
+        self.identity = identity
+        self.password = password
+        self._key: Any = None
+        self._algorithm = ''
+        self._lock = Lock()
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state['_key'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict[str, Any]):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    @property
+    def key(self) -> Any:
+        if self._key is None:
+            with self._lock:
+                if self._key is None:
+                    key = _load_key(self.pem, self.password)
+                    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+                    if isinstance(key, rsa.RSAPrivateKey):
+                        self._algorithm = 'rsa-sha256'
+                    elif isinstance(key, ed25519.Ed25519PrivateKey):
+                        self._algorithm = 'ed25519-sha256'
+                    else:
+                        raise ValueError('DKIM keys must be RSA or Ed25519 keys')
+                    self._key = key
+        return self._key
+
+    def _sign(self, key: Any, data: bytes) -> bytes:
+        if self._algorithm == 'ed25519-sha256':
+            # RFC 8463: Ed25519 signs the SHA-256 hash of the data
+            return key.sign(hashlib.sha256(data).digest())
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+        return key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+    # returns the DKIM-Signature header field for a message in wire format (CRLF line endings), ending with CRLF
+    def signature(self, data: bytes) -> bytes:
+        key = self.key
+        head, sep, body = data.partition(b'\r\n\r\n')
+        if not sep:
+            head, body = data, b''
+        body_hash = base64.b64encode(hashlib.sha256(canonicalize_body(body)).digest()).decode()
+
+        fields: dict[str, list[bytes]] = {}
+        for field in split_headers(head):
+            fields.setdefault(field.partition(b':')[0].strip().lower().decode('ascii', 'replace'), []).append(field)
+        # of a header that occurs several times, the last one is signed first (RFC 6376, 5.4.2)
+        signed: list[str] = []
+        hashed: list[bytes] = []
+        for name in self.headers:
+            for field in reversed(fields.get(name, ())):
+                signed.append(name)
+                hashed.append(canonicalize_header(field))
+
+        tags = [f'v=1; a={self._algorithm}; c=relaxed/relaxed; d={self.domain}; s={self.selector};']
+        if self.identity is not None:
+            tags.append(f' i={self.identity};')
+        tags.append(f' t={int(time.time())};\r\n\th={":".join(signed)};\r\n\tbh={body_hash};\r\n\tb=')
+        header = b'DKIM-Signature: ' + ''.join(tags).encode()
+        # the signature header itself is hashed last, with an empty b= and without its final CRLF; it is unique, so it bypasses the cache
+        hashed.append(canonicalize_header.__wrapped__(header)[:-2])
+
+        b = base64.b64encode(self._sign(key, b''.join(hashed)))
+        return header + b'\r\n\t'.join(b[i:i + 72] for i in range(0, len(b), 72)) + b'\r\n'
+
+    # returns the message with the signature prepended
+    def sign(self, data: bytes) -> bytes:
+        return self.signature(data) + data
@@ -1,7 +1,7 @@
-from email.message import EmailMessage
 from collections.abc import Collection
 from bulk_mailer.entities import Emailable
 from itertools import chain
+from .types import Message
 
 
 """
@@ -11,10 +11,11 @@ It can be used if sending the e-mail should be done at a later point in time.
 
 class Envelope:
     def __init__(self, 
-                 msg: EmailMessage,
+                 msg: Message,
                  to: Emailable | Collection[Emailable],
                  cc: Emailable | Collection[Emailable] | None = None,
-                 bcc: Emailable | Collection[Emailable] | None = None
+                 bcc: Emailable | Collection[Emailable] | None = None,
+                 key: str | None = None
                  ) -> None:
         
         if cc is None:
@@ -29,10 +30,12 @@ class Envelope:
         if isinstance(bcc, Emailable):
             bcc = [bcc]
 
-        self.msg: EmailMessage = msg
+        self.msg: Message = msg
         self.to: Collection[Emailable] = to
         self.cc: Collection[Emailable] = cc
         self.bcc: Collection[Emailable] = bcc
+        # stable ID, used by the journal to recognize the envelope after a restart
+        self.key = key
     
     @property
     def all_recipients(self):
@@ -0,0 +1,118 @@
+from __future__ import annotations
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from pathlib import PurePath
+from threading import Lock
+from typing import Any, IO
+from .envelope import Envelope
+from .types import SendErrs
+from bulk_mailer.entities import Emailable
+from collections.abc import Iterable
+
+
+log = logging.getLogger()
+
+_SUBJECT = re.compile(rb'^Subject:[ \t]*(.*?)\r?$', re.MULTILINE | re.IGNORECASE)
+
+
+# stable ID of an envelope across runs: the explicit key, or a hash of subject and recipient addresses
+def envelope_key(env: Envelope) -> str:
+    if env.key is not None:
+        return env.key
+
+    if isinstance(env.msg, bytes):
+        head = env.msg.split(b'\r\n\r\n', 1)[0]
+        m = _SUBJECT.search(head)
+        subject = m.group(1).decode('ascii', 'replace') if m else ''
+    else:
+        subject = str(env.msg.get("Subject", ''))
+
+    addrs = sorted({r.key for r in env.all_recipients})
+    return hashlib.sha1('\n'.join([subject, *addrs]).encode()).hexdigest()
+
+
+
+"""
+An append-only record of send outcomes, one JSON line per envelope.
+Opening an existing journal loads which recipients were already delivered, so that an interrupted campaign can be resumed.
+
+Every record is handed to the OS immediately, so it survives the process dying.
+fsync (which protects against OS crashes and power loss) is batched: at most every `sync_every` records or `sync_interval` seconds.
+"""
+
+class Journal:
+    file: IO[str]
+
+    def __init__(self, path: str | PurePath, sync_every: int = 256, sync_interval: float = 1.0) -> None:
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.delivered: dict[str, set[str]] = {}
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = Lock()
+
+        if os.path.exists(path):
+            self._load()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def _load(self):
+        # the last line may be incomplete if the process died while writing it; it is cut off, so that new records start on a line of their own
+        complete = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                complete += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get('ok'):
+                    self.delivered.setdefault(record['key'], set()).update(record['ok'])
+        if complete < os.path.getsize(self.path):
+            log.warning(f"Journal {self.path} ends with an incomplete record, which is discarded")
+            with open(self.path, 'r+b') as f:
+                f.truncate(complete)
+        log.debug(f"Journal loaded: {sum(len(a) for a in self.delivered.values())} delivered recipients")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
+
+    def delivered_addrs(self, key: str) -> set[str]:
+        return self.delivered.get(key, set())
+
+    # records the recipients that were sent to in one attempt
+    def record(self, key: str, succeeded: Iterable[Emailable], failed: SendErrs):
+        ok = sorted({r.key for r in succeeded})
+        record: dict[str, Any] = {'key': key, 'ok': ok}
+        if failed:
+            record['failed'] = {r.key: code for r, (code, _) in failed.items()}
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+
+        with self._lock:
+            self.delivered.setdefault(key, set()).update(ok)
+            self.file.write(line)
+            self.file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self.file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if not self.file.closed:
+                self.file.flush()
+                self._sync()
+                self.file.close()
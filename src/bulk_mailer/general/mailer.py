@@ -1,15 +1,29 @@
 from __future__ import annotations
 import smtplib, ssl
-from email.message import EmailMessage
-from bulk_mailer.entities import Emailable
-from collections.abc import Collection, Iterable
+from bulk_mailer.entities import Emailable, normalize_address
+from collections.abc import Collection, Iterable, Iterator, Sequence, Sized
 import logging
 from typing import Any, TYPE_CHECKING
 import time
+from pathlib import PurePath
+from threading import Lock
+from queue import Empty
+from copy import copy
 from .envelope import Envelope
+from .pool import BackgroundIterator, ConnectionPool, Connection, SessionPolicy, imap_ordered, prefetch
+from .journal import Journal, envelope_key
+from .retry import RetryPolicy, DeferredQueue, PendingSend
+from .ratelimit import RateLimiter
+from .relays import Relay, RelayBalancer
+from .suppression import SuppressionList
+from .sinks import LogSampler, ResultSink, ResultSummary
+from .scheduler import DomainScheduler
+from .transports import Transport, read_spool
+from .dkim import DkimSigner
+from .metrics import Metrics, ProgressReporter
 from .result import SendResult
-from .types import SendErrs, SendSuccs
-from bulk_mailer.utils import ask_mail_confirmation
+from .types import SendErrs, SendSuccs, Reply, Message
+from bulk_mailer.utils import ask_mail_confirmation, encode_header, message_to_bytes
 
 
 log = logging.getLogger()
@@ -42,150 +56,644 @@ class IncompleteLoginError(Exception):
 
 
 
+def connect(config: SMTP_CONFIG) -> smtplib.SMTP:
+    if config.username is not None and config.password is None:
+        raise IncompleteLoginError("User provided but password missing")
+    if config.password is not None and config.username is None:
+        raise IncompleteLoginError("Password provided but user missing")
+
+    server: smtplib.SMTP
+    if config.ssl:
+        log.debug("Connecting to SMTP server securely (SSL on)")
+        context = ssl.create_default_context()
+        server = smtplib.SMTP_SSL(config.address, config.port, context=context)
+    else:
+        log.debug("Connecting to SMTP server insecurely (SSL off)")
+        server = smtplib.SMTP(config.address, config.port)
+
+    if config.username is not None and config.password is not None:
+        log.debug(f"Logging in: '{config.username}'@{config.address}:{config.port}")
+        server.login(config.username, config.password)
+    else:
+        log.debug("Skipping login")
+    return server
+
+
+
+# the reply with which a message is refused locally if it cannot be built, e.g. because a header value contains CR or LF
+def invalid_message_reply(e: ValueError) -> Reply:
+    return (554, b'5.6.0 Invalid message: ' + str(e).encode('utf-8', 'replace'))
+
+
+# non-ASCII addresses need SMTPUTF8, like smtplib.SMTP.send_message does it
+def is_international(from_addr: str, to_addrs: Iterable[str]) -> bool:
+    return not ''.join([from_addr, *to_addrs]).isascii()
+
+
+
+"""
+An envelope that is ready for the wire: the message is serialized, with the address headers of sender and recipients.
+The message of the envelope itself is not modified, so the same message can be sent any number of times.
+international messages have non-ASCII addresses; they are serialized as UTF-8 and need a server that supports SMTPUTF8.
+A message that cannot be serialized (e.g. with a header value containing CR or LF) has an error instead of data, and is not sent.
+"""
+
+class PreparedMail:
+    __slots__ = ('env', 'from_addr', 'to_people', 'to_addrs', 'data', 'international', 'error')
+
+    def __init__(self, env: Envelope, from_addr: str, to_people: list[Emailable], data: bytes, international: bool = False, error: Reply | None = None) -> None:
+        self.env = env
+        self.from_addr = from_addr
+        self.to_people = to_people
+        self.to_addrs = [r.email_address for r in to_people]
+        self.data = data
+        self.international = international
+        self.error = error
+
+
+# the message in wire format without the given headers, which prepare_mail sets instead; serialized messages are returned as they are
+def serialize_message(msg: Message, replace: Iterable[str] = ("From", "To"), utf8: bool = False) -> bytes:
+    if isinstance(msg, bytes):
+        return msg
+    # deleting from the copy leaves the header list of the original untouched
+    msg = copy(msg)
+    for name in replace:
+        del msg[name]
+    return message_to_bytes(msg, utf8=utf8)
+
+
+def prepare_mail(env: Envelope, sender: Emailable) -> PreparedMail:
+    # without visible recipients (e.g. only Bcc), the To header is an empty group, as usual for undisclosed recipients
+    headers = [("From", sender.email_header_name), ("To", COMMASPACE.join(r.email_header_name for r in env.to) or "undisclosed-recipients:;")]
+    if env.cc:
+        headers.append(("Cc", COMMASPACE.join(r.email_header_name for r in env.cc)))
+
+    from_addr = sender.email_address
+    # ensure that every address is addressed at most once (i.e. remove duplicates), but preserve order
+    # recipients compare by normalized address, so the same address in e.g. To and Bcc is sent to only once
+    to_people = list(dict.fromkeys(env.all_recipients))
+    international = is_international(from_addr, (r.email_address for r in to_people))
+
+    # the headers replace those of the message
+    msg = serialize_message(env.msg, [name for name, _ in headers], utf8=international)
+    data = b''.join(encode_header(name, value, utf8=international) for name, value in headers) + msg
+    return PreparedMail(env, from_addr, to_people, data, international)
+
+
+# converts the addresses refused by the server to people
+def map_failed(to_people: list[Emailable], failed_addrs: dict[str, Reply]) -> tuple[SendSuccs, SendErrs]:
+    failed: SendErrs = dict()
+    if failed_addrs:
+        index = {p.key: p for p in to_people}
+        for addr, error in failed_addrs.items():
+            person = index.get(normalize_address(addr))
+            if person is not None:
+                failed[person] = error
+
+    succeeded: SendSuccs = set(to_people)
+    succeeded.difference_update(failed)
+    return succeeded, failed
+
+
+# with a sampler, only as many records are logged as it allows
+# unless final, transiently refused recipients are sent to again later, so they are logged as deferred, not as rejected;
+# the retry loop warns about the deferral itself
+def log_send_result(succeeded: SendSuccs, failed: SendErrs, to_people: list[Emailable], detailed_log: bool, sampler: LogSampler | None = None, final: bool = True):
+    log = logging.getLogger('send_mail')
+
+    def emit(level: int, msg: str):
+        if log.isEnabledFor(level) and (sampler is None or sampler.allow()):
+            log.log(level, msg)
+
+    deferred = {} if final else {r: e for r, e in failed.items() if RetryPolicy.is_transient(e)}
+
+    if not failed:
+        emit(logging.INFO, f"E-mail sent: accepted for every recipient")
+    elif len(deferred) == len(failed) and not succeeded:
+        emit(logging.INFO, f"E-mail deferred: temporarily refused for every recipient")
+    elif not succeeded and not deferred:
+        emit(logging.ERROR, f"E-mail sent: rejected for every recipient")
+    elif deferred:
+        emit(logging.WARNING, f"E-mail sent: accepted by {len(succeeded)} of {len(to_people)} recipients, deferred for {len(deferred)}")
+    else:
+        emit(logging.WARNING, f"E-mail sent: accepted by {len(succeeded)} of {len(to_people)} recipients")
+
+    if detailed_log or log.isEnabledFor(logging.DEBUG):
+        for recipient in succeeded:
+            emit(logging.INFO, f"   ACCEPTED:  {recipient}")
+        for recipient, error in failed.items():
+            if recipient in deferred:
+                emit(logging.WARNING, f"   DEFERRED:  {recipient} (code {error[0]}): {error[1].decode()}")
+            else:
+                emit(logging.ERROR, f"   REJECTED:  {recipient} (code {error[0]}): {error[1].decode()}")
+
+
+
 # works with 'with' statement
 
 class Mailer:
     sender: Emailable
     confirm_send: bool
-    server: smtplib.SMTP
-    last_send: float = 0
+    relays: list[Relay]
     delay_secs: float
-
-    def __init__(self, config: SMTP_CONFIG, sender: Emailable, confirm_send:bool=False, delay_secs:float=0, detailed_log:bool=True) -> None:
+    rate_limit: RateLimiter | None
+    metrics: Metrics
+
+    # connections > 1 opens a pool of connections and sends queued e-mails from that many threads
+    # with a retry policy, dropped connections are re-established and transient (4xx) failures are retried later
+    # rate_limit replaces the fixed delay_secs between sends
+    # max_recipients splits e-mails with more recipients into several transactions; it is lowered when the server answers 452 (too many recipients)
+    # the time spent per phase and the send counters are recorded in metrics (a new Metrics object if none is given)
+    # lookahead > 0 prepares (serializes) up to that many queued e-mails ahead, from `serializers` threads, while others are being sent
+    # instead of a single config, a list of relays can be given to balance the load across them and fail over between them;
+    # connections then is given per relay, and rate_limit applies to all relays together
+    # recipients on the suppression list are not sent to, and recipients that are permanently refused are added to it
+    # at most log_limit send results are logged per minute (None for no limit); the summary of a queue is always logged
+    # a scheduler reorders queued e-mails by recipient domain, with per-domain limits
+    # instead of over SMTP, e-mails can be handed to a transport, e.g. written to files or discarded for a dry run
+    # with a DKIM signer, every e-mail is signed when it is prepared, so with lookahead signing runs in the serializer threads
+    # the session policy decides when SMTP sessions are opened, kept alive and renewed (by default, lazily on first use, see SessionPolicy)
+    def __init__(self, config: SMTP_CONFIG | Sequence[Relay] | Transport, sender: Emailable, confirm_send:bool=False, delay_secs:float=0, detailed_log:bool=True, connections:int=1, retry:RetryPolicy|None=None, rate_limit:RateLimiter|None=None, max_recipients:int|None=None, metrics:Metrics|None=None, lookahead:int=0, serializers:int=1, suppression:SuppressionList|None=None, log_limit:int|None=100, scheduler:DomainScheduler|None=None, dkim:DkimSigner|None=None, session:SessionPolicy|None=None) -> None:
         self.sender = sender
         self.confirm_send = confirm_send
         self.delay_secs = delay_secs
         self.detailed_log = detailed_log
-
-        if config.ssl:
-            log.debug("Connecting to SMTP server securely (SSL on)")
-            context = ssl.create_default_context()
-            self.server = smtplib.SMTP_SSL(config.address, config.port, context=context)
-        else:
-            log.debug("Connecting to SMTP server insecurely (SSL off)")
-            self.server = smtplib.SMTP(config.address, config.port)
-
-        if config.username is not None and config.password is None:
-            raise IncompleteLoginError("User provided but password missing")
-        if config.password is not None and config.username is None:
-            raise IncompleteLoginError("Password provided but user missing")
-        if config.username is not None and config.password is not None:
-            log.debug(f"Logging in: '{config.username}'@{config.address}:{config.port}")
-            self.server.login(config.username, config.password)
+        self.retry = retry
+        self.max_recipients = max_recipients
+        self.lookahead = lookahead
+        self.serializers = serializers
+        self.suppression = suppression
+        self.log_sampler = LogSampler(log_limit) if log_limit is not None else None
+        self.scheduler = scheduler
+        self.dkim = dkim
+        self.session = session if session is not None else SessionPolicy()
+        if rate_limit is None and delay_secs > 0:
+            rate_limit = RateLimiter.fixed_delay(delay_secs)
+        self.rate_limit = rate_limit
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._confirm_lock = Lock()
+
+        self.transport: Transport | None = None
+        self.relays = []
+        if isinstance(config, Transport):
+            self.transport = config
         else:
-            log.debug("Skipping login")
+            self._open_relays([Relay(config, connections=connections)] if isinstance(config, SMTP_CONFIG) else list(config))
+
+    def _open_relays(self, relays: list[Relay]):
+        self.relays = relays
+        self.balancer = RelayBalancer(relays)
+        for relay in relays:
+            try:
+                relay.open(connect, self.session)
+            except (smtplib.SMTPException, OSError) as e:
+                # the relay is opened again when it is chosen next; without alternatives, fail right away
+                if len(self.relays) == 1:
+                    raise
+                relay.record_error(0, e)
+        if all(relay.pool is None for relay in self.relays):
+            raise ConnectionError("Could not connect to any relay")
+
+    # the connections of the first connected relay
+    @property
+    def pool(self) -> ConnectionPool:
+        pool = next((relay.pool for relay in self.relays if relay.pool is not None), None)
+        if pool is None:
+            raise RuntimeError("Mailer is not connected to an SMTP server")
+        return pool
+
+    # the session of the first connection, which is established if it is not yet
+    @property
+    def server(self) -> smtplib.SMTP:
+        conn = self.pool.connections[0]
+        conn.open()
+        return conn.server
+
+    # number of e-mails that are sent at once
+    @property
+    def workers(self) -> int:
+        if self.transport is not None:
+            return self.transport.workers
+        return sum(relay.connections for relay in self.relays)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type: Any, exc_value: Any, tb: Any):
-        log.debug("Disconnecting from SMTP server")
-        self.server.__exit__(exc_type, exc_value, tb)
+        self.quit()
     
     def quit(self):
-        log.debug("Disconnecting from SMTP server")
-        self.server.quit()
+        if self.transport is not None:
+            self.transport.close()
+        if self.relays:
+            log.debug("Disconnecting from SMTP server")
+        for relay in self.relays:
+            relay.quit()
+
+    def relay_stats(self) -> dict[str, dict[str, Any]]:
+        return {relay.name: relay.stats.as_dict() for relay in self.relays}
+
+    def log_relay_stats(self):
+        for relay in self.relays:
+            s = relay.stats
+            log.info(f"Relay {relay.name}: {s.messages} e-mails, {s.accepted} accepted, {s.rejected} rejected, {s.errors} errors, {s.failovers} failed over, {s.throughput:.1f} e-mails/s")
 
-    def wait(self):
-        wait_for_secs = self.delay_secs - (time.monotonic() - self.last_send)
-        if wait_for_secs > 0:
-            log.debug(f"Waiting for {round(wait_for_secs, 2)} seconds")
-            time.sleep(wait_for_secs)
+    # reserves the next send slot; the limits apply across all connections of the pool
+    def wait(self, recipients: int = 1, size: int = 0):
+        if self.rate_limit is not None:
+            with self.metrics.phase('wait'):
+                self.rate_limit.wait(recipients, size)
 
 
-    # returns tuple (succeeded, failed)
+    # returns tuple (succeeded, failed); suppressed recipients are in neither
     def send_mail(self,
-             msg: EmailMessage,
+             msg: Message,
              to: Emailable | Collection[Emailable],
              cc: Emailable | Collection[Emailable] | None = None,
              bcc: Emailable | Collection[Emailable] | None = None,
-             confirm: bool | None = None
+             confirm: bool | None = None,
+             skip_addrs: Collection[str] = ()
              ) -> tuple[SendSuccs, SendErrs]:
-        
+        env = Envelope(msg, to, cc, bcc)
+        suppressed = {p.key for p in self._suppressed(env)}
+        succeeded, failed = self.send_prepared(self.prepare(env), confirm, skip_addrs, suppressed)
+        if self.suppression is not None and failed:
+            self.suppression.add_bounces(failed)
+        return succeeded, failed
+
+    # an invalid message is refused for every recipient when it is sent, instead of aborting the queue
+    def prepare(self, env: Envelope) -> PreparedMail:
+        with self.metrics.phase('build'):
+            try:
+                mail = prepare_mail(env, self.sender)
+            except ValueError as e:
+                log.error(f"E-mail not sent: {e}")
+                to_people = list(dict.fromkeys(env.all_recipients))
+                return PreparedMail(env, self.sender.email_address, to_people, b'', error=invalid_message_reply(e))
+        if self.dkim is not None:
+            with self.metrics.phase('sign'):
+                mail.data = self.dkim.sign(mail.data)
+        return mail
+
+    # suppressed recipients (normalized addresses) are left out of the transaction and of the result
+    # final is false for an attempt that is retried if it fails transiently (see log_send_result)
+    def send_prepared(self, mail: PreparedMail, confirm: bool | None = None, skip_addrs: Collection[str] = (), suppressed: Collection[str] = (), final: bool = True) -> tuple[SendSuccs, SendErrs]:
         log = logging.getLogger('send_mail')
 
-        env = Envelope(msg, to, cc, bcc)
-        del to, cc, bcc
-    
         if confirm is None:
             confirm = self.confirm_send
-
-        msg["From"] = self.sender.email_header_name
-        msg["To"] = COMMASPACE.join(r.email_header_name for r in env.to)
-        if env.cc:
-            msg["Cc"] = COMMASPACE.join(r.email_header_name for r in env.cc)
-
-        from_addr = self.sender.email_address
-        # ensure that every person is addressed at most once (i.e. remove duplicates), but preserve order
-        to_people = list(dict.fromkeys(r for r in env.all_recipients))
-
-        # disallow sending to same address multiple times
-        # when same recipient is specified multiple times, email gets also send multiple times, but there will be max. 1 error entry
-        # if e.g. the address was accepted the first time but rejected the second time, we cannot know if the address got the email 0 or 1 time.
-        to_addrs = list({r.email_address for r in to_people})
+        metrics = self.metrics
+        to_people, to_addrs = mail.to_people, mail.to_addrs
+
+        if suppressed:
+            to_people = [p for p in to_people if p.key not in suppressed]
+            to_addrs = [p.email_address for p in to_people]
+            if not to_addrs:
+                log.info(f"E-mail skipped: every recipient is suppressed")
+                return set(), dict()
+
+        # recipients in skip_addrs (normalized addresses) are not sent to again, but counted as succeeded
+        skipped: SendSuccs = set()
+        if skip_addrs:
+            skipped = {p for p in to_people if p.key in skip_addrs}
+            to_people = [p for p in to_people if p.key not in skip_addrs]
+            to_addrs = [p.email_address for p in to_people]
+            metrics.add('skipped', len(skipped))
+            if not to_addrs:
+                log.info(f"E-mail skipped: already sent to every recipient")
+                return skipped, dict()
+
+        # the message could not be prepared (see prepare), which was logged already
+        if mail.error is not None:
+            metrics.add('rejected', len(to_people))
+            return skipped, {p: mail.error for p in to_people}
 
         if confirm:
-            log.debug("Awaiting e-mail confirmation")
-            if not ask_mail_confirmation(env, "Send", "Cancel"):
-                log.debug(f"E-mail cancelled")
-                raise SendCancelled()
-
-        self.wait()
-
+            # only one confirmation prompt at a time, even when sending from multiple threads
+            # the preview shows the message as it is sent
+            env = mail.env
+            with self._confirm_lock, metrics.phase('confirm'):
+                log.debug("Awaiting e-mail confirmation")
+                if not ask_mail_confirmation(Envelope(mail.data, env.to, env.cc, env.bcc), "Send", "Cancel"):
+                    log.debug(f"E-mail cancelled")
+                    metrics.add('cancelled')
+                    raise SendCancelled()
+
+        self.wait(len(to_addrs), len(mail.data))
+        failed_addrs = self._deliver(mail, to_addrs)
+
+        with metrics.phase('results'):
+            if self.rate_limit is not None:
+                self.rate_limit.feedback(code for code, _ in failed_addrs.values())
+            succeeded, failed = map_failed(to_people, failed_addrs)
+            log_send_result(succeeded, failed, to_people, self.detailed_log, self.log_sampler, final)
+        metrics.add('accepted', len(succeeded))
+        metrics.add('rejected', len(failed))
+
+        return succeeded | skipped, failed
+
+
+    # sends through one of the relays, failing over to the others if it fails; returns the refused addresses
+    def _deliver(self, mail: PreparedMail, to_addrs: list[str]) -> dict[str, Reply]:
+        if self.transport is not None:
+            with self.metrics.phase('transaction'):
+                failed = self.transport.send(mail.data, mail.from_addr, to_addrs, mail.env.key)
+            if len(failed) < len(to_addrs):
+                self.metrics.add('messages')
+                self.metrics.add('bytes_sent', len(mail.data))
+            return failed
+
+        tried: list[Relay] = []
+        while True:
+            relay = self.balancer.choose(tried)
+            assert relay is not None
+            tried.append(relay)
+            alternatives = len(tried) < len(self.relays)
+
+            if relay.rate_limit is not None:
+                with self.metrics.phase('wait'):
+                    relay.rate_limit.wait(len(to_addrs), len(mail.data))
+            start = time.perf_counter()
+            try:
+                with self.metrics.phase('transaction'):
+                    relay.open(connect, self.session)
+                    failed = self._transmit_batched(relay, mail.data, mail.from_addr, to_addrs, mail.international)
+            except (smtplib.SMTPException, OSError) as e:
+                # a message that is too large for the relay says nothing about whether the relay works
+                if not (isinstance(e, smtplib.SMTPSenderRefused) and e.smtp_code == 552):
+                    relay.record_error(time.perf_counter() - start, e)
+                if not alternatives:
+                    raise
+                relay.stats.failovers += 1
+                continue
+            secs = time.perf_counter() - start
+
+            if relay.rate_limit is not None:
+                relay.rate_limit.feedback(code for code, _ in failed.values())
+            # temporarily refused as a whole, e.g. the relay is unavailable or throttles: try the next one
+            if alternatives and len(failed) == len(to_addrs) and all(RetryPolicy.is_transient(reply) for reply in failed.values()):
+                code, msg = next(iter(failed.values()))
+                relay.record_error(secs, f"{code} {msg.decode(errors='replace')}")
+                relay.stats.failovers += 1
+                continue
+
+            relay.record(secs, len(to_addrs) - len(failed), len(failed))
+            return failed
+
+    # sends the message in transactions of at most max_recipients recipients over one session
+    # returns the refused addresses of all transactions
+    # international e-mails are sent with SMTPUTF8, or refused for every recipient if the server does not support it
+    def _transmit_batched(self, relay: Relay, msg: bytes, from_addr: str, to_addrs: list[str], international: bool = False) -> dict[str, Reply]:
+        assert relay.pool is not None
+        failed: dict[str, Reply] = {}
+        remaining = to_addrs
+        delivered = False
+        with relay.pool.acquire() as conn:
+            # not connected yet, or closed after an earlier failure
+            if conn.open():
+                self.metrics.add('reconnects')
+            max_size = conn.max_size if self.session.check_size else None
+            if max_size is not None and len(msg) > max_size:
+                # refused like by the server, but without uploading it; the other e-mails are sent on
+                log.error(f"E-mail of {len(msg)} bytes not sent: the server accepts at most {max_size} bytes")
+                return {addr: (552, b'5.3.4 Message exceeds server SIZE limit') for addr in to_addrs}
+            if international:
+                if 'smtputf8' not in conn.features:
+                    log.error(f"E-mail not sent: it has non-ASCII addresses, but the server does not support SMTPUTF8")
+                    return {addr: (553, b'5.6.7 Server does not support SMTPUTF8, needed for non-ASCII addresses') for addr in to_addrs}
+                mail_options = ['SMTPUTF8', 'BODY=8BITMIME']
+            else:
+                mail_options = ['BODY=8BITMIME'] if conn.eight_bit_mime and not msg.isascii() else []
+
+            while remaining:
+                limit = self.max_recipients or len(remaining)
+                batch, remaining = remaining[:limit], remaining[limit:]
+                try:
+                    if conn.expired(len(msg)):
+                        conn.rotate()
+                        self.metrics.add('rotations')
+                    refused = self._transmit(conn, msg, from_addr, batch, mail_options)
+                except (smtplib.SMTPException, OSError) as e:
+                    if not delivered:
+                        if not isinstance(e, smtplib.SMTPResponseException):
+                            # the session is lost or in an unknown state; it is re-established when the connection is used next
+                            conn.close()
+                        raise
+                    # earlier transactions went through, so the e-mail must not be sent again as a whole; the rest is retried later
+                    log.error(f"Sending failed after {len(to_addrs) - len(batch) - len(remaining)} recipients: {e}")
+                    failed.update((addr, (421, str(e).encode())) for addr in batch + remaining)
+                    break
+                accepted = len(batch) - len(refused)
+                if accepted > 0:
+                    delivered = True
+                    conn.sent(len(msg))
+                    self.metrics.add('messages')
+                    self.metrics.add('bytes_sent', len(msg))
+
+                # 452 for some recipients while others were accepted: the server limits the recipients per transaction
+                too_many = [addr for addr, (code, _) in refused.items() if code == 452]
+                if too_many and accepted > 0:
+                    if self.max_recipients is None or accepted < self.max_recipients:
+                        log.info(f"Server accepts at most {accepted} recipients per transaction")
+                        self.max_recipients = accepted
+                    for addr in too_many:
+                        del refused[addr]
+                    remaining = too_many + remaining
+
+                failed.update(refused)
+        return failed
+
+    # returns the refused addresses
+    def _transmit(self, conn: Connection, msg: bytes, from_addr: str, to_addrs: list[str], mail_options: Sequence[str] = ()) -> dict[str, Reply]:
+        reconnects = 0
+        while True:
+            try:
+                log.debug("Sending e-mail")
+                return conn.server.sendmail(from_addr, to_addrs, msg, mail_options)
+            except smtplib.SMTPRecipientsRefused as e:
+                return e.recipients
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                if self.retry is None or reconnects >= self.retry.reconnects:
+                    raise
+                reconnects += 1
+                log.warning(f"Connection lost ({e}), reconnecting")
+                try:
+                    conn.reconnect()
+                    self.metrics.add('reconnects')
+                except OSError as e:
+                    # the server is unreachable for now; retry the recipients later
+                    log.error(f"Reconnecting failed: {e}")
+                    return {addr: (421, str(e).encode()) for addr in to_addrs}
+            except smtplib.SMTPResponseException as e:
+                # sender or message refused: temporary failures apply to every recipient and are retried later
+                if self.retry is None or not self.retry.is_transient((e.smtp_code, e.smtp_error)):
+                    raise
+                if e.smtp_code == 421:
+                    # smtplib closes the connection on 421; it is re-established on the next send
+                    conn.server.close()
+                return {addr: (e.smtp_code, e.smtp_error) for addr in to_addrs}
+
+
+    # with a journal, the outcome is recorded, and with resume, recipients that the journal records as delivered are skipped
+    # recipients in skip_addrs are not sent to either, and are reported as succeeded
+    # suppressed recipients are reported as suppressed only
+    # prepared is the envelope prepared in advance (see send_queue_iter); final is passed on to send_prepared
+    def send_envelope(self, env: Envelope, journal: Journal | None = None, resume: bool = True, skip_addrs: Collection[str] = (), confirm: bool | None = None, prepared: PreparedMail | None = None, final: bool = True) -> SendResult:
+        key = envelope_key(env) if journal is not None else ''
+        delivered = journal.delivered_addrs(key) if journal is not None and resume else set()
+        skip = delivered | set(skip_addrs) if skip_addrs else delivered
+        suppressed = self._suppressed(env)
+
+        cancelled = False
+        succeeded: SendSuccs
+        failed: SendErrs
         try:
-            log.debug("Sending e-mail")
-            self.last_send = time.monotonic()
-            failed_addrs = self.server.send_message(msg, from_addr, to_addrs)
-        except smtplib.SMTPRecipientsRefused as e:
-            failed_addrs = e.recipients
-
-
-        # convert failed_addrs to people
-        failed: SendErrs = dict()
-        for addr, error in failed_addrs.items():
-            people = [p for p in to_people if p.email_address == addr]
-            for person in people:
-                failed[person] = error
-
-        succeeded: SendSuccs = set(to_people) - set(failed)
-
-
-        if not succeeded:
-            log.error(f"E-mail sent: rejected for every recipient")
-        elif failed:
-            log.warning(f"E-mail sent: accepted by {len(succeeded)} of {len(to_people)} recipients")
+            succeeded, failed = self.send_prepared(prepared if prepared is not None else self.prepare(env), confirm, skip, {p.key for p in suppressed}, final)
+        except SendCancelled:
+            cancelled = True
+            succeeded = set()
+            failed = dict()
+        already_sent = {p for p in succeeded if p.key in delivered}
+
+        if journal is not None and not cancelled:
+            sent = [p for p in succeeded if p.key not in skip]
+            if sent or failed:
+                journal.record(key, sent, failed)
+        if self.suppression is not None and failed:
+            self.suppression.add_bounces(failed)
+        return SendResult(env, succeeded, failed, cancelled, already_sent, suppressed)
+
+    # the suppressed recipients are counted in the summary of a queue, so they are only logged as far as the sampler allows
+    def _suppressed(self, env: Envelope) -> SendSuccs:
+        if self.suppression is None:
+            return set()
+        suppressed = {p for p in env.all_recipients if p in self.suppression}
+        if suppressed:
+            self.metrics.add('suppressed', len(suppressed))
+            if log.isEnabledFor(logging.INFO) and (self.log_sampler is None or self.log_sampler.allow()):
+                log.info(f"Not sending to {len(suppressed)} suppressed recipients")
+        return suppressed
+
+    # results are yielded in queue order (or in the order of the scheduler), also when sending over multiple connections
+    # with a retry policy, envelopes with temporarily refused recipients are deferred and yielded once they are finished
+    # with lookahead, up to that many upcoming envelopes are prepared in the background while the current ones are sent
+    def send_queue_iter(self, queue: Iterable[Envelope], journal: Journal | None = None, resume: bool = True) -> Iterable[SendResult]:
+        envelopes: Iterable[Envelope] = self._render(queue)
+        if self.scheduler is not None:
+            envelopes = self.scheduler.schedule(envelopes, self.metrics)
+        return self.send_prepared_iter(self._prepare_ahead(envelopes), journal, resume)
+
+    # sends e-mails that are prepared already, e.g. read from a spool with read_spool, without building them again
+    def send_prepared_iter(self, mails: Iterable[PreparedMail], journal: Journal | None = None, resume: bool = True) -> Iterable[SendResult]:
+        if self.retry is None:
+            return imap_ordered(lambda mail: self._finished(self.send_envelope(mail.env, journal, resume, prepared=mail)), mails, self.workers)
+        return self._send_queue_retrying(mails, journal, resume)
+
+    # tells the scheduler that an envelope has been sent
+    def _finished(self, res: SendResult) -> SendResult:
+        if self.scheduler is not None:
+            self.scheduler.done(res)
+        return res
+
+    # without lookahead, envelopes are prepared just before they are sent, in the sending thread
+    def _prepare_ahead(self, queue: Iterable[Envelope]) -> Iterable[PreparedMail]:
+        if self.lookahead <= 0:
+            return map(self.prepare, queue)
+        return prefetch(imap_ordered(self.prepare, queue, self.serializers), self.lookahead)
+
+    # pulls the envelopes from the queue, recording the time that lazy queues spend building them
+    def _render(self, queue: Iterable[Envelope]) -> Iterator[Envelope]:
+        envelopes = iter(queue)
+        while True:
+            with self.metrics.phase('render'):
+                env = next(envelopes, None)
+            if env is None:
+                return
+            yield env
+
+    def _send_queue_retrying(self, queue: Iterable[PreparedMail], journal: Journal | None, resume: bool) -> Iterator[SendResult]:
+        assert self.retry is not None
+        policy = self.retry
+        deferred: DeferredQueue[PendingSend] = DeferredQueue()
+
+        # without a source, only the deferred envelopes that are due
+        def attempts(source: BackgroundIterator[PreparedMail] | None) -> Iterator[PendingSend]:
+            while source is not None:
+                yield from deferred.pop_due()
+                # a live queue may wait for new e-mails for a long time, in which deferred envelopes become due
+                try:
+                    mail = source.next(deferred.due_in())
+                except Empty:
+                    continue
+                except StopIteration:
+                    break
+                yield PendingSend(mail.env, mail)
+            yield from deferred.pop_due()
+
+        def attempt(p: PendingSend) -> tuple[PendingSend, SendResult]:
+            p.attempts += 1
+            # confirmation is only asked for on the first attempt
+            confirm = None if p.attempts == 1 else False
+            final = p.attempts >= policy.max_attempts
+            return p, self._finished(self.send_envelope(p.env, journal, resume, skip_addrs=p.done, confirm=confirm, prepared=p.prepared, final=final))
+
+        source = BackgroundIterator(queue)
+        try:
+            items = attempts(source)
+            while True:
+                for p, res in imap_ordered(attempt, items, self.workers):
+                    if p.merge(res, policy):
+                        yield p.result()
+                    else:
+                        delay = policy.backoff(p.attempts)
+                        log.warning(f"E-mail deferred: {len(p.pending_recipients())} recipients temporarily refused, retrying in {round(delay)} seconds")
+                        deferred.push(p, delay)
+                        # attempts may be waiting for the queue, without knowing about the new deferred envelope
+                        source.wake()
+                        self.metrics.add('deferred')
+                if not deferred:
+                    break
+                # nothing else left to send
+                with self.metrics.phase('backoff'):
+                    deferred.wait()
+                items = attempts(None)
+        finally:
+            source.close()
+
+
+    # progress is updated with every finished e-mail, and every result is written to the sink
+    # returns the counts of the results
+    def send_queue(self, queue: Iterable[Envelope], journal: Journal | None = None, resume: bool = True, progress: ProgressReporter | None = None, sink: ResultSink | None = None) -> ResultSummary:
+        if isinstance(queue, Sized):
+            log.info(f"Sending {len(queue)} queued e-mails")
         else:
-            log.info(f"E-mail sent: accepted for every recipient")
-
-        if self.detailed_log or log.isEnabledFor(logging.DEBUG):
-            for recipient in succeeded:
-                log.info(f"   ACCEPTED:  {recipient}")
-            for recipient, error in failed.items():
-                log.error(f"   REJECTED:  {recipient} (code {error[0]}): {error[1].decode()}")
-
-        return succeeded, failed
-
-
-    def send_queue_iter(self, queue: Collection[Envelope]) -> Iterable[SendResult]:
-        for env in queue:
-            cancelled = False
-            succeeded: SendSuccs
-            failed: SendErrs
-            try:
-                succeeded, failed = self.send_mail(env.msg, env.to, env.cc, env.bcc)
-            except SendCancelled:
-                cancelled = True
-                succeeded = set()
-                failed = dict()
-            result = SendResult(env, succeeded, failed, cancelled)
-            yield result
-
-
-    def send_queue(self, queue: Collection[Envelope]) -> None:
-        log.info(f"Sending {len(queue)} queued e-mails")
-        for _ in self.send_queue_iter(queue):
-            pass
+            log.info(f"Sending queued e-mails")
+        if progress is not None:
+            progress.start(len(queue) if isinstance(queue, Sized) else None)
+        return self._consume(self.send_queue_iter(queue, journal, resume), progress, sink)
+
+    # sends the messages that a file transport has written to path, as they were built then
+    def send_spool(self, path: str | PurePath, journal: Journal | None = None, resume: bool = True, progress: ProgressReporter | None = None, sink: ResultSink | None = None) -> ResultSummary:
+        log.info(f"Sending spooled e-mails from {path}")
+        if progress is not None:
+            progress.start()
+        return self._consume(self.send_prepared_iter(read_spool(path), journal, resume), progress, sink)
+
+    def _consume(self, results: Iterable[SendResult], progress: ProgressReporter | None, sink: ResultSink | None) -> ResultSummary:
+        summary = ResultSummary()
+        for res in results:
+            summary.add(res)
+            if sink is not None:
+                sink.write(res)
+            if progress is not None:
+                progress.update(failed=bool(res.failed), cancelled=res.cancelled)
+        if self.log_sampler is not None:
+            self.log_sampler.flush()
         log.info(f"Sending queue finished")
+        summary.log()
+        if len(self.relays) > 1:
+            self.log_relay_stats()
+        return summary
 
 
     
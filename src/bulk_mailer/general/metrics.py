@@ -0,0 +1,227 @@
+from __future__ import annotations
+import os
+import json
+import time
+import logging
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Any
+
+
+log = logging.getLogger()
+
+COUNTERS = ('messages', 'accepted', 'rejected', 'skipped', 'suppressed', 'cancelled', 'deferred', 'bytes_sent', 'reconnects', 'rotations')
+
+
+class PhaseStats:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+
+"""
+Time spent per phase of a send and counters of what was sent.
+The mailer records the phases
+    render:       pulling the next envelope from the queue, which builds its message if the queue is lazy
+    schedule:     waiting for the domain scheduler to release an envelope
+    build:        setting the address headers and serializing the message to wire bytes
+    sign:         DKIM signing, if the mailer has a signer
+    confirm:      waiting for the user to confirm
+    wait:         throttling by the rate limiter
+    transaction:  the SMTP transaction(s), including reconnects
+    results:      mapping and logging the replies
+    backoff:      waiting for deferred e-mails to become due again
+With multiple connections, the phases of concurrent sends add up, so their total can exceed the wall time.
+
+hooks are called as hook(phase, seconds) after every recorded phase.
+"""
+
+class Metrics:
+    def __init__(self, hooks: list[Callable[[str, float], None]] | None = None) -> None:
+        self.phases: dict[str, PhaseStats] = {}
+        self.counters: dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self.hooks = hooks if hooks is not None else []
+        self.started = time.monotonic()
+        self._lock = Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, phase: str, secs: float):
+        with self._lock:
+            stats = self.phases.get(phase)
+            if stats is None:
+                stats = self.phases[phase] = PhaseStats()
+            stats.count += 1
+            stats.total += secs
+            if secs > stats.max:
+                stats.max = secs
+        for hook in self.hooks:
+            hook(phase, secs)
+
+    def add(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                'timestamp': time.time(),
+                'uptime_secs': time.monotonic() - self.started,
+                'counters': dict(self.counters),
+                'phases': {name: {'count': s.count, 'total_secs': s.total, 'max_secs': s.max} for name, s in self.phases.items()},
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    # Prometheus text exposition format
+    def to_prometheus(self, prefix: str = 'bulk_mailer') -> str:
+        snap = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_uptime_seconds Seconds since the metrics were created",
+            f"# TYPE {prefix}_uptime_seconds gauge",
+            f"{prefix}_uptime_seconds {snap['uptime_secs']:.6f}",
+        ]
+        for name, value in snap['counters'].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        phases = snap['phases']
+        for metric, field, kind, help in (
+            ('phase_seconds_total', 'total_secs', 'counter', 'Seconds spent per send phase'),
+            ('phase_count_total', 'count', 'counter', 'Number of times a send phase was entered'),
+            ('phase_max_seconds', 'max_secs', 'gauge', 'Longest single duration of a send phase'),
+        ):
+            lines.append(f"# HELP {prefix}_{metric} {help}")
+            lines.append(f"# TYPE {prefix}_{metric} {kind}")
+            for name, stats in phases.items():
+                lines.append(f'{prefix}_{metric}{{phase="{name}"}} {stats[field]}')
+        return '\n'.join(lines) + '\n'
+
+    # writes a snapshot atomically, as JSON if the path ends in .json and in Prometheus format otherwise
+    def write(self, path: str | os.PathLike[str], format: str | None = None):
+        path = Path(path)
+        if format is None:
+            format = 'json' if path.suffix == '.json' else 'prometheus'
+        text = self.to_json() if format == 'json' else self.to_prometheus()
+        tmp = path.with_name(path.name + '.tmp')
+        tmp.write_text(text)
+        os.replace(tmp, path)
+
+
+
+"""
+Writes snapshots of metrics to a file every `interval` seconds from a background thread, and once more when stopped.
+The file can be scraped by e.g. the textfile collector of the Prometheus node exporter.
+"""
+
+class MetricsExporter:
+    def __init__(self, metrics: Metrics, path: str | os.PathLike[str], interval: float = 15, format: str | None = None) -> None:
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.format = format
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any):
+        self.stop()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.metrics.write(self.path, self.format)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.metrics.write(self.path, self.format)
+            except OSError as e:
+                log.error(f"Writing metrics failed: {e}")
+
+
+
+"""
+Logs the progress of a queue every `interval` seconds, with the send rate and, if the total is known, an ETA.
+"""
+
+class ProgressReporter:
+    def __init__(self, total: int | None = None, interval: float = 10) -> None:
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.started = time.monotonic()
+        self._last = self.started
+
+    # restarts the clock, e.g. when sending begins
+    def start(self, total: int | None = None):
+        if total is not None:
+            self.total = total
+        self.started = self._last = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0
+
+    # seconds until the queue is finished at the current rate, None if unknown
+    @property
+    def eta(self) -> float | None:
+        rate = self.rate
+        if self.total is None or rate == 0:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def update(self, failed: bool = False, cancelled: bool = False):
+        self.done += 1
+        self.failed += failed
+        self.cancelled += cancelled
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.report()
+
+    def report(self):
+        progress = f"{self.done}/{self.total} e-mails ({self.done * 100 // self.total}%)" if self.total else f"{self.done} e-mails"
+        eta = self.eta
+        log.info(
+            f"Progress: {progress}, {self.failed} failed, {self.cancelled} cancelled, {self.rate:.1f}/s"
+            + (f", ETA {format_duration(eta)}" if eta is not None else "")
+        )
+
+
+def format_duration(secs: float) -> str:
+    secs = round(secs)
+    hours, rest = divmod(secs, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02}m"
+    if minutes:
+        return f"{minutes}m{secs:02}s"
+    return f"{secs}s"
@@ -0,0 +1,383 @@
+from __future__ import annotations
+import time
+import smtplib
+import logging
+import threading
+from queue import Queue, Empty, Full
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from typing import Any, Generic, TypeVar
+
+
+log = logging.getLogger()
+
+_T = TypeVar('_T')
+_R = TypeVar('_R')
+
+
+"""
+How the SMTP sessions of a connection pool are managed.
+With lazy, a session is only established when the connection is first used, so a mailer whose queue turns out empty does not connect at all.
+A session that has been idle for `keepalive` seconds (e.g. while an e-mail is confirmed or the rate limiter waits) is kept alive with NOOP;
+if that fails, the session is closed and opened again when it is used next. None turns keepalives off.
+A session is ended with QUIT, and a new one opened, before it would exceed max_messages messages or max_bytes bytes,
+so that servers which limit their sessions do not drop it in the middle of a transaction.
+With check_size, messages larger than the SIZE the server advertises are refused locally, instead of by the server after the upload.
+"""
+
+class SessionPolicy:
+    def __init__(self,
+                 lazy: bool = True,
+                 keepalive: float | None = 30,
+                 max_messages: int | None = None,
+                 max_bytes: int | None = None,
+                 check_size: bool = True
+                 ) -> None:
+        if keepalive is not None and keepalive <= 0:
+            raise ValueError('keepalive must be positive')
+        if max_messages is not None and max_messages < 1:
+            raise ValueError('max_messages must be at least 1')
+        self.lazy = lazy
+        self.keepalive = keepalive
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.check_size = check_size
+
+
+# sessions as they are without a policy: opened right away and used until they fail
+EAGER = SessionPolicy(lazy=False, keepalive=None, check_size=False)
+
+
+
+"""
+A single SMTP session that can be re-established when the server drops it.
+The capabilities the server announces in reply to EHLO are kept per session, in features.
+"""
+
+class Connection:
+    def __init__(self, connect: Callable[[], smtplib.SMTP], policy: SessionPolicy = EAGER) -> None:
+        self._connect = connect
+        self.policy = policy
+        # without a host, smtplib does not connect; the session is established by open
+        self.server = smtplib.SMTP()
+        self.features: dict[str, str] = {}
+        self.reconnects = 0
+        self.sessions = 0
+        # messages and bytes sent in the current session
+        self.messages = 0
+        self.bytes = 0
+        self.last_used = time.monotonic()
+        if not policy.lazy:
+            self.open()
+
+    @property
+    def connected(self) -> bool:
+        return self.server.sock is not None
+
+    # the maximum message size the server accepts, None if it announces none
+    @property
+    def max_size(self) -> int | None:
+        size = self.features.get('size', '')
+        return int(size) if size.isdigit() and int(size) > 0 else None
+
+    @property
+    def eight_bit_mime(self) -> bool:
+        return '8bitmime' in self.features
+
+    def _start(self):
+        self.server = self._connect()
+        self.server.ehlo_or_helo_if_needed()
+        self.features = dict(self.server.esmtp_features)
+        self.sessions += 1
+        self.messages = 0
+        self.bytes = 0
+        self.last_used = time.monotonic()
+
+    # establishes a session if there is none, i.e. on first use or after the last one was closed
+    # returns whether an earlier session is replaced
+    def open(self) -> bool:
+        if self.connected:
+            return False
+        replaced = self.sessions > 0
+        self._start()
+        if replaced:
+            self.reconnects += 1
+        return replaced
+
+    def reconnect(self):
+        log.debug("Reconnecting to SMTP server")
+        self.close()
+        self._start()
+        self.reconnects += 1
+
+    # whether sending `size` more bytes would exceed the limits of the policy for one session
+    def expired(self, size: int) -> bool:
+        if self.messages == 0:
+            return False
+        policy = self.policy
+        return (policy.max_messages is not None and self.messages >= policy.max_messages) or (policy.max_bytes is not None and self.bytes + size > policy.max_bytes)
+
+    # ends the session and starts a new one
+    def rotate(self):
+        log.debug(f"Starting a new SMTP session after {self.messages} messages")
+        self.quit()
+        self._start()
+
+    # records a message sent in the current session
+    def sent(self, size: int):
+        self.messages += 1
+        self.bytes += size
+        self.last_used = time.monotonic()
+
+    # sends NOOP if the session has been idle for the keepalive time of the policy; a session that does not answer is closed
+    def keepalive(self):
+        if self.policy.keepalive is None or not self.connected or time.monotonic() - self.last_used < self.policy.keepalive:
+            return
+        try:
+            code, _ = self.server.noop()
+        except OSError:
+            code = -1
+        if code != 250:
+            log.debug("SMTP session did not answer the keepalive, closing it")
+            self.close()
+        self.last_used = time.monotonic()
+
+    def quit(self):
+        try:
+            self.server.quit()
+        except OSError:
+            pass
+        finally:
+            self.server.close()
+
+    def close(self):
+        try:
+            self.server.close()
+        except OSError:
+            pass
+
+
+
+"""
+A fixed number of SMTP connections that are shared between worker threads.
+Every connection is used by at most one thread at a time.
+If the policy has a keepalive, a background thread keeps the idle sessions alive.
+"""
+
+class ConnectionPool:
+    def __init__(self, connect: Callable[[], smtplib.SMTP], size: int = 1, policy: SessionPolicy = EAGER) -> None:
+        if size < 1:
+            raise ValueError('Pool size must be at least 1')
+        self.size = size
+        self.policy = policy
+        self.connections: list[Connection] = []
+        self._idle: Queue[Connection] = Queue()
+
+        for i in range(size):
+            log.debug(f"Opening connection {i+1} of {size}")
+            conn = Connection(connect, policy)
+            self.connections.append(conn)
+            self._idle.put(conn)
+
+        self._stopped = threading.Event()
+        self._keeper: threading.Thread | None = None
+        if policy.keepalive is not None:
+            self._keeper = threading.Thread(target=self._keep_alive, args=(policy.keepalive,), daemon=True)
+            self._keeper.start()
+
+    # checks the connections that are not in use twice per keepalive time
+    def _keep_alive(self, keepalive: float):
+        while not self._stopped.wait(keepalive / 2):
+            for _ in range(self.size):
+                try:
+                    conn = self._idle.get_nowait()
+                except Empty:
+                    break
+                try:
+                    conn.keepalive()
+                finally:
+                    self._idle.put(conn)
+
+    @contextmanager
+    def acquire(self) -> Iterator[Connection]:
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def quit(self):
+        self._stopped.set()
+        if self._keeper is not None:
+            self._keeper.join()
+        for conn in self.connections:
+            conn.quit()
+
+
+# like map(), but calls func from up to `workers` threads
+# results are yielded in input order; at most 2*workers items are in flight, so `items` may be a lazy iterable
+# the items are pulled (and submitted) from a thread of their own, so that finished results are passed on while the source waits,
+# e.g. a live queue that waits for new e-mails
+def imap_ordered(func: Callable[[_T], _R], items: Iterable[_T], workers: int) -> Iterator[_R]:
+    if workers <= 1:
+        yield from map(func, items)
+        return
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending: deque[Future[_R]] = deque()
+        changed = threading.Condition()
+        stopped = False
+        finished = False
+        error: BaseException | None = None
+
+        def feed():
+            nonlocal finished, error
+            iterator = iter(items)
+            try:
+                while True:
+                    with changed:
+                        while len(pending) >= 2 * workers and not stopped:
+                            changed.wait()
+                        if stopped:
+                            return
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    with changed:
+                        if stopped:
+                            return
+                        pending.append(executor.submit(func, item))
+                        changed.notify_all()
+            except BaseException as e:
+                error = e
+            finally:
+                with changed:
+                    finished = True
+                    changed.notify_all()
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            while True:
+                with changed:
+                    while not pending and not finished:
+                        changed.wait()
+                    if not pending:
+                        # the results of the items before an error in the source are passed on first
+                        if error is not None:
+                            raise error
+                        return
+                    future = pending[0]
+                result = future.result()
+                with changed:
+                    pending.popleft()
+                    changed.notify_all()
+                yield result
+        finally:
+            with changed:
+                stopped = True
+                for future in pending:
+                    future.cancel()
+                changed.notify_all()
+            # like in BackgroundIterator.close, the feeder may be blocked in its source
+            feeder.join(timeout=1)
+
+
+
+"""
+Iterates `items` in a background thread, at most `lookahead` items ahead of the consumer, which takes them with next().
+As the consumer does not block in the source itself, it can wait for the next item with a timeout, or be woken up with wake(),
+e.g. to do something else while a live queue waits for new e-mails. The source's exceptions are raised in the consumer.
+on_item is called from the background thread whenever an item is ready.
+"""
+
+class BackgroundIterator(Generic[_T]):
+    _ITEM, _END, _ERROR, _WAKE = range(4)
+
+    def __init__(self, items: Iterable[_T], lookahead: int = 1, on_item: Callable[[], None] | None = None) -> None:
+        if lookahead < 1:
+            raise ValueError('lookahead must be at least 1')
+        self.on_item = on_item
+        self._buffer: Queue[tuple[int, Any]] = Queue(maxsize=lookahead)
+        self._stopped = threading.Event()
+        self._done = False
+        self._producer = threading.Thread(target=self._produce, args=(items,), daemon=True)
+        self._producer.start()
+
+    # returns False if the consumer is gone
+    def _put(self, entry: tuple[int, Any]) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._buffer.put(entry, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _produce(self, items: Iterable[_T]):
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not self._put((self._ITEM, item)):
+                    return
+                if self.on_item is not None:
+                    self.on_item()
+            self._put((self._END, None))
+        except BaseException as e:
+            self._put((self._ERROR, e))
+        finally:
+            if self.on_item is not None:
+                self.on_item()
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    # the next item; raises StopIteration at the end, and queue.Empty after timeout seconds or when woken up
+    def next(self, timeout: float | None = None) -> _T:
+        if self._done:
+            raise StopIteration
+        kind, value = self._buffer.get(timeout=max(0, timeout) if timeout is not None else None)
+        if kind == self._ITEM:
+            return value
+        if kind == self._WAKE:
+            raise Empty
+        self._done = True
+        if kind == self._ERROR:
+            raise value
+        raise StopIteration
+
+    # ends a wait in next() early; if items are ready anyway, there is nothing to wake up
+    def wake(self):
+        try:
+            self._buffer.put_nowait((self._WAKE, None))
+        except Full:
+            pass
+
+    def close(self):
+        self._stopped.set()
+        # the producer may be blocked in a live source (e.g. a queue waiting for new e-mails), which would never let it finish;
+        # it is a daemon and stops on its own once the source returns, so it is not waited for any longer than a blocked put takes
+        self._producer.join(timeout=1)
+        if self._producer.is_alive():
+            log.debug("Not waiting for the producer, which is blocked in its source")
+
+
+# iterates `items` in a background thread, at most `lookahead` items ahead of the consumer
+# the producer blocks while the buffer is full; its exceptions are raised in the consumer
+def prefetch(items: Iterable[_T], lookahead: int) -> Iterator[_T]:
+    source = BackgroundIterator(items, lookahead)
+    try:
+        while True:
+            try:
+                item = source.next()
+            except StopIteration:
+                return
+            yield item
+    finally:
+        source.close()
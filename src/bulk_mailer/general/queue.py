@@ -1,21 +1,44 @@
 from __future__ import annotations
-from email.message import EmailMessage
+import time
+import heapq
+from datetime import datetime
+from itertools import count
+from threading import Condition
 from bulk_mailer.entities import Person
-from collections.abc import Collection
+from collections.abc import Collection, Iterable, Iterator
 from typing import TYPE_CHECKING, Any
-from bulk_mailer.utils import ask_mail_confirmation
+from bulk_mailer.utils import ask_mail_confirmation, review_mails
 import logging
 from .envelope import Envelope
+from .types import Message
+if TYPE_CHECKING:
+    from .suppression import SuppressionList
 
 
 log = logging.getLogger()
 
 
+# the envelope without the suppressed recipients; None if every recipient is suppressed
+def _unsuppressed(env: Envelope, suppression: SuppressionList) -> Envelope | None:
+    keep = lambda people: [p for p in people if p not in suppression]
+    to, cc, bcc = keep(env.to), keep(env.cc), keep(env.bcc)
+    removed = len(env.to) + len(env.cc) + len(env.bcc) - len(to) - len(cc) - len(bcc)
+    if not removed:
+        return env
+    if not to and not cc and not bcc:
+        log.warning(f"Mail not added: every recipient is suppressed")
+        return None
+    log.info(f"Removed {removed} suppressed recipients from mail")
+    return Envelope(env.msg, to, cc, bcc, env.key)
+
+
 class MailQueue(Collection[Envelope]):
 
-    def __init__(self, confirm_mails:bool=False) -> None:
+    # recipients on the suppression list are removed from added e-mails
+    def __init__(self, confirm_mails:bool=False, suppression:SuppressionList|None=None) -> None:
         self.queue: list[Envelope] = []
         self.confirm_mails = confirm_mails
+        self.suppression = suppression
     
     def __contains__(self, item: Any):
         return item in self.queue
@@ -30,15 +53,120 @@ class MailQueue(Collection[Envelope]):
         return str(self.queue)
 
     def add(self,
-            msg: EmailMessage,
+            msg: Message,
             to: Person | Collection[Person],
             cc: Person | Collection[Person] | None = None,
             bcc: Person | Collection[Person] | None = None
             ) -> bool:
 
-        envelope = Envelope(msg, to, cc, bcc)
+        envelope: Envelope | None = Envelope(msg, to, cc, bcc)
+        if self.suppression is not None:
+            envelope = _unsuppressed(envelope, self.suppression)
+            if envelope is None:
+                return False
         if self.confirm_mails and not ask_mail_confirmation(envelope, "Accept", "Reject"):
             log.debug("Mail rejected")
             return False
         self.queue.append(envelope)
         return True
+
+    # lets the user review all queued e-mails in one session; rejected e-mails are removed
+    # returns the number of approved e-mails
+    def review(self, page_size: int = 20) -> int:
+        approved = review_mails(self.queue, page_size)
+        rejected = len(self.queue) - len(approved)
+        self.queue = [env for i, env in enumerate(self.queue) if i in approved]
+        if rejected:
+            log.warning(f"{len(self.queue)} of {len(self.queue) + rejected} e-mails have been approved")
+        else:
+            log.info(f"All e-mails have been approved")
+        return len(self.queue)
+
+
+
+"""
+A queue that sends urgent e-mails first and holds back scheduled ones until they are due.
+E-mails with a higher priority are sent before those with a lower one, and e-mails of equal priority in the order they were added.
+An e-mail with send_at (a datetime or a time.time() timestamp) is not sent before then. Adding and taking an e-mail are O(log n).
+
+Iterating the queue takes the e-mails out of it, sleeping until the next scheduled e-mail is due. E-mails can be added
+from other threads while it is being sent. Without live, the iteration ends once the queue is empty; with live, it waits
+for new e-mails until close() is called, so a mailer can run as a long-lived consumer.
+The mailer takes a few e-mails ahead (see Mailer.send_queue_iter), so an urgent e-mail may still wait behind those.
+"""
+
+class PriorityMailQueue(Iterable[Envelope]):
+    def __init__(self, confirm_mails: bool = False, suppression: SuppressionList | None = None, live: bool = False) -> None:
+        self.confirm_mails = confirm_mails
+        self.suppression = suppression
+        self.live = live
+        # (-priority, seq, envelope) of the due e-mails, and (send_at, seq, priority, envelope) of the scheduled ones
+        self._ready: list[tuple[int, int, Envelope]] = []
+        self._scheduled: list[tuple[float, int, int, Envelope]] = []
+        self._seq = count()
+        self._closed = False
+        self._changed = Condition()
+
+    # number of e-mails in the queue, due or not
+    def count(self) -> int:
+        with self._changed:
+            return len(self._ready) + len(self._scheduled)
+
+    def add(self,
+            msg: Message,
+            to: Person | Collection[Person],
+            cc: Person | Collection[Person] | None = None,
+            bcc: Person | Collection[Person] | None = None,
+            priority: int = 0,
+            send_at: datetime | float | None = None,
+            key: str | None = None
+            ) -> bool:
+
+        envelope: Envelope | None = Envelope(msg, to, cc, bcc, key)
+        if self.suppression is not None:
+            envelope = _unsuppressed(envelope, self.suppression)
+            if envelope is None:
+                return False
+        if self.confirm_mails and not ask_mail_confirmation(envelope, "Accept", "Reject"):
+            log.debug("Mail rejected")
+            return False
+
+        if isinstance(send_at, datetime):
+            send_at = send_at.timestamp()
+        with self._changed:
+            if self._closed:
+                raise RuntimeError('Queue is closed')
+            if send_at is not None and send_at > time.time():
+                heapq.heappush(self._scheduled, (send_at, next(self._seq), priority, envelope))
+            else:
+                heapq.heappush(self._ready, (-priority, next(self._seq), envelope))
+            self._changed.notify()
+        return True
+
+    # no more e-mails can be added; a live iteration ends once the queue is empty
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    def __iter__(self) -> Iterator[Envelope]:
+        while True:
+            with self._changed:
+                env = self._take()
+                while env is None:
+                    if not self._scheduled and (self._closed or not self.live):
+                        return
+                    timeout = self._scheduled[0][0] - time.time() if self._scheduled else None
+                    self._changed.wait(timeout)
+                    env = self._take()
+            yield env
+
+    # the due e-mail with the highest priority, None if none is due
+    def _take(self) -> Envelope | None:
+        now = time.time()
+        while self._scheduled and self._scheduled[0][0] <= now:
+            _, seq, priority, env = heapq.heappop(self._scheduled)
+            heapq.heappush(self._ready, (-priority, seq, env))
+        if not self._ready:
+            return None
+        return heapq.heappop(self._ready)[2]
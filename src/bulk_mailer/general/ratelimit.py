@@ -0,0 +1,151 @@
+from __future__ import annotations
+import time
+import logging
+from collections.abc import Iterable, Sequence
+from threading import Lock
+from typing import Any
+
+
+log = logging.getLogger()
+
+
+# at most `count` units per `per_secs` seconds, of which at most `burst` at once (default: count)
+class Limit:
+    def __init__(self, count: float, per_secs: float, burst: float | None = None) -> None:
+        if count <= 0 or per_secs <= 0:
+            raise ValueError('count and per_secs must be positive')
+        self.count = count
+        self.per_secs = per_secs
+        self.burst = burst if burst is not None else count
+
+
+class TokenBucket:
+    def __init__(self, limit: Limit) -> None:
+        self.rate = limit.count / limit.per_secs
+        self.capacity = limit.burst
+        self.tokens = limit.burst
+        self.last = time.monotonic()
+
+    # takes `amount` tokens, going into debt if there are not enough; returns how long the caller has to wait
+    def reserve(self, amount: float, factor: float, now: float) -> float:
+        rate = self.rate * factor
+        self.tokens = min(self.capacity * factor, self.tokens + (now - self.last) * rate)
+        self.last = now
+        self.tokens -= amount
+        return -self.tokens / rate if self.tokens < 0 else 0
+
+    # how long until `amount` tokens could be taken without going into debt (or the bucket is full); takes nothing
+    def ready_in(self, amount: float, factor: float, now: float) -> float:
+        rate = self.rate * factor
+        capacity = self.capacity * factor
+        tokens = min(capacity, self.tokens + (now - self.last) * rate)
+        amount = min(amount, capacity)
+        return (amount - tokens) / rate if tokens < amount else 0
+
+    # whether the bucket has refilled completely at the full rate
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.last) * self.rate >= self.capacity
+
+
+
+"""
+Limits the rate of messages, recipients and bytes, each with any number of windows (e.g. per minute and per day).
+reserve() never blocks, so the same limiter works for threads and asyncio: it books the send and returns the time to wait before it.
+
+With adaptive=True the limiter does AIMD: all rates are multiplied by a factor that is cut by `decrease` whenever the server
+throttles (421/451/452), and grows by `increase` with every send that goes through, up to the configured rates.
+"""
+
+class RateLimiter:
+    THROTTLE_CODES = frozenset({421, 451, 452})
+
+    def __init__(self,
+                 messages: Sequence[Limit] = (),
+                 recipients: Sequence[Limit] = (),
+                 data_bytes: Sequence[Limit] = (),
+                 adaptive: bool = True,
+                 decrease: float = 0.5,
+                 increase: float = 0.05,
+                 min_factor: float = 0.05
+                 ) -> None:
+        self.limits = (list(messages), list(recipients), list(data_bytes))
+        self.messages = [TokenBucket(l) for l in messages]
+        self.recipients = [TokenBucket(l) for l in recipients]
+        self.data_bytes = [TokenBucket(l) for l in data_bytes]
+        self.adaptive = adaptive
+        self.decrease = decrease
+        self.increase = increase
+        self.min_factor = min_factor
+        self.factor = 1.0
+        self._lock = Lock()
+
+    # the same behaviour as a fixed delay between sends
+    @classmethod
+    def fixed_delay(cls, delay_secs: float) -> RateLimiter:
+        return cls(messages=[Limit(1, delay_secs, burst=1)], adaptive=False)
+
+    # a limiter with a 1/parts share of every rate, for each of `parts` processes that send under the same budget
+    def split(self, parts: int) -> RateLimiter:
+        def share(limits: list[Limit]) -> list[Limit]:
+            return [Limit(l.count / parts, l.per_secs, l.burst / parts) for l in limits]
+        messages, recipients, data_bytes = self.limits
+        return RateLimiter(share(messages), share(recipients), share(data_bytes), self.adaptive, self.decrease, self.increase, self.min_factor)
+
+    # locks cannot be pickled, e.g. when passing the limiter to another process
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict[str, Any]):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def reserve(self, recipients: int = 1, size: int = 0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            for bucket in self.messages:
+                delay = max(delay, bucket.reserve(1, self.factor, now))
+            for bucket in self.recipients:
+                delay = max(delay, bucket.reserve(recipients, self.factor, now))
+            for bucket in self.data_bytes:
+                delay = max(delay, bucket.reserve(size, self.factor, now))
+            return delay
+
+    # how long until a send would go through without waiting; books nothing
+    def ready_in(self, recipients: int = 1, size: int = 0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            for bucket in self.messages:
+                delay = max(delay, bucket.ready_in(1, self.factor, now))
+            for bucket in self.recipients:
+                delay = max(delay, bucket.ready_in(recipients, self.factor, now))
+            for bucket in self.data_bytes:
+                delay = max(delay, bucket.ready_in(size, self.factor, now))
+            return delay
+
+    # whether the limiter is as good as a new one: every bucket is full again, and the rate is not reduced
+    def is_fresh(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            return self.factor >= 1 and all(bucket.is_full(now) for bucket in (*self.messages, *self.recipients, *self.data_bytes))
+
+    def wait(self, recipients: int = 1, size: int = 0):
+        delay = self.reserve(recipients, size)
+        if delay > 0:
+            log.debug(f"Waiting for {round(delay, 2)} seconds")
+            time.sleep(delay)
+
+    # adapts the rate to the reply codes of a send
+    def feedback(self, codes: Iterable[int]):
+        if not self.adaptive:
+            return
+        throttled = any(code in self.THROTTLE_CODES for code in codes)
+        with self._lock:
+            if throttled:
+                self.factor = max(self.min_factor, self.factor * self.decrease)
+                log.warning(f"Server is throttling, reducing send rate to {round(self.factor * 100)}%")
+            elif self.factor < 1:
+                self.factor = min(1.0, self.factor + self.increase)
@@ -0,0 +1,140 @@
+from __future__ import annotations
+import time
+import logging
+import smtplib
+from collections.abc import Callable, Collection, Sequence
+from threading import Lock
+from typing import Any, TYPE_CHECKING
+from .pool import ConnectionPool, SessionPolicy, EAGER
+from .ratelimit import RateLimiter
+if TYPE_CHECKING:
+    from .mailer import SMTP_CONFIG
+
+
+log = logging.getLogger()
+
+
+class RelayStats:
+    __slots__ = ('messages', 'accepted', 'rejected', 'errors', 'failovers', 'busy_secs')
+
+    def __init__(self) -> None:
+        self.messages = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = 0
+        self.failovers = 0
+        self.busy_secs = 0.0
+
+    # messages per second of transaction time
+    @property
+    def throughput(self) -> float:
+        return self.messages / self.busy_secs if self.busy_secs else 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__} | {'throughput': self.throughput}
+
+
+
+"""
+An SMTP relay with its own connections and, optionally, its own rate limit (in addition to the rate limit of the mailer).
+Envelopes are distributed across the relays of a mailer in proportion to their weights.
+
+A relay that fails (connection or SMTP errors, or a temporary failure for all recipients) is taken out of rotation for `cooldown` seconds,
+and the e-mail is sent through another relay. So is a relay whose average transaction time exceeds max_latency seconds.
+"""
+
+class Relay:
+    def __init__(self,
+                 config: SMTP_CONFIG,
+                 weight: float = 1,
+                 connections: int = 1,
+                 rate_limit: RateLimiter | None = None,
+                 max_latency: float | None = None,
+                 cooldown: float = 60,
+                 name: str | None = None
+                 ) -> None:
+        if weight <= 0:
+            raise ValueError('weight must be positive')
+        self.config = config
+        self.weight = weight
+        self.connections = connections
+        self.rate_limit = rate_limit
+        self.max_latency = max_latency
+        self.cooldown = cooldown
+        self.name = name if name is not None else f"{config.address}:{config.port}"
+
+        self.pool: ConnectionPool | None = None
+        self.stats = RelayStats()
+        self.latency: float | None = None
+        self.down_until = 0.0
+        self._current = 0.0
+
+    def __repr__(self) -> str:
+        return f"Relay({self.name!r}, weight={self.weight})"
+
+    # a copy of the (not yet opened) relay for one of `parts` processes, with that share of its rate limit
+    def split(self, parts: int) -> Relay:
+        rate_limit = self.rate_limit.split(parts) if self.rate_limit is not None else None
+        return Relay(self.config, self.weight, self.connections, rate_limit, self.max_latency, self.cooldown, self.name)
+
+    def open(self, connect: Callable[[SMTP_CONFIG], smtplib.SMTP], session: SessionPolicy = EAGER):
+        if self.pool is None:
+            self.pool = ConnectionPool(lambda: connect(self.config), self.connections, session)
+
+    def quit(self):
+        if self.pool is not None:
+            self.pool.quit()
+
+    def available(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def mark_down(self, reason: str):
+        self.down_until = time.monotonic() + self.cooldown
+        log.warning(f"Relay {self.name} {reason}, not using it for {round(self.cooldown)} seconds")
+
+    # records a finished transaction; takes the relay out of rotation if it has become too slow
+    def record(self, secs: float, accepted: int, rejected: int):
+        stats = self.stats
+        stats.messages += 1
+        stats.accepted += accepted
+        stats.rejected += rejected
+        stats.busy_secs += secs
+        self.latency = secs if self.latency is None else 0.8 * self.latency + 0.2 * secs
+        if self.max_latency is not None and self.latency > self.max_latency and self.available(time.monotonic()):
+            self.mark_down(f"is slow ({self.latency:.2f} seconds per e-mail)")
+            # start afresh after the cooldown
+            self.latency = None
+
+    def record_error(self, secs: float, error: BaseException | str):
+        self.stats.errors += 1
+        self.stats.busy_secs += secs
+        self.mark_down(f"failed ({error})")
+
+
+
+# smooth weighted round robin over the available relays
+class RelayBalancer:
+    def __init__(self, relays: Sequence[Relay]) -> None:
+        if not relays:
+            raise ValueError('At least one relay is needed')
+        self.relays = list(relays)
+        self._lock = Lock()
+
+    # returns None if every relay has been tried
+    def choose(self, exclude: Collection[Relay] = ()) -> Relay | None:
+        with self._lock:
+            candidates = [r for r in self.relays if r not in exclude]
+            if not candidates:
+                return None
+            now = time.monotonic()
+            available = [r for r in candidates if r.available(now)]
+            if not available:
+                # every relay is out of rotation: rather try the one that comes back first than give up
+                return min(candidates, key=lambda r: r.down_until)
+
+            total = sum(r.weight for r in available)
+            for r in available:
+                r._current += r.weight
+            best = max(available, key=lambda r: r._current)
+            best._current -= total
+            return best
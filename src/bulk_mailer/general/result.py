@@ -4,10 +4,14 @@ from .types import SendSuccs, SendErrs
 
 
 class SendResult:
-    def __init__(self, envelope: Envelope, succeeded: SendSuccs, failed: SendErrs, cancelled: bool) -> None:
-        assert cancelled or set(succeeded) | set(failed) == set(envelope.all_recipients)
+    # already_sent: recipients that were not sent to again because the journal records them as delivered (also part of succeeded)
+    # suppressed: recipients that were not sent to because they are on the suppression list (neither succeeded nor failed)
+    def __init__(self, envelope: Envelope, succeeded: SendSuccs, failed: SendErrs, cancelled: bool, already_sent: SendSuccs | None = None, suppressed: SendSuccs | None = None) -> None:
+        self.suppressed: SendSuccs = suppressed if suppressed is not None else set()
+        assert cancelled or set(succeeded) | set(failed) | self.suppressed == set(envelope.all_recipients)
         self.envelope = envelope
         self.succeeded = succeeded
         self.failed = failed
         self.cancelled = cancelled
+        self.already_sent: SendSuccs = already_sent if already_sent is not None else set()
         
\ No newline at end of file
@@ -0,0 +1,137 @@
+from __future__ import annotations
+import heapq
+import random
+import time
+from collections.abc import Iterator
+from itertools import count
+from threading import Lock
+from typing import Generic, TypeVar, TYPE_CHECKING
+from bulk_mailer.entities import Emailable
+from .envelope import Envelope
+from .result import SendResult
+from .types import Reply, SendErrs, SendSuccs
+if TYPE_CHECKING:
+    from .mailer import PreparedMail
+
+
+_T = TypeVar('_T')
+
+
+"""
+Decides how transient failures are retried.
+A reply is transient if it has a 4xx code. Dropped connections are re-established (at most `reconnects` times per send),
+everything else that is transient is retried later, after a capped exponential backoff with jitter, at most `max_attempts` times in total.
+"""
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 5, base_delay: float = 30, max_delay: float = 1800, jitter: float = 0.5, reconnects: int = 2) -> None:
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1')
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.reconnects = reconnects
+
+    @staticmethod
+    def is_transient(reply: Reply) -> bool:
+        return 400 <= reply[0] < 500
+
+    # delay before the attempt after `attempt` failed attempts
+    def backoff(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+
+"""
+Items that become due at a given time, ordered by a heap.
+Items can be pushed and popped from different threads.
+"""
+
+class DeferredQueue(Generic[_T]):
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, _T]] = []
+        self._seq = count()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, item: _T, delay: float):
+        with self._lock:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), item))
+
+    def pop_due(self) -> Iterator[_T]:
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > time.monotonic():
+                    return
+                item = heapq.heappop(self._heap)[2]
+            yield item
+
+    # seconds until the next item is due, None if there is none
+    def due_in(self) -> float | None:
+        with self._lock:
+            return max(0, self._heap[0][0] - time.monotonic()) if self._heap else None
+
+    def wait(self):
+        delay = self.due_in()
+        if delay is not None:
+            time.sleep(delay)
+
+
+
+"""
+The state of an envelope across send attempts.
+Recipients are done once they were accepted or permanently refused; only the others are sent to again.
+The prepared (serialized) message is kept, so retries do not serialize it again.
+"""
+
+class PendingSend:
+    def __init__(self, env: Envelope, prepared: PreparedMail | None = None) -> None:
+        self.env = env
+        self.prepared = prepared
+        self.attempts = 0
+        self.done: set[str] = set()
+        self.succeeded: SendSuccs = set()
+        self.failed: SendErrs = dict()
+        self.already_sent: SendSuccs = set()
+        self.suppressed: SendSuccs = set()
+        self.cancelled = False
+
+    # merges the result of an attempt; returns whether the envelope is finished
+    def merge(self, res: SendResult, policy: RetryPolicy) -> bool:
+        if res.cancelled:
+            self.cancelled = True
+            return True
+
+        self.already_sent |= res.already_sent
+        # recipients that bounced in an earlier attempt may be suppressed by now
+        suppressed = {p for p in res.suppressed if p.key not in self.done}
+        self.suppressed |= suppressed
+        newly_done: set[str] = {p.key for p in suppressed}
+        for person in res.succeeded:
+            if person.key not in self.done:
+                self.succeeded.add(person)
+                newly_done.add(person.key)
+
+        retry = False
+        last_attempt = self.attempts >= policy.max_attempts
+        for person, error in res.failed.items():
+            if policy.is_transient(error) and not last_attempt:
+                retry = True
+            else:
+                self.failed[person] = error
+                newly_done.add(person.key)
+
+        self.done |= newly_done
+        return not retry
+
+    def result(self) -> SendResult:
+        if self.cancelled:
+            return SendResult(self.env, set(), dict(), True)
+        return SendResult(self.env, self.succeeded, self.failed, False, self.already_sent, self.suppressed)
+
+    def pending_recipients(self) -> list[Emailable]:
+        return [r for r in self.env.all_recipients if r.key not in self.done]
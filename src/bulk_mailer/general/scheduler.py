@@ -0,0 +1,226 @@
+from __future__ import annotations
+import time
+import logging
+from collections import deque
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from queue import Empty
+from threading import Condition
+from .envelope import Envelope
+from .ratelimit import Limit, RateLimiter
+from .result import SendResult
+from .metrics import Metrics
+from .pool import BackgroundIterator
+
+
+log = logging.getLogger()
+
+
+# the domain an envelope is scheduled by: that of its first recipient
+def envelope_domain(env: Envelope) -> str:
+    for recipient in env.all_recipients:
+        return recipient.email_address.rpartition('@')[2].lower()
+    return ''
+
+
+
+"""
+How e-mails to one recipient domain are sent.
+messages and recipients are rate limits per domain, with AIMD on throttling replies as in RateLimiter (see adaptive).
+At most max_concurrent e-mails to the domain are in flight at once. A domain with twice the weight gets twice the share of the sends.
+"""
+
+class DomainPolicy:
+    def __init__(self,
+                 messages: Sequence[Limit] = (),
+                 recipients: Sequence[Limit] = (),
+                 max_concurrent: int | None = None,
+                 weight: float = 1,
+                 adaptive: bool = True
+                 ) -> None:
+        if max_concurrent is not None and max_concurrent < 1:
+            raise ValueError('max_concurrent must be at least 1')
+        if weight <= 0:
+            raise ValueError('weight must be positive')
+        self.messages = messages
+        self.recipients = recipients
+        self.max_concurrent = max_concurrent
+        self.weight = weight
+        self.adaptive = adaptive
+
+    # every domain gets a limiter of its own
+    def limiter(self) -> RateLimiter | None:
+        if not self.messages and not self.recipients:
+            return None
+        return RateLimiter(self.messages, self.recipients, adaptive=self.adaptive)
+
+
+class _Domain:
+    __slots__ = ('name', 'policy', 'limiter', 'pending', 'in_flight', 'finish')
+
+    def __init__(self, name: str, policy: DomainPolicy, finish: float) -> None:
+        self.name = name
+        self.policy = policy
+        self.limiter = policy.limiter()
+        self.pending: deque[Envelope] = deque()
+        self.in_flight = 0
+        # virtual finish time of its next send, for weighted fair queueing
+        self.finish = finish
+
+    # seconds until the domain may send again; None while it is at its concurrency cap
+    def ready_in(self) -> float | None:
+        cap = self.policy.max_concurrent
+        if cap is not None and self.in_flight >= cap:
+            return None
+        if self.limiter is None:
+            return 0
+        return self.limiter.ready_in(sum(1 for _ in self.pending[0].all_recipients))
+
+
+
+"""
+Sits between a queue and the mailer and reorders the envelopes by recipient domain, so that a list sorted by address
+does not send thousands of consecutive e-mails to one provider.
+
+Up to `window` envelopes are read ahead and grouped by domain; domains are only interleaved within the window,
+so a larger window evens out longer runs of one domain, at the cost of memory. The queue is read in a background thread (with as many envelopes
+buffered again), and only the envelopes that it has ready are scheduled, so a live queue that waits for new e-mails does not hold up the sends. The next envelope is taken from the domain with the lowest
+virtual finish time (weighted fair queueing, i.e. round robin for equal weights) among those that are below their concurrency cap
+and rate limit. A domain that is throttled or at its cap is passed over, so it does not hold up the others.
+Policies are given per domain; other domains get the default policy.
+
+The mailer calls done() with every result, which frees the concurrency slot and adapts the domain's rate to the reply codes.
+"""
+
+class DomainScheduler:
+    def __init__(self, domains: Mapping[str, DomainPolicy] | None = None, default: DomainPolicy | None = None, window: int = 1000) -> None:
+        if window < 1:
+            raise ValueError('window must be at least 1')
+        self.policies = {name.lower(): policy for name, policy in (domains or {}).items()}
+        self.default = default if default is not None else DomainPolicy()
+        self.window = window
+        self._domains: dict[str, _Domain] = {}
+        # domains with a limiter that have nothing to send, in the order they became idle (see _forget)
+        self._idle: dict[str, _Domain] = {}
+        self._dispatched: dict[int, _Domain] = {}
+        self._clock = 0.0
+        self._buffered = 0
+        self._changed = Condition()
+
+    # the time spent waiting for throttled domains is recorded as the phase 'schedule' of metrics
+    def schedule(self, queue: Iterable[Envelope], metrics: Metrics | None = None) -> Iterator[Envelope]:
+        source = BackgroundIterator(queue, self.window, on_item=self._notify)
+        exhausted = False
+        try:
+            while True:
+                with self._changed:
+                    if not exhausted:
+                        exhausted = self._fill(source)
+                    if self._buffered == 0:
+                        if exhausted:
+                            return
+                        # wait for the queue
+                        self._changed.wait()
+                        continue
+                    domain, delay = self._next()
+                    if domain is None:
+                        # every domain with pending e-mails is throttled or at its cap: wait for a send to finish, a limit to free up,
+                        # or a new e-mail (to another domain)
+                        start = time.perf_counter()
+                        self._changed.wait(delay)
+                        if metrics is not None:
+                            metrics.record('schedule', time.perf_counter() - start)
+                        continue
+                    env = self._dispatch(domain)
+                yield env
+        finally:
+            source.close()
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    # takes the envelopes that the queue has ready, without waiting for more; returns whether the queue is exhausted
+    def _fill(self, source: BackgroundIterator[Envelope]) -> bool:
+        self._expire()
+        while self._buffered < self.window:
+            try:
+                env = source.next(timeout=0)
+            except Empty:
+                return False
+            except StopIteration:
+                return True
+            name = envelope_domain(env)
+            domain = self._domains.get(name)
+            if domain is None:
+                # a new domain starts at the current virtual time, so it neither jumps ahead nor falls behind
+                policy = self.policies.get(name, self.default)
+                domain = self._domains[name] = _Domain(name, policy, self._clock + 1 / policy.weight)
+            elif not domain.pending and domain.in_flight == 0:
+                domain.finish = max(domain.finish, self._clock + 1 / domain.policy.weight)
+            domain.pending.append(env)
+            self._buffered += 1
+        return False
+
+    # returns the domain to send to next, or None and how long to wait at most
+    def _next(self) -> tuple[_Domain | None, float | None]:
+        best: _Domain | None = None
+        delay: float | None = None
+        for domain in self._domains.values():
+            if not domain.pending:
+                continue
+            ready_in = domain.ready_in()
+            if ready_in is None:
+                continue
+            if ready_in > 0:
+                delay = ready_in if delay is None else min(delay, ready_in)
+                continue
+            if best is None or domain.finish < best.finish:
+                best = domain
+        return best, delay
+
+    def _dispatch(self, domain: _Domain) -> Envelope:
+        env = domain.pending.popleft()
+        self._buffered -= 1
+        self._clock = domain.finish
+        domain.finish += 1 / domain.policy.weight
+        domain.in_flight += 1
+        if domain.limiter is not None:
+            domain.limiter.reserve(sum(1 for _ in env.all_recipients))
+        self._dispatched[id(env)] = domain
+        return env
+
+    # drops idle domains, so that memory does not grow with the number of domains seen
+    # a domain with a limiter is only dropped once the limiter has recovered, when a new one would be the same (see _expire)
+    def _forget(self, domain: _Domain):
+        if domain.pending or domain.in_flight:
+            return
+        if domain.limiter is None or domain.limiter.is_fresh():
+            self._domains.pop(domain.name, None)
+            self._idle.pop(domain.name, None)
+        else:
+            self._idle[domain.name] = domain
+
+    # drops the idle domains whose limiters have recovered, oldest first; domains that have e-mails again are no longer idle
+    def _expire(self):
+        while self._idle:
+            domain = next(iter(self._idle.values()))
+            active = bool(domain.pending or domain.in_flight)
+            if not active and domain.limiter is not None and not domain.limiter.is_fresh():
+                return
+            del self._idle[domain.name]
+            if not active:
+                self._domains.pop(domain.name, None)
+
+    # called with the result of every sent envelope, also of retries
+    def done(self, res: SendResult):
+        with self._changed:
+            domain = self._dispatched.pop(id(res.envelope), None)
+            if domain is None:
+                domain = self._domains.get(envelope_domain(res.envelope))
+            else:
+                domain.in_flight -= 1
+            if domain is not None:
+                if domain.limiter is not None:
+                    domain.limiter.feedback(code for code, _ in res.failed.values())
+                self._forget(domain)
+            self._changed.notify_all()
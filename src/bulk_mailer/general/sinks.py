@@ -0,0 +1,214 @@
+from __future__ import annotations
+import json
+import time
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import Counter
+from pathlib import PurePath
+from threading import Lock
+from typing import Any, IO
+from .result import SendResult
+
+
+log = logging.getLogger()
+
+
+
+"""
+Receives the result of every sent envelope as it is produced, so that the outcome of a huge queue can be kept on disk
+instead of in memory. Subclasses implement write; close is called once the queue is finished.
+"""
+
+class ResultSink(ABC):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
+
+    @abstractmethod
+    def write(self, res: SendResult):
+        ...
+
+    def close(self):
+        pass
+
+
+# the outcome of every recipient of a result as (address, status, code, reply)
+def result_rows(res: SendResult) -> list[tuple[str, str, int | None, str | None]]:
+    if res.cancelled:
+        return [(p.email_address, 'cancelled', None, None) for p in res.envelope.all_recipients]
+    rows: list[tuple[str, str, int | None, str | None]] = []
+    rows.extend((p.email_address, 'already_sent' if p in res.already_sent else 'accepted', None, None) for p in res.succeeded)
+    rows.extend((p.email_address, 'rejected', code, msg.decode(errors='replace')) for p, (code, msg) in res.failed.items())
+    rows.extend((p.email_address, 'suppressed', None, None) for p in res.suppressed)
+    return rows
+
+
+
+"""
+Writes one JSON line per envelope: its key (if it has one) and the addresses by outcome.
+Lines are flushed to the OS every `flush_every` results.
+"""
+
+class JsonlSink(ResultSink):
+    file: IO[str]
+
+    def __init__(self, path: str | PurePath, flush_every: int = 1000) -> None:
+        self.path = path
+        self.flush_every = flush_every
+        self.file = open(path, 'a', encoding='utf-8')
+        self._unflushed = 0
+
+    def write(self, res: SendResult):
+        record: dict[str, Any] = {'time': round(time.time(), 3)}
+        if res.envelope.key is not None:
+            record['key'] = res.envelope.key
+        if res.cancelled:
+            record['cancelled'] = [p.email_address for p in res.envelope.all_recipients]
+        else:
+            ok = [p.email_address for p in res.succeeded if p not in res.already_sent]
+            if ok:
+                record['ok'] = ok
+            if res.failed:
+                record['failed'] = {p.email_address: [code, msg.decode(errors='replace')] for p, (code, msg) in res.failed.items()}
+            if res.already_sent:
+                record['already_sent'] = [p.email_address for p in res.already_sent]
+            if res.suppressed:
+                record['suppressed'] = [p.email_address for p in res.suppressed]
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.file.flush()
+            self._unflushed = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+
+"""
+Writes one row per recipient to the table `results` of an SQLite database, which can be queried afterwards, e.g.
+    SELECT code, count(*) FROM results WHERE status = 'rejected' GROUP BY code
+Rows are committed in batches of `batch` results.
+"""
+
+class SqliteSink(ResultSink):
+    def __init__(self, path: str | PurePath, batch: int = 1000) -> None:
+        self.path = path
+        self.batch = batch
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS results (time REAL NOT NULL, key TEXT, address TEXT NOT NULL, status TEXT NOT NULL, code INTEGER, reply TEXT)')
+        self._pending: list[tuple[float, str | None, str, str, int | None, str | None]] = []
+        self._results = 0
+
+    def write(self, res: SendResult):
+        now = time.time()
+        key = res.envelope.key
+        self._pending.extend((now, key, *row) for row in result_rows(res))
+        self._results += 1
+        if self._results >= self.batch:
+            self._commit()
+
+    def _commit(self):
+        with self._db:
+            self._db.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)', self._pending)
+        self._pending.clear()
+        self._results = 0
+
+    def close(self):
+        if self._pending:
+            self._commit()
+        self._db.close()
+
+
+# SQLite if the path ends in .db, .sqlite or .sqlite3, and JSONL otherwise
+def open_sink(path: str | PurePath) -> ResultSink:
+    if PurePath(path).suffix.lower() in ('.db', '.sqlite', '.sqlite3'):
+        return SqliteSink(path)
+    return JsonlSink(path)
+
+
+
+"""
+Counts of the results of a queue, in constant memory: per outcome, and the rejections per reply code.
+"""
+
+class ResultSummary:
+    def __init__(self) -> None:
+        self.envelopes = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.suppressed = 0
+        self.already_sent = 0
+        self.codes: Counter[int] = Counter()
+
+    def add(self, res: SendResult):
+        self.envelopes += 1
+        if res.cancelled:
+            self.cancelled += sum(1 for _ in res.envelope.all_recipients)
+            return
+        self.accepted += len(res.succeeded) - len(res.already_sent)
+        self.already_sent += len(res.already_sent)
+        self.rejected += len(res.failed)
+        self.suppressed += len(res.suppressed)
+        self.codes.update(code for code, _ in res.failed.values())
+
+    def __str__(self) -> str:
+        parts = [f"{self.envelopes} e-mails", f"{self.accepted} recipients accepted", f"{self.rejected} rejected"]
+        if self.codes:
+            parts[-1] += f" ({', '.join(f'{code}: {n}' for code, n in self.codes.most_common())})"
+        for name in ('cancelled', 'suppressed', 'already_sent'):
+            if getattr(self, name):
+                parts.append(f"{getattr(self, name)} {name.replace('_', ' ')}")
+        return ', '.join(parts)
+
+    def log(self):
+        level = logging.INFO if not self.rejected and not self.cancelled else logging.WARNING
+        if self.envelopes and not self.accepted and not self.already_sent:
+            level = logging.ERROR
+        log.log(level, f"Summary: {self}")
+
+
+
+"""
+Limits log records to `limit` per `interval` seconds, so that sending a huge queue does not produce millions of them.
+Records beyond the limit are dropped and counted; the count is logged when the next interval begins, and by flush.
+"""
+
+class LogSampler:
+    def __init__(self, limit: int = 100, interval: float = 60) -> None:
+        self.limit = limit
+        self.interval = interval
+        self.dropped = 0
+        self._logged = 0
+        self._window = time.monotonic()
+        self._lock = Lock()
+
+    # returns whether the next record may be logged
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window >= self.interval:
+                self._report()
+                self._window = now
+                self._logged = 0
+            if self._logged < self.limit:
+                self._logged += 1
+                return True
+            self.dropped += 1
+            return False
+
+    def _report(self):
+        if self.dropped:
+            log.info(f"{self.dropped} log records have been left out")
+            self.dropped = 0
+
+    def flush(self):
+        with self._lock:
+            self._report()
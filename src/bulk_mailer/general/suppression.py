@@ -0,0 +1,216 @@
+from __future__ import annotations
+import math
+import time
+import hashlib
+import logging
+import sqlite3
+from collections.abc import Iterable, Iterator
+from pathlib import PurePath
+from threading import Lock
+from typing import Any
+from bulk_mailer.entities import Emailable, normalize_address
+from .types import SendErrs
+
+
+log = logging.getLogger()
+
+# enhanced status codes (RFC 3463) of replies that refuse the message, not the recipient: message too big, media and content errors
+_MESSAGE_ERRORS = (b'5.3.4', b'5.6.')
+
+
+# 64-bit hash of a normalized address, as a signed integer so that it fits an SQLite INTEGER
+def address_hash(address: str) -> int:
+    return int.from_bytes(hashlib.blake2b(address.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+
+"""
+A Bloom filter over address hashes: answers "maybe contained" or "certainly not contained" with a fixed memory size.
+With `capacity` hashes added, a hash that was not added is reported as contained with probability about `error_rate`.
+The bit positions are derived from the address hash by double hashing, so the filter can be rebuilt from the stored hashes alone.
+"""
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01, data: bytes | None = None) -> None:
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1')
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        bits = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.bits = max(64, bits + -bits % 8)
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        if data is not None and len(data) != self.bits // 8:
+            raise ValueError('Filter data does not match the capacity')
+        self.data = bytearray(data) if data is not None else bytearray(self.bits // 8)
+
+    def _positions(self, h: int) -> Iterator[int]:
+        bits = self.bits
+        pos = (h & 0xFFFFFFFF) % bits
+        step = ((h >> 32) & 0xFFFFFFFF | 1) % bits
+        for _ in range(self.hashes):
+            yield pos
+            pos = (pos + step) % bits
+
+    def add(self, h: int):
+        data = self.data
+        for pos in self._positions(h):
+            data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, h: int) -> bool:
+        data, bits = self.data, self.bits
+        pos = (h & 0xFFFFFFFF) % bits
+        step = ((h >> 32) & 0xFFFFFFFF | 1) % bits
+        # most lookups of absent hashes stop at the first or second bit
+        for _ in range(self.hashes):
+            if not data[pos >> 3] & (1 << (pos & 7)):
+                return False
+            pos = (pos + step) % bits
+        return True
+
+
+
+"""
+An on-disk list of addresses that must not be sent to, e.g. unsubscribed and hard-bounced ones.
+It is an SQLite database keyed by a 64-bit hash of the normalized address, so lists of millions of addresses are looked up
+without loading them into memory. Entries can be added at any time, also while sending.
+
+With bloom, a Bloom filter in memory (about 1.2 bytes per address at the default error rate) answers most lookups of addresses
+that are not suppressed without touching the database. It is stored in the database when the list is closed,
+and rebuilt from the stored hashes when it is missing, e.g. after a crash, or has become too small.
+Two addresses with the same hash are indistinguishable; with 64-bit hashes, that is negligibly unlikely.
+"""
+
+class SuppressionList:
+    def __init__(self, path: str | PurePath, bloom: bool = True, bloom_error_rate: float = 0.01, cache_kb: int = 8192) -> None:
+        self.path = path
+        self.bloom_error_rate = bloom_error_rate
+        self._lock = Lock()
+        # shared by the sending threads; the lock serializes its use
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(f'PRAGMA cache_size = -{int(cache_kb)}')
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS suppressed (hash INTEGER PRIMARY KEY, address TEXT NOT NULL, reason TEXT NOT NULL, added REAL NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+        self._count = self._meta('count')
+        if self._count is None:
+            self._count = self._db.execute('SELECT count(*) FROM suppressed').fetchone()[0]
+        self._bloom = self._load_bloom() if bloom else None
+        self._bloom_stored = self._meta('bloom') is not None
+
+    def _meta(self, key: str) -> Any:
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_meta(self, key: str, value: Any):
+        self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    # the stored filter is dropped with the first change, so that a filter that misses entries is never loaded
+    def _changed(self):
+        self._set_meta('count', self._count)
+        if self._bloom_stored:
+            self._db.execute("DELETE FROM meta WHERE key = 'bloom'")
+            self._bloom_stored = False
+
+    def _load_bloom(self) -> BloomFilter:
+        capacity, data = self._meta('bloom_capacity'), self._meta('bloom')
+        if data is not None and self._count <= capacity:
+            try:
+                return BloomFilter(capacity, self.bloom_error_rate, data)
+            except ValueError:
+                pass
+        return self._build_bloom()
+
+    # with room to grow, so that appends do not degrade the filter right away
+    def _build_bloom(self) -> BloomFilter:
+        bloom = BloomFilter(max(2 * self._count, 100_000), self.bloom_error_rate)
+        if self._count:
+            log.info(f"Building the Bloom filter of {self._count} suppressed addresses")
+            for (h,) in self._db.execute('SELECT hash FROM suppressed'):
+                bloom.add(h)
+        return bloom
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, address: str | Emailable) -> bool:
+        h = address_hash(_normalize(address))
+        if self._bloom is not None and h not in self._bloom:
+            return False
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM suppressed WHERE hash = ?', (h,)).fetchone() is not None
+
+    # returns whether the address was not suppressed before
+    def add(self, address: str | Emailable, reason: str = '') -> bool:
+        return self.update([address], reason) == 1
+
+    # adds the addresses in one transaction; returns the number of new entries
+    def update(self, addresses: Iterable[str | Emailable], reason: str = '') -> int:
+        bloom = self._bloom
+        now = time.time()
+
+        def rows() -> Iterator[tuple[int, str, str, float]]:
+            for address in addresses:
+                address = _normalize(address)
+                h = address_hash(address)
+                if bloom is not None:
+                    bloom.add(h)
+                yield h, address, reason, now
+
+        with self._lock, self._db:
+            before = self._db.total_changes
+            self._db.executemany('INSERT OR IGNORE INTO suppressed VALUES (?, ?, ?, ?)', rows())
+            added = self._db.total_changes - before
+            self._count += added
+            self._changed()
+            if bloom is not None and self._count > bloom.capacity:
+                self._bloom = self._build_bloom()
+        return added
+
+    # adds the recipients that were permanently refused (5xx); returns the number of new entries
+    # refusals of the message rather than the address (e.g. 5.3.4, too large) are not bounces
+    def add_bounces(self, failed: SendErrs) -> int:
+        added = 0
+        for person, (code, msg) in failed.items():
+            if 500 <= code < 600 and not msg.startswith(_MESSAGE_ERRORS):
+                added += self.add(person, f"{code} {msg.decode(errors='replace')}")
+        if added:
+            log.info(f"Added {added} bounced addresses to the suppression list")
+        return added
+
+    # the Bloom filter keeps the address, but the database decides
+    def remove(self, address: str | Emailable) -> bool:
+        with self._lock, self._db:
+            removed = self._db.execute('DELETE FROM suppressed WHERE hash = ?', (address_hash(_normalize(address)),)).rowcount
+            self._count -= removed
+            self._changed()
+        return removed > 0
+
+    # returns the reason the address was suppressed for, None if it is not suppressed
+    def reason(self, address: str | Emailable) -> str | None:
+        with self._lock:
+            row = self._db.execute('SELECT reason FROM suppressed WHERE hash = ?', (address_hash(_normalize(address)),)).fetchone()
+        return row[0] if row is not None else None
+
+    # stores the Bloom filter, so that the next open does not rebuild it
+    def flush(self):
+        bloom = self._bloom
+        if bloom is None:
+            return
+        with self._lock, self._db:
+            self._set_meta('bloom', bytes(bloom.data))
+            self._set_meta('bloom_capacity', bloom.capacity)
+        self._bloom_stored = True
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+def _normalize(address: str | Emailable) -> str:
+    return address.key if isinstance(address, Emailable) else normalize_address(address)
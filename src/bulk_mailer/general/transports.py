@@ -0,0 +1,209 @@
+from __future__ import annotations
+import os
+import re
+import time
+import socket
+import logging
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from itertools import count
+from pathlib import Path, PurePath
+from threading import Lock
+from typing import Any, IO, TYPE_CHECKING
+from bulk_mailer.entities import Emailable
+from .envelope import Envelope
+from .types import Reply
+if TYPE_CHECKING:
+    from .mailer import PreparedMail
+
+
+log = logging.getLogger()
+
+# the envelope of a spooled message is kept in these headers, which are removed again when it is read
+ENVELOPE_FROM = b'X-Envelope-From'
+ENVELOPE_TO = b'X-Envelope-To'
+ENVELOPE_KEY = b'X-Envelope-Key'
+
+_MBOX_FROM = re.compile(rb'^(>*From )', re.MULTILINE)
+_MBOX_QUOTED_FROM = re.compile(rb'^>(>*From )', re.MULTILINE)
+_BARE_LF = re.compile(rb'(?<!\r)\n')
+
+
+
+"""
+Where the mailer hands its messages to, instead of an SMTP server (which is built into the mailer, see Mailer).
+Subclasses implement send, which returns the refused recipients like smtplib's sendmail; file transports accept every recipient.
+The mailer sends from `workers` threads at once.
+"""
+
+class Transport(ABC):
+    workers = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
+
+    @abstractmethod
+    def send(self, data: bytes, from_addr: str, to_addrs: list[str], key: str | None = None) -> dict[str, Reply]:
+        ...
+
+    def close(self):
+        pass
+
+
+# accepts and discards every message, e.g. for dry runs and measuring how fast messages are built
+class NullTransport(Transport):
+    def __init__(self) -> None:
+        self.messages = 0
+        self.bytes = 0
+        self._lock = Lock()
+
+    def send(self, data: bytes, from_addr: str, to_addrs: list[str], key: str | None = None) -> dict[str, Reply]:
+        with self._lock:
+            self.messages += 1
+            self.bytes += len(data)
+        return {}
+
+
+def spool_headers(from_addr: str, to_addrs: list[str], key: str | None) -> bytes:
+    lines = [ENVELOPE_FROM + b': ' + from_addr.encode() + b'\r\n']
+    lines.extend(ENVELOPE_TO + b': ' + addr.encode() + b'\r\n' for addr in to_addrs)
+    if key is not None:
+        lines.append(ENVELOPE_KEY + b': ' + key.encode() + b'\r\n')
+    return b''.join(lines)
+
+
+
+"""
+Writes every message to its own .eml file in `directory`, preceded by headers with its envelope, so it can be sent later (see read_spool).
+"""
+
+class EmlTransport(Transport):
+    def __init__(self, directory: str | PurePath) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # names sort in the order the messages were written
+        self._prefix = f"{int(time.time())}-{os.getpid()}"
+        self._seq = count()
+
+    def send(self, data: bytes, from_addr: str, to_addrs: list[str], key: str | None = None) -> dict[str, Reply]:
+        path = self.directory / f"{self._prefix}-{next(self._seq):09}.eml"
+        with open(path, 'wb') as f:
+            f.write(spool_headers(from_addr, to_addrs, key))
+            f.write(data)
+        return {}
+
+
+
+"""
+Delivers every message into a Maildir: written to tmp/ first and then moved to new/, so readers never see partial messages.
+"""
+
+class MaildirTransport(Transport):
+    def __init__(self, directory: str | PurePath) -> None:
+        self.directory = Path(directory)
+        for sub in ('tmp', 'new', 'cur'):
+            (self.directory / sub).mkdir(parents=True, exist_ok=True)
+        self._prefix = f"{int(time.time())}.P{os.getpid()}"
+        self._host = socket.gethostname().replace('/', r'\057').replace(':', r'\072')
+        self._seq = count()
+
+    def send(self, data: bytes, from_addr: str, to_addrs: list[str], key: str | None = None) -> dict[str, Reply]:
+        name = f"{self._prefix}Q{next(self._seq):09}.{self._host}"
+        tmp = self.directory / 'tmp' / name
+        with open(tmp, 'wb') as f:
+            f.write(spool_headers(from_addr, to_addrs, key))
+            f.write(data)
+        os.replace(tmp, self.directory / 'new' / name)
+        return {}
+
+
+
+"""
+Appends every message to an mbox file (mboxrd: lines starting with "From " are quoted with '>', which reading undoes).
+"""
+
+class MboxTransport(Transport):
+    file: IO[bytes]
+
+    def __init__(self, path: str | PurePath) -> None:
+        self.path = path
+        self.file = open(path, 'ab')
+        self._lock = Lock()
+
+    def send(self, data: bytes, from_addr: str, to_addrs: list[str], key: str | None = None) -> dict[str, Reply]:
+        body = (spool_headers(from_addr, to_addrs, key) + data).replace(b'\r\n', b'\n')
+        body = _MBOX_FROM.sub(rb'>\1', body)
+        if not body.endswith(b'\n'):
+            body += b'\n'
+        separator = f"From {from_addr or 'MAILER-DAEMON'} {time.asctime(time.gmtime())}\n".encode()
+        with self._lock:
+            self.file.write(separator + body + b'\n')
+        return {}
+
+    def close(self):
+        with self._lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+
+# reads messages written by one of the file transports back, ready to be sent with Mailer.send_prepared_iter
+# path is a Maildir (its new/ and cur/ messages), a directory of .eml files, or an mbox file
+def read_spool(path: str | PurePath) -> Iterator[PreparedMail]:
+    path = Path(path)
+    if path.is_dir():
+        if (path / 'new').is_dir() and (path / 'cur').is_dir():
+            files = sorted((path / 'new').iterdir()) + sorted((path / 'cur').iterdir())
+        else:
+            files = sorted(path.glob('*.eml'))
+        for file in files:
+            yield _unspool(file.read_bytes())
+    else:
+        for raw in _read_mbox(path):
+            yield _unspool(_BARE_LF.sub(b'\r\n', _MBOX_QUOTED_FROM.sub(rb'\1', raw)))
+
+
+def _read_mbox(path: Path) -> Iterator[bytes]:
+    lines: list[bytes] = []
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'From ') and (not lines or lines[-1] == b'\n'):
+                if lines:
+                    # the blank line before the separator belongs to the mbox format
+                    yield b''.join(lines[:-1])
+                lines = []
+                continue
+            lines.append(line)
+    if lines:
+        yield b''.join(lines[:-1] if lines[-1] == b'\n' else lines)
+
+
+def _unspool(raw: bytes) -> PreparedMail:
+    from .mailer import PreparedMail, is_international
+
+    from_addr = ''
+    to_addrs: list[str] = []
+    key: str | None = None
+    pos = 0
+    # the envelope headers come first
+    while True:
+        end = raw.index(b'\r\n', pos)
+        name, _, value = raw[pos:end].partition(b': ')
+        if name == ENVELOPE_FROM:
+            from_addr = value.decode()
+        elif name == ENVELOPE_TO:
+            to_addrs.append(value.decode())
+        elif name == ENVELOPE_KEY:
+            key = value.decode()
+        else:
+            break
+        pos = end + 2
+    if not to_addrs:
+        raise ValueError('Message has no envelope recipients')
+
+    data = raw[pos:]
+    to_people = [Emailable(addr) for addr in to_addrs]
+    return PreparedMail(Envelope(data, to_people, key=key), from_addr, to_people, data, is_international(from_addr, to_addrs))
@@ -1,5 +1,9 @@
+from email.message import EmailMessage
 from bulk_mailer.entities import Emailable
 
 Reply = tuple[int, bytes]
 SendErrs = dict[Emailable, Reply]
-SendSuccs = set[Emailable]
\ No newline at end of file
+SendSuccs = set[Emailable]
+
+# a message is either built, or already serialized to wire bytes (without From/To/Cc headers)
+Message = EmailMessage | bytes
@@ -1,5 +1,19 @@
 
 from .envelope import Envelope
 from .mailer import Mailer, SMTP_CONFIG
-from .queue import MailQueue
-from .result import SendResult
\ No newline at end of file
+from .async_mailer import AsyncMailer
+from .queue import MailQueue, StreamingMailQueue
+from .result import SendResult
+from .template import MessageTemplate
+from bulk_mailer.general.journal import Journal
+from bulk_mailer.general.retry import RetryPolicy
+from bulk_mailer.general.ratelimit import RateLimiter, Limit
+from bulk_mailer.general.relays import Relay
+from bulk_mailer.general.transports import Transport, NullTransport, EmlTransport, MaildirTransport, MboxTransport, read_spool
+from bulk_mailer.general.suppression import SuppressionList
+from bulk_mailer.general.sinks import ResultSink, JsonlSink, SqliteSink, ResultSummary, open_sink
+from bulk_mailer.general.scheduler import DomainScheduler, DomainPolicy
+from bulk_mailer.general.dkim import DkimSigner
+from bulk_mailer.general.pool import SessionPolicy
+from bulk_mailer.general.metrics import Metrics, MetricsExporter, ProgressReporter
+from .campaign import Campaign
@@ -0,0 +1,70 @@
+from collections.abc import Collection, Iterable, AsyncIterator, Sized
+from bulk_mailer.general.types import Message
+from bulk_mailer.general.mailer import SMTP_CONFIG, SendCancelled
+from bulk_mailer.general.async_mailer import AsyncMailer as GenericAsyncMailer, gather_ordered
+from bulk_mailer.entities import Emailable
+from typing import Any
+import logging
+from bulk_mailer.general.ratelimit import RateLimiter
+from .envelope import Envelope
+from .mailer import log_summary
+from .result import SendResult
+from .types import Error
+
+
+log = logging.getLogger()
+
+
+
+class AsyncMailer:
+    def __init__(self, config: SMTP_CONFIG, sender: Emailable, confirm_send: bool = False, delay_secs: float = 0, detailed_log: bool = True, connections: int = 1, rate_limit: RateLimiter | None = None) -> None:
+        self.mailer = GenericAsyncMailer(config, sender, confirm_send, delay_secs=delay_secs, detailed_log=detailed_log, connections=connections, rate_limit=rate_limit)
+        self.detailed_log = detailed_log
+
+    async def __aenter__(self):
+        await self.mailer.__aenter__()
+        return self
+
+    async def __aexit__(self, *args: Any):
+        await self.mailer.__aexit__(*args)
+
+    # returns reply if error
+    # returns None if success
+    async def send_mail(self, msg: Message, to: Emailable) -> Error:
+        _, failed = await self.mailer.send_mail(msg, to)
+        return next(iter(failed.values())) if failed else None
+
+    async def send_envelope(self, env: Envelope) -> SendResult:
+        cancelled = False
+        try:
+            error = await self.send_mail(env.msg, env.to)
+        except SendCancelled:
+            cancelled = True
+            error = None
+        return SendResult(env, error, cancelled)
+
+    async def send_queue_iter(self, queue: Iterable[Envelope]) -> AsyncIterator[SendResult]:
+        async for result in gather_ordered(self.send_envelope, queue, self.mailer.size):
+            yield result
+
+    async def send_queue(self, queue: Iterable[Envelope]) -> tuple[Collection[Emailable], Collection[Emailable], Collection[Emailable]]:
+        succeeded: set[Emailable] = set()
+        failed: set[Emailable] = set()
+        cancelled: set[Emailable] = set()
+
+        if isinstance(queue, Sized):
+            log.info(f"Sending {len(queue)} queued personal e-mails")
+        else:
+            log.info(f"Sending queued personal e-mails")
+
+        async for res in self.send_queue_iter(queue):
+            to = res.envelope.to
+            if res.cancelled:
+                cancelled.add(to)
+            elif res.error:
+                failed.add(to)
+            else:
+                succeeded.add(to)
+
+        log_summary(succeeded, failed, cancelled, self.detailed_log)
+        return succeeded, failed, cancelled
@@ -0,0 +1,162 @@
+from __future__ import annotations
+import os
+import logging
+from collections.abc import Callable, Collection, Iterable, Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from itertools import islice
+from multiprocessing.util import Finalize
+from typing import Any, TypeVar
+from bulk_mailer.entities import Emailable, Person
+from bulk_mailer.general.mailer import SMTP_CONFIG, invalid_message_reply
+from bulk_mailer.general.ratelimit import RateLimiter
+from bulk_mailer.general.relays import Relay
+from bulk_mailer.general.dkim import DkimSigner
+from bulk_mailer.general.pool import SessionPolicy
+from bulk_mailer.general.retry import RetryPolicy
+from bulk_mailer.general.types import Message
+from .envelope import Envelope
+from .mailer import Mailer, log_summary
+from .types import Error
+
+
+log = logging.getLogger()
+
+_RecipientType = TypeVar('_RecipientType', bound=Person)
+
+# what a worker reports per e-mail: (recipient, error, cancelled)
+Outcome = tuple[Emailable, Error, bool]
+
+
+# the mailer of a worker process and the function that builds its e-mails
+_mailer: Mailer | None = None
+_get_mail: Callable[[Any], Message] | None = None
+
+
+def _init_worker(config: SMTP_CONFIG | Sequence[Relay], sender: Emailable, get_mail: Callable[[Any], Message], mailer_args: dict[str, Any]):
+    global _mailer, _get_mail
+    _mailer = Mailer(config, sender, **mailer_args)
+    _get_mail = get_mail
+    # disconnect when the worker exits
+    Finalize(None, _mailer.mailer.quit, exitpriority=10)
+
+
+# recipients whose e-mail cannot be built (get_mail raises ValueError) are reported as failed
+def _send_shard(recipients: list[Any]) -> list[Outcome]:
+    assert _mailer is not None and _get_mail is not None
+    get_mail = _get_mail
+    invalid: list[Outcome] = []
+
+    def queue() -> Iterator[Envelope]:
+        for r in recipients:
+            try:
+                msg = get_mail(r)
+            except ValueError as e:
+                log.error(f"E-mail to {r} not sent: {e}")
+                invalid.append((r, invalid_message_reply(e), False))
+                continue
+            yield Envelope(msg, r)
+
+    outcomes = [(res.envelope.to, res.error, res.cancelled) for res in _mailer.send_queue_iter(queue())]
+    return outcomes + invalid
+
+
+def _shards(items: Iterable[_RecipientType], size: int) -> Iterator[list[_RecipientType]]:
+    iterator = iter(items)
+    while shard := list(islice(iterator, size)):
+        yield shard
+
+
+
+"""
+Sends personal e-mails from several processes, so that building the messages is not limited to one CPU core.
+The recipients are split into shards of `shard_size`, which are sent by `processes` worker processes. Every worker has its own mailer
+(with `connections` SMTP connections, `retry`, `lookahead`, `dkim` and `session` as for Mailer) and a 1/processes share of the rate limit,
+and of the rate limits of the relays if config is a list of relays.
+At most 2*processes shards are in flight, so the recipients may be a lazy iterable. Outcomes arrive per shard, not in recipient order.
+
+get_mail (e.g. a MessageTemplate) is passed to the workers, so it has to be picklable unless the processes are forked (the default on Linux).
+E-mails cannot be confirmed from the workers; review them beforehand instead.
+"""
+
+class Campaign:
+    def __init__(self,
+                 config: SMTP_CONFIG | Sequence[Relay],
+                 sender: Emailable,
+                 processes: int | None = None,
+                 shard_size: int = 100,
+                 delay_secs: float = 0,
+                 detailed_log: bool = True,
+                 connections: int = 1,
+                 retry: RetryPolicy | None = None,
+                 rate_limit: RateLimiter | None = None,
+                 lookahead: int = 0,
+                 dkim: DkimSigner | None = None,
+                 session: SessionPolicy | None = None
+                 ) -> None:
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes < 1:
+            raise ValueError('Number of processes must be at least 1')
+        if rate_limit is None and delay_secs > 0:
+            rate_limit = RateLimiter.fixed_delay(delay_secs)
+        self.config = config
+        self.sender = sender
+        self.processes = processes
+        self.shard_size = shard_size
+        self.detailed_log = detailed_log
+        self.connections = connections
+        self.retry = retry
+        self.rate_limit = rate_limit
+        self.lookahead = lookahead
+        self.dkim = dkim
+        self.session = session
+
+    def send_iter(self, recipients: Iterable[_RecipientType], get_mail: Callable[[_RecipientType], Message]) -> Iterator[Outcome]:
+        mailer_args = {
+            'detailed_log': False,
+            'connections': self.connections,
+            'retry': self.retry,
+            'rate_limit': self.rate_limit.split(self.processes) if self.rate_limit is not None else None,
+            'lookahead': self.lookahead,
+            'dkim': self.dkim,
+            'session': self.session,
+        }
+        config = self.config if isinstance(self.config, SMTP_CONFIG) else [relay.split(self.processes) for relay in self.config]
+        with ProcessPoolExecutor(self.processes, initializer=_init_worker, initargs=(config, self.sender, get_mail, mailer_args)) as executor:
+            pending: set[Future[list[Outcome]]] = set()
+            try:
+                for shard in _shards(recipients, self.shard_size):
+                    pending.add(executor.submit(_send_shard, shard))
+                    if len(pending) >= 2 * self.processes:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield from future.result()
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    # returns (succeeded, failed, cancelled) like Mailer.send_queue
+    def send(self, recipients: Iterable[_RecipientType], get_mail: Callable[[_RecipientType], Message]) -> tuple[Collection[Emailable], Collection[Emailable], Collection[Emailable]]:
+        succeeded: set[Emailable] = set()
+        failed: set[Emailable] = set()
+        cancelled: set[Emailable] = set()
+
+        if isinstance(recipients, Collection):
+            log.info(f"Sending {len(recipients)} personal e-mails from {self.processes} processes")
+        else:
+            log.info(f"Sending personal e-mails from {self.processes} processes")
+
+        for recipient, error, was_cancelled in self.send_iter(recipients, get_mail):
+            if was_cancelled:
+                cancelled.add(recipient)
+            elif error:
+                failed.add(recipient)
+            else:
+                succeeded.add(recipient)
+
+        log_summary(succeeded, failed, cancelled, self.detailed_log)
+        return succeeded, failed, cancelled
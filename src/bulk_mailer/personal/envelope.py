@@ -1,7 +1,8 @@
-from email.message import EmailMessage
 from bulk_mailer.entities import Emailable
+from bulk_mailer.general.types import Message
 
 class Envelope:
-    def __init__(self, msg: EmailMessage, to: Emailable) -> None:
+    def __init__(self, msg: Message, to: Emailable, key: str | None = None) -> None:
         self.msg = msg
         self.to = to
+        self.key = key
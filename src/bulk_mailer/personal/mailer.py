@@ -1,10 +1,25 @@
-from collections.abc import Collection
-from email.message import EmailMessage
-from bulk_mailer.general.mailer import SMTP_CONFIG, Mailer as GenericMailer, SendCancelled
+from collections import OrderedDict
+from collections.abc import Collection, Iterable, Iterator, Sequence, Sized
+from bulk_mailer.general.types import Message
+from bulk_mailer.general.mailer import SMTP_CONFIG, Mailer as GenericMailer, serialize_message
+from bulk_mailer.general.envelope import Envelope as GeneralEnvelope
+from bulk_mailer.general.journal import Journal
+from bulk_mailer.general.result import SendResult as GeneralSendResult
+from bulk_mailer.general.retry import RetryPolicy
+from bulk_mailer.general.ratelimit import RateLimiter
+from bulk_mailer.general.relays import Relay
+from bulk_mailer.general.transports import Transport
+from bulk_mailer.general.suppression import SuppressionList
+from bulk_mailer.general.sinks import LogSampler, ResultSink, ResultSummary
+from bulk_mailer.general.scheduler import DomainScheduler
+from bulk_mailer.general.dkim import DkimSigner
+from bulk_mailer.general.pool import SessionPolicy
+from bulk_mailer.general.metrics import Metrics, ProgressReporter
 from bulk_mailer.entities import Emailable
 from typing import Any
+import hashlib
 import logging
-from .queue import MailQueue
+from .envelope import Envelope
 from .result import SendResult
 from .types import Error
 
@@ -13,10 +28,46 @@ log = logging.getLogger()
 
 
 
+# with a sampler, only as many recipients are listed as it allows
+def log_summary(succeeded: Collection[Emailable], failed: Collection[Emailable], cancelled: Collection[Emailable], detailed_log: bool, sampler: LogSampler | None = None):
+    if succeeded:
+        if failed:
+            level = logging.WARNING
+        else:
+            level = logging.INFO if not cancelled else logging.WARNING
+    else:
+        level = logging.ERROR
+
+    log.log(level, f"Sending queue finished ({len(succeeded)} successful, {len(failed)} failed, {len(cancelled)} cancelled)")
+    if detailed_log or log.isEnabledFor(logging.DEBUG):
+        allow = sampler.allow if sampler is not None else lambda: True
+        for recipient in succeeded:
+            if allow():
+                log.info(f"   SUCCEEDED:  {recipient}")
+        for recipient in failed:
+            if allow():
+                log.error(f"   FAILED:  {recipient}")
+        for recipient in cancelled:
+            if allow():
+                log.warning(f"   CANCELLED:  {recipient}")
+        if sampler is not None:
+            sampler.flush()
+
+
+
 class Mailer:
-    def __init__(self, config: SMTP_CONFIG, sender: Emailable, confirm_send: bool = False, delay_secs: float = 0, detailed_log: bool = True) -> None:
-        self.mailer = GenericMailer(config, sender, confirm_send, delay_secs=delay_secs, detailed_log=detailed_log)
+    # dedupe > 0 reads up to that many queued e-mails ahead, and sends those with identical content to all their recipients at once,
+    # as one e-mail with many RCPT TO (see _grouped); max_recipients limits the recipients per transaction, as for the general Mailer
+    def __init__(self, config: SMTP_CONFIG | Sequence[Relay] | Transport, sender: Emailable, confirm_send: bool = False, delay_secs: float = 0, detailed_log: bool = True, connections: int = 1, retry: RetryPolicy | None = None, rate_limit: RateLimiter | None = None, metrics: Metrics | None = None, lookahead: int = 0, serializers: int = 1, suppression: SuppressionList | None = None, log_limit: int | None = 100, scheduler: DomainScheduler | None = None, dkim: DkimSigner | None = None, dedupe: int = 0, max_recipients: int | None = None, session: SessionPolicy | None = None) -> None:
+        self.mailer = GenericMailer(config, sender, confirm_send, delay_secs=delay_secs, detailed_log=detailed_log, connections=connections, retry=retry, rate_limit=rate_limit, max_recipients=max_recipients, metrics=metrics, lookahead=lookahead, serializers=serializers, suppression=suppression, log_limit=log_limit, scheduler=scheduler, dkim=dkim, session=session)
         self.detailed_log = detailed_log
+        self.dedupe = dedupe
+        # the counts of the last sent queue
+        self.summary: ResultSummary | None = None
+
+    @property
+    def metrics(self) -> Metrics:
+        return self.mailer.metrics
 
     def __enter__(self):
         self.mailer.__enter__()
@@ -27,53 +78,112 @@ class Mailer:
 
     # returns reply if error
     # returns None if success
-    def send_mail(self, msg: EmailMessage, to: Emailable) -> Error:
+    def send_mail(self, msg: Message, to: Emailable) -> Error:
         _, failed = self.mailer.send_mail(msg, to)
         return next(iter(failed.values())) if failed else None
 
-    def send_queue_iter(self, queue: MailQueue):
+    def send_envelope(self, env: Envelope, journal: Journal | None = None, resume: bool = True) -> SendResult:
+        res = self.mailer.send_envelope(GeneralEnvelope(env.msg, env.to, key=env.key), journal, resume)
+        return self._to_personal(env, res)
+
+    # the result of the recipient of env, which may be one of several recipients of the general envelope
+    @staticmethod
+    def _to_personal(env: Envelope, res: GeneralSendResult) -> SendResult:
+        return SendResult(env, res.failed.get(env.to), res.cancelled, already_sent=env.to in res.already_sent, suppressed=env.to in res.suppressed)
+
+    # with dedupe, results arrive per group of identical e-mails, so not quite in queue order
+    def send_queue_iter(self, queue: Iterable[Envelope], journal: Journal | None = None, resume: bool = True) -> Iterable[SendResult]:
+        for envs, res in self._send_queue_iter(queue, journal, resume):
+            for env in envs:
+                yield self._to_personal(env, res)
+
+    # yields the results of the general mailer with the personal envelopes they belong to
+    def _send_queue_iter(self, queue: Iterable[Envelope], journal: Journal | None, resume: bool) -> Iterator[tuple[list[Envelope], GeneralSendResult]]:
+        # the general mailer sends (and possibly retries) the envelopes; results are mapped back to the personal envelopes
+        origins: dict[GeneralEnvelope, list[Envelope]] = {}
+
+        def general_envelopes() -> Iterator[GeneralEnvelope]:
+            for env in queue:
+                general = GeneralEnvelope(env.msg, env.to, key=env.key)
+                origins[general] = [env]
+                yield general
+
+        envelopes = self._grouped(queue, origins) if self.dedupe > 0 else general_envelopes()
+        for res in self.mailer.send_queue_iter(envelopes, journal, resume):
+            yield origins.pop(res.envelope), res
+
+    # groups e-mails whose messages are identical once serialized without From and To, i.e. that differ only in the recipient
+    # a group is sent when `dedupe` e-mails are waiting, oldest group first, so a group has at most that many recipients
+    def _grouped(self, queue: Iterable[Envelope], origins: dict[GeneralEnvelope, list[Envelope]]) -> Iterator[GeneralEnvelope]:
+        # keyed by the serialized message itself, so only truly identical messages are grouped
+        groups: OrderedDict[bytes, list[Envelope]] = OrderedDict()
+        waiting = 0
         for env in queue:
-            cancelled = False
-            try:
-                error = self.send_mail(env.msg, env.to)
-            except SendCancelled:
-                cancelled = True
-                error = None
-            result = SendResult(env, error, cancelled)
-            yield result
+            data = serialize_message(env.msg)
+            group = groups.get(data)
+            if group is None:
+                group = groups[data] = []
+            group.append(env)
+            waiting += 1
+            if waiting >= self.dedupe:
+                data, group = groups.popitem(last=False)
+                waiting -= len(group)
+                yield self._group_envelope(data, group, origins)
+        while groups:
+            data, group = groups.popitem(last=False)
+            yield self._group_envelope(data, group, origins)
+
+    @staticmethod
+    def _group_envelope(data: bytes, group: list[Envelope], origins: dict[GeneralEnvelope, list[Envelope]]) -> GeneralEnvelope:
+        if len(group) == 1:
+            general = GeneralEnvelope(data, group[0].to, key=group[0].key)
+        else:
+            # the recipients do not see each other; the journal records them under a hash of the content
+            general = GeneralEnvelope(data, [], bcc=[env.to for env in group], key=hashlib.blake2b(data, digest_size=16).hexdigest())
+        origins[general] = group
+        return general
     
-    def send_queue(self, queue: MailQueue) -> tuple[Collection[Emailable], Collection[Emailable], Collection[Emailable]]:
+    # every result is written to the sink, and the counts of the results are kept in summary
+    # without collect, the recipients are not gathered, so that memory use does not grow with the queue; the returned collections are empty then
+    def send_queue(self, queue: Iterable[Envelope], journal: Journal | None = None, resume: bool = True, progress: ProgressReporter | None = None, sink: ResultSink | None = None, collect: bool = True) -> tuple[Collection[Emailable], Collection[Emailable], Collection[Emailable]]:
         succeeded: set[Emailable] = set()
         failed: set[Emailable] = set()
         cancelled: set[Emailable] = set()
+        summary = self.summary = ResultSummary()
 
-        log.info(f"Sending {len(queue)} queued personal e-mails")
-
-        for res in self.send_queue_iter(queue):
-            to = res.envelope.to
-            if res.cancelled:
-                cancelled.add(to)
-            elif res.error:
-                failed.add(to)
-            else:
-                succeeded.add(to)
-
-        if succeeded:
-            if failed:
-                level = logging.WARNING
-            else:
-                level = logging.INFO if not cancelled else logging.WARNING
+        if isinstance(queue, Sized):
+            log.info(f"Sending {len(queue)} queued personal e-mails")
         else:
-            level = logging.ERROR
+            log.info(f"Sending queued personal e-mails")
+        if progress is not None:
+            progress.start(len(queue) if isinstance(queue, Sized) else None)
 
-        log.log(level, f"Sending queue finished ({len(succeeded)} successful, {len(failed)} failed, {len(cancelled)} cancelled)")
-        if self.detailed_log or log.isEnabledFor(logging.DEBUG):
-            for recipient in succeeded:
-                log.info(f"   SUCCEEDED:  {recipient}")
-            for recipient in failed:
-                log.error(f"   FAILED:  {recipient}")
-            for recipient in cancelled:
-                log.warning(f"   CANCELLED:  {recipient}")
+        for envs, general in self._send_queue_iter(queue, journal, resume):
+            summary.add(general)
+            if sink is not None:
+                sink.write(general)
+            for env in envs:
+                res = self._to_personal(env, general)
+                if progress is not None:
+                    progress.update(failed=res.error is not None, cancelled=res.cancelled)
+                if not collect:
+                    continue
+                to = res.envelope.to
+                if res.cancelled:
+                    cancelled.add(to)
+                elif res.error:
+                    failed.add(to)
+                elif not res.suppressed:
+                    succeeded.add(to)
 
+        sampler = self.mailer.log_sampler
+        if sampler is not None:
+            sampler.flush()
+        if collect:
+            log_summary(succeeded, failed, cancelled, self.detailed_log, sampler)
+            if summary.suppressed:
+                log.warning(f"{summary.suppressed} suppressed recipients were not sent to")
+        else:
+            summary.log()
         return succeeded, failed, cancelled
 
@@ -1,9 +1,15 @@
-from collections.abc import Collection
-from typing import Any, TypeVar, Callable
+from __future__ import annotations
+from collections import deque
+from collections.abc import Collection, Iterable, Iterator
+from typing import Any, TypeVar, Callable, TYPE_CHECKING
 from .envelope import Envelope
-from email.message import EmailMessage
+from bulk_mailer.general.types import Message
 from bulk_mailer.entities import Person
+from bulk_mailer.general.envelope import Envelope as GeneralEnvelope
+from bulk_mailer.utils import ask_mail_confirmation, review_mails
 import logging
+if TYPE_CHECKING:
+    from bulk_mailer.general.suppression import SuppressionList
 
 
 log = logging.getLogger()
@@ -11,10 +17,17 @@ log = logging.getLogger()
 _RecipientType = TypeVar('_RecipientType', bound=Person)
 
 
+def _confirm(env: Envelope) -> bool:
+    return ask_mail_confirmation(GeneralEnvelope(env.msg, env.to), "Accept", "Reject")
+
+
 class MailQueue(Collection[Envelope]):
-    def __init__(self, confirm_mails: bool = False, detailed_log: bool = True) -> None:
-        self.queue = MailQueue(confirm_mails)
+    # recipients on the suppression list are not added, and their e-mails are not built
+    def __init__(self, confirm_mails: bool = False, detailed_log: bool = True, suppression: SuppressionList | None = None) -> None:
+        self.queue: list[Envelope] = []
+        self.confirm_mails = confirm_mails
         self.detailed_log = detailed_log
+        self.suppression = suppression
 
     def __contains__(self, item: Any):
         return item in self.queue
@@ -25,29 +38,110 @@ class MailQueue(Collection[Envelope]):
     def __len__(self):
         return len(self.queue)
 
-    def add(self, msg: EmailMessage, to: Person) -> bool:
-        return self.queue.add(msg, to)
-    
-    def add_for(self, recipients: Collection[_RecipientType], get_mail: Callable[[_RecipientType], EmailMessage]):
-        log.info(f"Adding {len(recipients)} e-mails to queue")
+    def add(self, msg: Message, to: Person) -> bool:
+        if self.suppression is not None and to in self.suppression:
+            log.debug(f"Mail not added: {to} is suppressed")
+            return False
+        envelope = Envelope(msg, to)
+        if self.confirm_mails and not _confirm(envelope):
+            log.debug("Mail rejected")
+            return False
+        self.queue.append(envelope)
+        return True
+
+    # lets the user review all queued e-mails in one session instead of confirming every single one; rejected e-mails are removed
+    # send the queue with confirm_send=False afterwards, so that it is sent without further interruptions
+    # returns the number of approved e-mails
+    def review(self, page_size: int = 20) -> int:
+        approved = review_mails([GeneralEnvelope(env.msg, env.to) for env in self.queue], page_size)
+        rejected = [env for i, env in enumerate(self.queue) if i not in approved]
+        self.queue = [env for i, env in enumerate(self.queue) if i in approved]
+
+        if rejected:
+            log.warning(f"{len(self.queue)} of {len(self.queue) + len(rejected)} e-mails have been approved")
+        else:
+            log.info(f"All e-mails have been approved")
+        if self.detailed_log or log.isEnabledFor(logging.DEBUG):
+            for env in rejected:
+                log.warning(f"   REJECTED:  {env.to}")
+        return len(self.queue)
+
+    def add_for(self, recipients: Iterable[_RecipientType], get_mail: Callable[[_RecipientType], Message]):
+        if isinstance(recipients, Collection):
+            log.info(f"Adding {len(recipients)} e-mails to queue")
 
-        cancelled: set[_RecipientType] = set()
+        total = 0
+        suppressed = 0
+        accepted: list[_RecipientType] = []
+        cancelled: list[_RecipientType] = []
         for r in recipients:
+            total += 1
+            if self.suppression is not None and r in self.suppression:
+                suppressed += 1
+                continue
             mail = get_mail(r)
-            is_accepted = self.add(mail, r)
-            if not is_accepted:
-                cancelled.add(r)
-        accepted: set[_RecipientType] = set(recipients) - cancelled
+            if self.add(mail, r):
+                accepted.append(r)
+            else:
+                cancelled.append(r)
 
         if not accepted:
             log.error(f"No e-mails have been added to the queue")
         elif cancelled:
-            log.warning(f"{len(accepted)} of {len(recipients)} e-mails have been added to queue")
+            log.warning(f"{len(accepted)} of {total} e-mails have been added to queue")
         else:
             log.info(f"All e-mails have been added to the queue")
+        if suppressed:
+            log.warning(f"{suppressed} suppressed recipients have been left out")
 
         if self.detailed_log or log.isEnabledFor(logging.DEBUG):
             for recipient in accepted:
                 log.info(f"   ACCEPTED:  {recipient}")
             for recipient in cancelled:
                 log.warning(f"   CANCELLED:  {recipient}")
+
+
+
+"""
+A queue that does not store messages.
+Recipients are only pulled from the added iterables, and their messages only built, when the queue is iterated, i.e. just before sending.
+Each added source is consumed exactly once, so iterating the queue drains it.
+Recipients on the suppression list are skipped before their messages are built; `suppressed` counts them.
+Recipients whose message cannot be built (get_mail raises ValueError, e.g. for a header value with CR or LF) are skipped; `invalid` counts them.
+"""
+
+class StreamingMailQueue(Iterable[Envelope]):
+    def __init__(self, confirm_mails: bool = False, detailed_log: bool = True, suppression: SuppressionList | None = None) -> None:
+        # a deque, so that draining does not get slower with many single add() calls
+        self.sources: deque[tuple[Iterable[Any], Callable[[Any], Message]]] = deque()
+        self.confirm_mails = confirm_mails
+        self.detailed_log = detailed_log
+        self.suppression = suppression
+        self.suppressed = 0
+        self.invalid = 0
+
+    def add(self, msg: Message, to: Person):
+        self.sources.append(([to], lambda _: msg))
+
+    def add_for(self, recipients: Iterable[_RecipientType], get_mail: Callable[[_RecipientType], Message]):
+        self.sources.append((recipients, get_mail))
+
+    def __iter__(self) -> Iterator[Envelope]:
+        while self.sources:
+            recipients, get_mail = self.sources.popleft()
+            for r in recipients:
+                if self.suppression is not None and r in self.suppression:
+                    self.suppressed += 1
+                    log.debug(f"Skipping suppressed recipient {r}")
+                    continue
+                try:
+                    envelope = Envelope(get_mail(r), r)
+                except ValueError as e:
+                    self.invalid += 1
+                    log.error(f"Skipping {r}, whose e-mail cannot be built: {e}")
+                    continue
+                if self.confirm_mails and not _confirm(envelope):
+                    if self.detailed_log or log.isEnabledFor(logging.DEBUG):
+                        log.warning(f"   CANCELLED:  {r}")
+                    continue
+                yield envelope
@@ -3,7 +3,11 @@ from .types import Error
 
 
 class SendResult:
-    def __init__(self, envelope: Envelope, error: Error, cancelled: bool) -> None:
+    # already_sent: the journal recorded the recipient as delivered in an earlier run, so it was not sent again
+    # suppressed: the recipient is on the suppression list, so the e-mail was not sent
+    def __init__(self, envelope: Envelope, error: Error, cancelled: bool, already_sent: bool = False, suppressed: bool = False) -> None:
         self.envelope = envelope
         self.error = error
         self.cancelled = cancelled
+        self.already_sent = already_sent
+        self.suppressed = suppressed
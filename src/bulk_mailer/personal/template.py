@@ -0,0 +1,118 @@
+from __future__ import annotations
+import base64
+import re
+import secrets
+from collections.abc import Collection, Mapping
+from pathlib import PurePath
+from string import Formatter
+from typing import Any
+from bulk_mailer.entities import Emailable
+from bulk_mailer.utils import AttachmentCache, attachment_cache, encode_header, message_to_bytes
+
+
+_EOL = re.compile(r'\r\n|\n|\r')
+
+
+class _Fields(Mapping[str, Any]):
+    def __init__(self, recipient: Emailable, extra: Mapping[str, Any]) -> None:
+        self.recipient = recipient
+        self.extra = extra
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.extra:
+            return self.extra[key]
+        try:
+            return getattr(self.recipient, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return iter(self.extra)
+
+    def __len__(self):
+        return len(self.extra)
+
+
+def _has_fields(text: str) -> bool:
+    return any(field is not None for _, field, _, _ in Formatter().parse(text))
+
+
+def _encode_body(text: str) -> tuple[bytes, bytes]:
+    # returns (content-transfer-encoding, encoded body)
+    lines = _EOL.split(text)
+    if text.isascii() and all(len(line) <= 998 for line in lines):
+        return b'7bit', '\r\n'.join(lines).encode('ascii') + b'\r\n'
+    return b'base64', base64.encodebytes(text.encode('utf-8')).replace(b'\n', b'\r\n')
+
+
+
+"""
+A plain text e-mail with placeholders, e.g. "Dear {first_name}".
+Placeholders are filled from the attributes of the recipient (first_name, last_name, email_address, ...) and from extra fields.
+
+Subject, body and attachments are parsed and the static parts serialized once; render() only encodes the parts that contain placeholders,
+and returns the message as wire bytes that the mailer sends without building an EmailMessage.
+A template can be passed directly as get_mail to MailQueue.add_for.
+"""
+
+class MessageTemplate:
+    def __init__(self,
+                 subject: str,
+                 body: str,
+                 attachments: str | PurePath | Collection[str|PurePath] | None = None,
+                 cache: AttachmentCache | None = attachment_cache
+                 ) -> None:
+        if attachments is None:
+            attachments = []
+        if isinstance(attachments, str | PurePath):
+            attachments = [attachments]
+
+        self.subject = subject
+        self.body = body
+
+        self._subject_dynamic = _has_fields(subject)
+        self._body_dynamic = _has_fields(body)
+        self._subject_bytes = b'' if self._subject_dynamic else encode_header("Subject", subject)
+        self._body_bytes = b'' if self._body_dynamic else self._encode_text_part(body)
+
+        if not attachments:
+            self._boundary = None
+            self._head = b'MIME-Version: 1.0\r\n'
+            self._tail = b''
+            return
+
+        cache = cache if cache is not None else AttachmentCache(max_bytes=0)
+        self._boundary = ('=' * 15 + secrets.token_hex(16) + '==').encode('ascii')
+        self._head = b'MIME-Version: 1.0\r\nContent-Type: multipart/mixed; boundary="' + self._boundary + b'"\r\n'
+        self._tail = b''.join(
+            b'--' + self._boundary + b'\r\n' + message_to_bytes(cache.get(a)) + b'\r\n'
+            for a in attachments
+        ) + b'--' + self._boundary + b'--\r\n'
+
+    @staticmethod
+    def _encode_text_part(text: str) -> bytes:
+        cte, body = _encode_body(text)
+        return b'Content-Type: text/plain; charset="utf-8"\r\nContent-Transfer-Encoding: ' + cte + b'\r\n\r\n' + body
+
+    def render(self, recipient: Emailable, fields: Mapping[str, Any] | None = None) -> bytes:
+        values = _Fields(recipient, fields or {})
+
+        if self._subject_dynamic:
+            subject = encode_header("Subject", self.subject.format_map(values))
+        else:
+            subject = self._subject_bytes
+
+        if self._body_dynamic:
+            body = self._encode_text_part(self.body.format_map(values))
+        else:
+            body = self._body_bytes
+
+        if self._boundary is None:
+            return subject + self._head + body
+
+        if b'--' + self._boundary in body:
+            # practically impossible, but the body must never contain the boundary
+            raise ValueError('Rendered body contains the multipart boundary')
+        return subject + self._head + b'\r\n--' + self._boundary + b'\r\n' + body + self._tail
+
+    __call__ = render
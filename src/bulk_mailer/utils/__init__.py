@@ -1,2 +1,3 @@
 
-from .utils import ask_mail_confirmation, mail_to_str, create_plain_mail
\ No newline at end of file
+from .utils import ask_mail_confirmation, review_mails, mail_subject, mail_to_str, create_plain_mail, message_to_bytes, encode_header
+from .attachments import AttachmentCache, attachment_cache
@@ -0,0 +1,93 @@
+from __future__ import annotations
+import os
+import mmap
+import hashlib
+from collections import OrderedDict
+from email.message import EmailMessage
+from email.policy import default
+from mimetypes import guess_type
+from pathlib import PurePath
+from threading import Lock
+
+
+"""
+Caches encoded attachment parts, so that a file that is attached to many e-mails is only read and encoded once.
+Entries are keyed by path, modification time and size (or by content hash with by_hash=True), so a changed file is never served from the cache.
+The least recently used entries are evicted when the encoded parts exceed max_bytes.
+
+The returned parts are shared between messages and must not be modified.
+"""
+
+class AttachmentCache:
+    def __init__(self, max_bytes: int = 64 * 2**20, mmap_threshold: int = 2**20, by_hash: bool = False) -> None:
+        self.max_bytes = max_bytes
+        self.mmap_threshold = mmap_threshold
+        self.by_hash = by_hash
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._parts: OrderedDict[tuple[object, ...], tuple[EmailMessage, int]] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._parts)
+
+    def clear(self):
+        with self._lock:
+            self._parts.clear()
+            self.size = 0
+
+    def get(self, path: str | PurePath) -> EmailMessage:
+        path = PurePath(path)
+        stat = os.stat(path)
+        if self.by_hash:
+            key: tuple[object, ...] = (path.name, self._hash(path, stat.st_size))
+        else:
+            key = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._parts.get(key)
+            if entry is not None:
+                self._parts.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        part = self._encode(path, stat.st_size)
+        part_size = len(part.get_payload())
+
+        with self._lock:
+            if part_size <= self.max_bytes and key not in self._parts:
+                self._parts[key] = (part, part_size)
+                self.size += part_size
+                while self.size > self.max_bytes:
+                    _, (_, evicted_size) = self._parts.popitem(last=False)
+                    self.size -= evicted_size
+        return part
+
+    def _hash(self, path: PurePath, size: int) -> str:
+        with open(path, 'rb') as f:
+            if size < self.mmap_threshold or size == 0:
+                return hashlib.sha256(f.read()).hexdigest()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return hashlib.sha256(m).hexdigest()
+
+    def _encode(self, path: PurePath, size: int) -> EmailMessage:
+        mime_type = guess_type(path, strict=False)[0]
+        if mime_type is None:
+            mime_type = "application/octet-stream"
+        maintype, subtype = mime_type.split('/')
+
+        part = EmailMessage(policy=default)
+        with open(path, 'rb') as f:
+            if size < self.mmap_threshold or size == 0:
+                part.set_content(f.read(), maintype=maintype, subtype=subtype, disposition='attachment', filename=path.name)
+            else:
+                # encode straight from the mapped file instead of copying it into memory first
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    with memoryview(m) as data:
+                        part.set_content(data, maintype=maintype, subtype=subtype, disposition='attachment', filename=path.name)
+        return part
+
+
+attachment_cache = AttachmentCache()
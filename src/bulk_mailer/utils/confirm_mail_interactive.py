@@ -1,4 +1,5 @@
 import tkinter as tk
+from collections.abc import Callable, Sequence
 
 
 class ConfirmMailWindow(tk.Tk):
@@ -59,4 +60,111 @@ def ask_send_confirmation(text: str, accept:str, reject:str) -> bool:
     if root.is_confirmed is None:
         return False
     else:
-        return root.is_confirmed
\ No newline at end of file
+        return root.is_confirmed
+
+
+# a list of all e-mails next to the preview of the selected one
+# previews are rendered when an e-mail is selected, and the list is filled page by page while scrolling
+class ReviewMailsWindow(tk.Tk):
+    is_confirmed: bool = False
+
+    def __init__(self, titles: Sequence[str], preview: Callable[[int], str], page_size: int):
+        super().__init__()
+        self.titles = titles
+        self.preview = preview
+        self.page_size = page_size
+        self.approved = set(range(len(titles)))
+        self.loaded = 0
+
+        screen_width = self.winfo_screenwidth()
+        screen_height = self.winfo_screenheight()
+        self.geometry(f"{int(screen_width * 0.8)}x{int(screen_height * 0.85)}+0+0")
+
+        panes = tk.PanedWindow(self, orient="horizontal")
+        panes.pack(fill="both", expand=True)
+
+        list_frame = tk.Frame(panes)
+        self.listbox = tk.Listbox(list_frame, selectmode="extended", exportselection=False)
+        scrollbar = tk.Scrollbar(list_frame, command=self.listbox.yview)
+        self.listbox.configure(yscrollcommand=self.on_scroll(scrollbar))
+        scrollbar.pack(side="right", fill="y")
+        self.listbox.pack(side="left", fill="both", expand=True)
+        self.listbox.bind("<<ListboxSelect>>", self.show_selected)
+        self.listbox.bind("<space>", lambda _: self.toggle())
+        panes.add(list_frame)
+
+        self.text_widget = tk.Text(panes)
+        panes.add(self.text_widget)
+
+        button_frame = tk.Frame(self)
+        button_frame.pack(fill="both", padx=30, pady=10)
+        self.status = tk.Label(button_frame)
+        self.status.pack(side="left")
+        tk.Button(button_frame, text="✓ Send approved", command=self.accept, padx=10).pack(side="right")
+        tk.Button(button_frame, text="✗ Cancel all", command=self.reject, padx=10).pack(side="right")
+        tk.Button(button_frame, text="Reject all", command=lambda: self.set_all(False), padx=10).pack(side="right")
+        tk.Button(button_frame, text="Approve all", command=lambda: self.set_all(True), padx=10).pack(side="right")
+        tk.Button(button_frame, text="Approve / reject selected [space]", command=self.toggle, padx=10).pack(side="right")
+
+        self.load_page()
+        self.update_status()
+
+    def line(self, i: int) -> str:
+        return f"{'✓' if i in self.approved else '✗'}  {i + 1}  {self.titles[i]}"
+
+    def load_page(self):
+        end = min(self.loaded + self.page_size, len(self.titles))
+        for i in range(self.loaded, end):
+            self.listbox.insert(tk.END, self.line(i))
+        self.loaded = end
+
+    # loads the next page when the end of the list is reached
+    def on_scroll(self, scrollbar: tk.Scrollbar):
+        def scrolled(first: str, last: str):
+            scrollbar.set(first, last)
+            if float(last) >= 1.0 and self.loaded < len(self.titles):
+                self.load_page()
+        return scrolled
+
+    def show_selected(self, _: object = None):
+        selection = self.listbox.curselection()
+        if selection:
+            self.text_widget.delete("1.0", tk.END)
+            self.text_widget.insert(tk.END, self.preview(selection[-1]))
+
+    def toggle(self):
+        for i in self.listbox.curselection():
+            self.approved ^= {i}
+            self.refresh(i)
+        self.update_status()
+
+    def set_all(self, approved: bool):
+        self.approved = set(range(len(self.titles))) if approved else set()
+        for i in range(self.loaded):
+            self.refresh(i)
+        self.update_status()
+
+    def refresh(self, i: int):
+        selected = self.listbox.selection_includes(i)
+        self.listbox.delete(i)
+        self.listbox.insert(i, self.line(i))
+        if selected:
+            self.listbox.selection_set(i)
+
+    def update_status(self):
+        self.status.configure(text=f"{len(self.approved)} of {len(self.titles)} approved")
+
+    def accept(self):
+        self.is_confirmed = True
+        self.destroy()
+
+    def reject(self):
+        self.is_confirmed = False
+        self.destroy()
+
+
+
+def review_send(titles: Sequence[str], preview: Callable[[int], str], page_size: int = 20) -> set[int]:
+    root = ReviewMailsWindow(titles, preview, page_size)
+    root.mainloop()
+    return root.approved if root.is_confirmed else set()
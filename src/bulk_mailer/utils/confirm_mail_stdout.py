@@ -1,3 +1,6 @@
+from collections.abc import Callable, Sequence
+
+
 
 def ask_send_confirmation(text: str, accept: str, reject: str) -> bool:
     print(text)
@@ -10,3 +13,56 @@ def ask_send_confirmation(text: str, accept: str, reject: str) -> bool:
             return False
         else:
             print('Invalid input')
+
+
+# parses e.g. "3 5-7" into {2, 4, 5, 6} (zero-based); raises ValueError on invalid input
+def _parse_numbers(text: str, count: int) -> set[int]:
+    numbers: set[int] = set()
+    for part in text.replace(',', ' ').split():
+        first, _, last = part.partition('-')
+        start, end = int(first), int(last or first)
+        if not 1 <= start <= end <= count:
+            raise ValueError(part)
+        numbers.update(range(start - 1, end))
+    return numbers
+
+
+def review_send(titles: Sequence[str], preview: Callable[[int], str], page_size: int = 20) -> set[int]:
+    count = len(titles)
+    approved = set(range(count))
+    pages = max(1, -(-count // page_size))
+    page = 0
+
+    while True:
+        start = page * page_size
+        end = min(start + page_size, count)
+        print(f"\n--- E-MAILS {start + 1}-{end} OF {count} (page {page + 1}/{pages}, {len(approved)} approved) ---")
+        for i in range(start, end):
+            print(f"[{'x' if i in approved else ' '}] {i + 1:>6}  {titles[i]}")
+
+        choice = input(
+            "\n[n]ext/[p]revious page, [v] # view, [r] #... reject, [a] #... approve, "
+            "[y] send approved, [q] reject all: "
+        ).strip()
+        command, _, args = choice.partition(' ')
+        command = command.lower()
+        try:
+            if command == 'n':
+                page = min(page + 1, pages - 1)
+            elif command == 'p':
+                page = max(page - 1, 0)
+            elif command == 'v':
+                for i in sorted(_parse_numbers(args, count)):
+                    print(f"\n===== E-MAIL {i + 1} =====\n{preview(i)}")
+            elif command == 'r':
+                approved -= _parse_numbers(args, count)
+            elif command == 'a':
+                approved |= _parse_numbers(args, count)
+            elif command == 'y':
+                return approved
+            elif command == 'q':
+                return set()
+            else:
+                print('Invalid input')
+        except ValueError:
+            print('Invalid number')
@@ -1,15 +1,23 @@
 from __future__ import annotations
 from email.message import EmailMessage
+from email.policy import SMTP, SMTPUTF8, default
+from email import message_from_bytes
+from email.parser import BytesHeaderParser
 from pathlib import PurePath
-from collections.abc import Collection
+from collections.abc import Collection, Sequence
 from mimetypes import guess_type
+from email.generator import BytesGenerator
+from io import BytesIO
+from copy import copy
+from .attachments import AttachmentCache, attachment_cache
 try:
-    from .confirm_mail_interactive import ask_send_confirmation as _ask_send_confirmation
+    from .confirm_mail_interactive import ask_send_confirmation as _ask_send_confirmation, review_send as _review_send
 except ModuleNotFoundError:
-    from .confirm_mail_stdout import ask_send_confirmation as _ask_send_confirmation
+    from .confirm_mail_stdout import ask_send_confirmation as _ask_send_confirmation, review_send as _review_send
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from bulk_mailer.general.envelope import Envelope
+    from bulk_mailer.general.types import Message
 
 
 
@@ -18,37 +26,54 @@ def ask_mail_confirmation(envelope: Envelope, accept:str="Accept", reject:str="R
     return _ask_send_confirmation(text, accept, reject)
 
 
-def mail_to_str(envelope: Envelope) -> str:
-    msg = envelope.msg
-    text = ""
+# lets the user review all e-mails in one session; previews are only rendered when opened
+# returns the indices of the approved e-mails
+def review_mails(envelopes: Sequence[Envelope], page_size: int = 20) -> set[int]:
+    titles = [f"{', '.join(f'{p.name} <{p.email_address}>' if p.name else p.email_address for p in env.to)}: {mail_subject(env.msg)}" for env in envelopes]
+    return _review_send(titles, lambda i: mail_to_str(envelopes[i]), page_size)
+
+
+def mail_subject(msg: Message) -> str:
+    if isinstance(msg, bytes):
+        # parse only the header
+        msg = BytesHeaderParser(policy=default).parsebytes(msg.split(b'\r\n\r\n', 1)[0])
+    return str(msg.get('Subject', ''))
 
-    text += "--- RECIPIENTS ---\n"
-    text += f"To: {', '.join(p.email_header_name for p in envelope.to)}\n"
-    text += f"Cc: {', '.join(p.email_header_name for p in envelope.cc)}\n"
-    text += f"Bcc: {', '.join(p.email_header_name for p in envelope.bcc)}\n"
-    text += "\n\n"
 
-    text += "--- ATTACHMENTS ---\n"
+def mail_to_str(envelope: Envelope) -> str:
+    msg = envelope.msg
+    if isinstance(msg, bytes):
+        msg = message_from_bytes(msg, policy=default)
+        assert isinstance(msg, EmailMessage)
+    parts: list[str] = []
+
+    parts.append("--- RECIPIENTS ---\n")
+    parts.append(f"To: {', '.join(p.email_header_name for p in envelope.to)}\n")
+    parts.append(f"Cc: {', '.join(p.email_header_name for p in envelope.cc)}\n")
+    parts.append(f"Bcc: {', '.join(p.email_header_name for p in envelope.bcc)}\n")
+    parts.append("\n\n")
+
+    parts.append("--- ATTACHMENTS ---\n")
     for a in msg.iter_attachments():
         assert isinstance(a, EmailMessage)
-        text += f"{a.get_filename()} ({a.get_content_type()})\n"
-    text += "\n\n"
+        parts.append(f"{a.get_filename()} ({a.get_content_type()})\n")
+    parts.append("\n\n")
 
-    headers = msg.items()
-    text += "--- HEADER ---\n"
-    for header in headers:
-        text += f"{header[0]}: {header[1]}\n"
-    text += "\n\n"
+    parts.append("--- HEADER ---\n")
+    for name, value in msg.items():
+        parts.append(f"{name}: {value}\n")
+    parts.append("\n\n")
 
     body = msg.get_body()
     assert isinstance(body, EmailMessage)
-    text += "--- BODY ---\n"
-    text += body.get_content()
+    parts.append("--- BODY ---\n")
+    parts.append(body.get_content())
 
-    return text
+    return ''.join(parts)
 
 
-def create_plain_mail(subject: str, body: str, attachments: str | PurePath | Collection[str|PurePath] | None = None) -> EmailMessage:
+# attachments are taken from the given cache (or read every time if cache is None)
+def create_plain_mail(subject: str, body: str, attachments: str | PurePath | Collection[str|PurePath] | None = None, cache: AttachmentCache | None = attachment_cache) -> EmailMessage:
     if attachments is None:
         attachments = []
     if isinstance(attachments, str | PurePath):
@@ -62,6 +87,12 @@ def create_plain_mail(subject: str, body: str, attachments: str | PurePath | Col
         if isinstance(attachment, str):
             attachment = PurePath(attachment)
 
+        if cache is not None:
+            if msg.get_content_type() != 'multipart/mixed':
+                msg.make_mixed()
+            msg.attach(cache.get(attachment))
+            continue
+
         with open(attachment, 'rb') as f:
             data = f.read()
 
@@ -72,4 +103,30 @@ def create_plain_mail(subject: str, body: str, attachments: str | PurePath | Col
         maintype, subtype = mime_type.split('/')
         msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=attachment.name)
 
-    return msg
\ No newline at end of file
+    return msg
+
+
+# flattens the message into the bytes that are sent on the wire, like smtplib.SMTP.send_message does
+# Bcc headers are not transmitted; utf8 is for internationalized (SMTPUTF8) addresses
+def message_to_bytes(msg: EmailMessage, utf8: bool = False) -> bytes:
+    if 'Bcc' in msg or 'Resent-Bcc' in msg:
+        msg = copy(msg)
+        del msg['Bcc']
+        del msg['Resent-Bcc']
+    buffer = BytesIO()
+    policy = msg.policy.clone(linesep='\r\n', utf8=True) if utf8 else msg.policy.clone(linesep='\r\n')
+    BytesGenerator(buffer, policy=policy).flatten(msg, linesep='\r\n')
+    return buffer.getvalue()
+
+
+# encodes a single header line for the wire; short ASCII values skip the (slow) header parser
+# with utf8 (for SMTPUTF8), non-ASCII values are sent as UTF-8 instead of encoded words
+# raises ValueError if the value contains CR or LF, which would inject header lines (like EmailMessage does)
+def encode_header(name: str, value: str, utf8: bool = False) -> bytes:
+    if '\n' in value or '\r' in value:
+        raise ValueError(f"Header values must not contain CR or LF: {name}: {value!r}")
+    line = f"{name}: {value}\r\n"
+    if len(line) <= SMTP.max_line_length and (utf8 or line.isascii()):
+        return line.encode('utf-8')
+    policy = SMTPUTF8 if utf8 else SMTP
+    return policy.header_factory(name, value).fold(policy=policy).encode('utf-8' if utf8 else 'ascii')
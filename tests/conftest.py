@@ -0,0 +1,34 @@
+from __future__ import annotations
+import sys
+from pathlib import Path
+from collections.abc import Iterator
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# run from a source checkout without installing; the fake server lives with the benchmarks
+sys.path.insert(0, str(ROOT / 'src'))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+from fake_smtp import FakeSMTPServer
+from bulk_mailer.entities import Emailable
+from bulk_mailer.general.mailer import SMTP_CONFIG
+from bulk_mailer.general.envelope import Envelope
+from bulk_mailer.utils import create_plain_mail
+
+
+SENDER = Emailable('sender@example.org')
+
+
+@pytest.fixture
+def server() -> Iterator[FakeSMTPServer]:
+    with FakeSMTPServer() as server:
+        yield server
+
+
+def config_for(server: FakeSMTPServer) -> SMTP_CONFIG:
+    return SMTP_CONFIG(server.host, server.port, ssl=False)
+
+
+# n e-mails to one recipient each, with distinct subjects
+def plain_queue(n: int, body: str = 'Hello') -> list[Envelope]:
+    return [Envelope(create_plain_mail(f'Test {i}', body), Emailable(f'user{i}@example.org')) for i in range(n)]
@@ -0,0 +1,73 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+from bulk_mailer.utils import AttachmentCache, create_plain_mail
+
+
+def write(path: Path, data: bytes) -> Path:
+    path.write_bytes(data)
+    return path
+
+
+def test_file_is_encoded_once(tmp_path: Path):
+    path = write(tmp_path / 'report.pdf', b'%PDF' + bytes(range(256)) * 10)
+    cache = AttachmentCache()
+    first = cache.get(path)
+    assert cache.get(str(path)) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert first.get_content_type() == 'application/pdf'
+    assert first.get_filename() == 'report.pdf'
+    assert first.get_content() == path.read_bytes()
+
+
+def test_changed_file_is_encoded_again(tmp_path: Path):
+    path = write(tmp_path / 'a.txt', b'old')
+    cache = AttachmentCache()
+    cache.get(path)
+    write(path, b'newer')
+    os.utime(path, ns=(0, 0))
+    assert cache.get(path).get_payload(decode=True) == b'newer'
+    assert cache.misses == 2
+
+
+def test_least_recently_used_parts_are_evicted(tmp_path: Path):
+    paths = [write(tmp_path / f'{i}.bin', bytes([i]) * 3000) for i in range(3)]
+    cache = AttachmentCache(max_bytes=9000)
+    cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])
+    cache.get(paths[2])
+    assert len(cache) == 2
+    assert cache.size <= 9000
+    cache.get(paths[0])
+    assert cache.misses == 3
+
+
+def test_copies_are_shared_by_hash(tmp_path: Path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    first = write(tmp_path / 'a' / 'logo.png', b'\x89PNG' * 100)
+    second = write(tmp_path / 'b' / 'logo.png', b'\x89PNG' * 100)
+    cache = AttachmentCache(by_hash=True, mmap_threshold=1)
+    assert cache.get(first) is cache.get(second)
+
+
+def test_mapped_files_are_encoded_the_same(tmp_path: Path):
+    path = write(tmp_path / 'data.bin', os.urandom(5000))
+    mapped = AttachmentCache(mmap_threshold=1).get(path)
+    read = AttachmentCache().get(path)
+    assert mapped.get_payload() == read.get_payload()
+
+
+def test_create_plain_mail_uses_the_cache(tmp_path: Path):
+    path = write(tmp_path / 'notes.txt', b'some notes')
+    cache = AttachmentCache()
+    msgs = [create_plain_mail(f'Subject {i}', 'Body', path, cache=cache) for i in range(3)]
+    uncached = create_plain_mail('Subject', 'Body', path, cache=None)
+    assert (cache.hits, cache.misses) == (2, 1)
+    for msg in msgs:
+        (part,) = msg.iter_attachments()
+        assert part.get_filename() == 'notes.txt'
+        assert part.get_payload(decode=True) == b'some notes'
+    (part,) = uncached.iter_attachments()
+    assert part.get_payload(decode=True) == b'some notes'
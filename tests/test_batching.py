@@ -0,0 +1,38 @@
+from __future__ import annotations
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for
+from bulk_mailer.entities import Emailable
+from bulk_mailer.general.mailer import Mailer
+from bulk_mailer.general.envelope import Envelope
+from bulk_mailer.utils import create_plain_mail
+
+
+def bulk(n: int) -> Envelope:
+    return Envelope(create_plain_mail('Bulk', 'Hello'), [], bcc=[Emailable(f'user{i}@example.org') for i in range(n)])
+
+
+def test_recipients_are_split_into_transactions(server: FakeSMTPServer):
+    with Mailer(config_for(server), SENDER, detailed_log=False, max_recipients=4) as mailer:
+        summary = mailer.send_queue([bulk(10)])
+    assert (summary.envelopes, summary.accepted) == (1, 10)
+    assert (server.messages, server.recipients) == (3, 10)
+
+
+def test_recipient_limit_is_learned_from_452():
+    with FakeSMTPServer(max_recipients=5) as server:
+        with Mailer(config_for(server), SENDER, detailed_log=False) as mailer:
+            summary = mailer.send_queue([bulk(12)])
+            assert mailer.max_recipients == 5
+            # later e-mails are split right away
+            mailer.send_queue([bulk(6)])
+    assert (summary.accepted, summary.rejected) == (12, 0)
+    assert (server.messages, server.recipients) == (5, 18)
+
+
+def test_refused_recipients_of_a_batch_are_reported():
+    with FakeSMTPServer(reject_rate=0.5, seed=1) as server:
+        with Mailer(config_for(server), SENDER, detailed_log=False, max_recipients=3) as mailer:
+            summary = mailer.send_queue([bulk(20)])
+    assert summary.accepted + summary.rejected == 20
+    assert summary.rejected == summary.codes[550] > 0
+    assert server.recipients == summary.accepted
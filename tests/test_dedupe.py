@@ -0,0 +1,49 @@
+from __future__ import annotations
+from pathlib import Path
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for
+from bulk_mailer.entities import Emailable
+from bulk_mailer.general.journal import Journal
+from bulk_mailer.utils import create_plain_mail
+from bulk_mailer import personal
+
+
+def personal_queue(n: int, body: str = 'Same for everyone') -> list[personal.Envelope]:
+    return [personal.Envelope(create_plain_mail('News', body), Emailable(f'user{i}@example.org')) for i in range(n)]
+
+
+def test_identical_mails_are_sent_once(server: FakeSMTPServer):
+    mails = personal_queue(10) + personal_queue(2, 'Something else')
+    with personal.Mailer(config_for(server), SENDER, detailed_log=False, dedupe=20) as mailer:
+        succeeded, failed, cancelled = mailer.send_queue(mails)
+    assert len(succeeded) == 10 and not failed and not cancelled
+    assert server.messages == 2
+    assert server.recipients == 12
+
+
+def test_groups_are_limited_to_dedupe(server: FakeSMTPServer):
+    with personal.Mailer(config_for(server), SENDER, detailed_log=False, dedupe=4) as mailer:
+        results = list(mailer.send_queue_iter(personal_queue(10)))
+    assert len(results) == 10 and all(res.error is None for res in results)
+    assert server.messages == 3
+
+
+def test_refused_recipients_of_a_group_are_reported():
+    mails = personal_queue(20)
+    with FakeSMTPServer(reject_rate=0.3, seed=3) as server:
+        with personal.Mailer(config_for(server), SENDER, detailed_log=False, dedupe=20) as mailer:
+            succeeded, failed, _ = mailer.send_queue(mails)
+    assert failed and succeeded
+    assert len(succeeded) + len(failed) == 20
+    assert server.recipients == len(succeeded)
+    assert server.messages == 1
+
+
+def test_grouped_mails_are_not_sent_again(server: FakeSMTPServer, tmp_path: Path):
+    path = tmp_path / 'journal.jsonl'
+    with Journal(path) as journal, personal.Mailer(config_for(server), SENDER, detailed_log=False, dedupe=5) as mailer:
+        mailer.send_queue(personal_queue(5), journal)
+    with Journal(path) as journal, personal.Mailer(config_for(server), SENDER, detailed_log=False, dedupe=5) as mailer:
+        results = list(mailer.send_queue_iter(personal_queue(5), journal))
+    assert all(res.already_sent for res in results)
+    assert server.messages == 1
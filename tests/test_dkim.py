@@ -0,0 +1,74 @@
+from __future__ import annotations
+import base64
+import pickle
+import pytest
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for, plain_queue
+from bulk_mailer.general.dkim import DkimSigner, canonicalize_body, canonicalize_header
+from bulk_mailer.general.mailer import Mailer, prepare_mail
+
+dkim = pytest.importorskip('dkim')
+serialization = pytest.importorskip('cryptography.hazmat.primitives.serialization')
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+
+def rsa_key() -> tuple[bytes, bytes]:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    public = key.public_key().public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return pem, b'v=DKIM1; k=rsa; p=' + base64.b64encode(public)
+
+
+def ed25519_key() -> tuple[bytes, bytes]:
+    key = ed25519.Ed25519PrivateKey.generate()
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    public = key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    return pem, b'v=DKIM1; k=ed25519; p=' + base64.b64encode(public)
+
+
+def verify(data: bytes, record: bytes) -> bool:
+    return dkim.verify(data, dnsfunc=lambda name, timeout=5: record if name == b'sel._domainkey.example.org.' else None)
+
+
+def test_canonicalization():
+    assert canonicalize_header(b'SubJect : Hello \r\n\t  World  \r\n') == b'subject:Hello World\r\n'
+    assert canonicalize_body(b'Line  one \r\n\r\n\r\n') == b'Line one\r\n'
+    assert canonicalize_body(b'\r\n\r\n') == b''
+
+
+@pytest.mark.parametrize('make_key', [rsa_key, ed25519_key])
+def test_signature_verifies(make_key):
+    pem, record = make_key()
+    signer = DkimSigner('example.org', 'sel', pem)
+    data = signer.sign(prepare_mail(plain_queue(1)[0], SENDER).data)
+    assert data.startswith(b'DKIM-Signature: ')
+    assert verify(data, record)
+    # a changed body no longer verifies
+    assert not verify(data.replace(b'Hello', b'Hallo'), record)
+
+
+def test_mailer_signs_prepared_mails(server: FakeSMTPServer):
+    pem, record = ed25519_key()
+    with Mailer(config_for(server), SENDER, detailed_log=False, dkim=DkimSigner('example.org', 'sel', pem)) as mailer:
+        mail = mailer.prepare(plain_queue(1)[0])
+        summary = mailer.send_queue(plain_queue(3))
+    assert verify(mail.data, record)
+    assert summary.accepted == 3
+
+
+def test_pickled_signer_signs_the_same(tmp_path):
+    pem, record = rsa_key()
+    path = tmp_path / 'dkim.pem'
+    path.write_bytes(pem)
+    signer = DkimSigner('example.org', 'sel', path)
+    signer.sign(b'Subject: x\r\n\r\nbody\r\n')
+    copy = pickle.loads(pickle.dumps(signer))
+    assert copy._key is None
+    assert verify(copy.sign(prepare_mail(plain_queue(1)[0], SENDER).data), record)
+
+
+def test_other_keys_are_refused():
+    from cryptography.hazmat.primitives.asymmetric import ec
+    pem = ec.generate_private_key(ec.SECP256R1()).private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    with pytest.raises(ValueError):
+        DkimSigner('example.org', 'sel', pem).sign(b'Subject: x\r\n\r\nbody\r\n')
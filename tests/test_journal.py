@@ -0,0 +1,57 @@
+from __future__ import annotations
+from pathlib import Path
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for, plain_queue
+from bulk_mailer.entities import Emailable
+from bulk_mailer.general.mailer import Mailer
+from bulk_mailer.general.journal import Journal
+
+
+def test_records_are_loaded_again(tmp_path: Path):
+    path = tmp_path / 'journal.jsonl'
+    with Journal(path) as journal:
+        journal.record('a', [Emailable('Ann@example.org')], {Emailable('bob@example.org'): (550, b'No such user')})
+        journal.record('b', [], {Emailable('eve@example.org'): (451, b'Later')})
+    with Journal(path) as journal:
+        assert journal.delivered_addrs('a') == {'ann@example.org'}
+        assert journal.delivered_addrs('b') == set()
+
+
+def test_incomplete_last_line_is_cut_off(tmp_path: Path):
+    path = tmp_path / 'journal.jsonl'
+    with Journal(path) as journal:
+        journal.record('a', [Emailable('ann@example.org')], {})
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"key":"b","ok":["bo')
+    with Journal(path) as journal:
+        journal.record('c', [Emailable('cid@example.org')], {})
+    with Journal(path) as journal:
+        assert journal.delivered_addrs('a') == {'ann@example.org'}
+        assert journal.delivered_addrs('b') == set()
+        assert journal.delivered_addrs('c') == {'cid@example.org'}
+    assert path.read_text().endswith('\n')
+
+
+def test_journal_resumes_after_crash(server: FakeSMTPServer, tmp_path: Path):
+    path = tmp_path / 'journal.jsonl'
+    mails = plain_queue(6)
+
+    with Journal(path) as journal, Mailer(config_for(server), SENDER, detailed_log=False) as mailer:
+        for i, _ in enumerate(mailer.send_queue_iter(mails, journal), 1):
+            if i == 3:
+                break
+    # the process died while writing the next record
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"key": "')
+    assert server.messages == 3
+
+    with Journal(path) as journal, Mailer(config_for(server), SENDER, detailed_log=False) as mailer:
+        summary = mailer.send_queue(mails, journal)
+    assert (summary.accepted, summary.already_sent) == (3, 3)
+    assert server.messages == 6
+
+    # the records written after the torn line are intact, so nothing is sent again
+    with Journal(path) as journal, Mailer(config_for(server), SENDER, detailed_log=False) as mailer:
+        summary = mailer.send_queue(mails, journal)
+    assert (summary.accepted, summary.already_sent) == (0, 6)
+    assert server.messages == 6
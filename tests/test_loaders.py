@@ -0,0 +1,71 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+import pytest
+from bulk_mailer.entities import RecipientLoader, load_csv, load_jsonl, is_valid_address
+from bulk_mailer.entities.loaders import SpillingSet
+
+
+def test_address_syntax():
+    assert is_valid_address('ann.lee+news@example.org')
+    assert is_valid_address('joerg@bücher.de')
+    assert not is_valid_address('ann@localhost')
+    assert not is_valid_address('ann@@example.org')
+    assert not is_valid_address('ann lee@example.org')
+    assert not is_valid_address('ann@-example.org')
+    assert not is_valid_address('ann@example.123')
+    assert not is_valid_address('')
+
+
+def test_spilling_set_spills_beyond_its_cache():
+    with SpillingSet(cache_kb=64) as seen:
+        assert not any(seen.add(f'user{i}@example.org') for i in range(20000))
+        assert seen.add('user123@example.org')
+        assert 'user19999@example.org' in seen
+        assert 'other@example.org' not in seen
+
+
+def test_csv_rows_are_validated_and_deduplicated(tmp_path: Path):
+    path = tmp_path / 'list.csv'
+    path.write_text(
+        '﻿first_name,last_name,email_address,plan\n'
+        'Ann,Lee,ann@example.org,pro\n'
+        'Bob,,not-an-address,free\n'
+        'Ann,Lee, ANN@Example.org ,pro\n'
+        'Cid,Roe,cid@example.org,free\n',
+        encoding='utf-8',
+    )
+    loader = load_csv(path)
+    recipients = list(loader)
+    assert [r.email_address for r in recipients] == ['ann@example.org', 'cid@example.org']
+    assert recipients[0].name == 'Ann Lee'
+    assert recipients[1].plan == 'free'
+    assert (loader.rows, loader.invalid, loader.duplicates) == (4, 1, 1)
+    # every iteration reads the file again
+    assert len(list(loader)) == 2
+
+
+def test_columns_and_fields_are_mapped(tmp_path: Path):
+    path = tmp_path / 'list.txt'
+    path.write_text('Vorname;Mail;Stadt;Intern\nJörg;joerg@example.org;Köln;x\n', encoding='utf-8')
+    loader = RecipientLoader(path, 'csv', columns={'first_name': 'Vorname', 'email_address': 'Mail'}, fields=['Stadt'], delimiter=';')
+    (recipient,) = loader
+    assert (recipient.first_name, recipient.email_address) == ('Jörg', 'joerg@example.org')
+    assert recipient.fields == {'Stadt': 'Köln'}
+
+
+def test_jsonl_without_dedupe_or_validation(tmp_path: Path):
+    path = tmp_path / 'list.jsonl'
+    rows = [{'first_name': 'Ann', 'email_address': 'ann@example.org'}, {'email_address': 'ann@example.org'}, {'email_address': 'broken'}]
+    path.write_text('\n'.join(json.dumps(row) for row in rows) + '\n\n', encoding='utf-8')
+    assert RecipientLoader(path).format == 'jsonl'
+    assert len(list(load_jsonl(path))) == 1
+    assert len(list(load_jsonl(path, dedupe=False))) == 2
+    assert len(list(load_jsonl(path, dedupe=False, validate=False))) == 3
+
+
+def test_unknown_options_are_refused(tmp_path: Path):
+    with pytest.raises(ValueError):
+        RecipientLoader(tmp_path / 'list.xml', 'xml')
+    with pytest.raises(ValueError):
+        RecipientLoader(tmp_path / 'list.csv', columns={'email': 'mail'})
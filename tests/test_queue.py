@@ -0,0 +1,72 @@
+from __future__ import annotations
+import time
+import threading
+from collections.abc import Callable
+import pytest
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for
+from bulk_mailer.entities import Emailable
+from bulk_mailer.general.mailer import Mailer
+from bulk_mailer.general.queue import PriorityMailQueue
+from bulk_mailer.general.result import SendResult
+from bulk_mailer.general.retry import RetryPolicy
+from bulk_mailer.general.scheduler import DomainScheduler
+from bulk_mailer.utils import create_plain_mail
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def subjects(queue: PriorityMailQueue) -> list[str]:
+    return [env.msg['Subject'] for env in queue]
+
+
+def test_higher_priority_first_then_in_order():
+    queue = PriorityMailQueue()
+    for subject, priority in [('a', 0), ('b', 1), ('c', 0), ('d', 2)]:
+        queue.add(create_plain_mail(subject, 'Hello'), Emailable('x@example.org'), priority=priority)
+    assert subjects(queue) == ['d', 'b', 'a', 'c']
+    assert queue.count() == 0
+
+
+def test_scheduled_mail_waits_until_due():
+    queue = PriorityMailQueue()
+    queue.add(create_plain_mail('later', 'Hello'), Emailable('x@example.org'), priority=5, send_at=time.time() + 0.2)
+    queue.add(create_plain_mail('now', 'Hello'), Emailable('x@example.org'))
+    start = time.monotonic()
+    assert subjects(queue) == ['now', 'later']
+    assert time.monotonic() - start >= 0.15
+
+
+@pytest.mark.parametrize('options', [
+    {'connections': 2},
+    {'connections': 2, 'scheduler': DomainScheduler()},
+    {'connections': 2, 'retry': RetryPolicy(base_delay=0.05)},
+    {'connections': 1, 'scheduler': DomainScheduler(), 'retry': RetryPolicy(base_delay=0.05)},
+], ids=['pool', 'scheduler', 'retry', 'scheduler-retry'])
+def test_live_queue_sends_while_waiting_for_more(options: dict):
+    queue = PriorityMailQueue(live=True)
+    results: list[SendResult] = []
+    # with a retry policy, every address is refused once, and is retried while the queue waits
+    with FakeSMTPServer(greylist='retry' in options) as server:
+        with Mailer(config_for(server), SENDER, detailed_log=False, **options) as mailer:
+            consumer = threading.Thread(target=lambda: results.extend(mailer.send_queue_iter(queue)))
+            consumer.start()
+            try:
+                for i in range(3):
+                    queue.add(create_plain_mail('Hi', 'Hello'), Emailable(f'user{i}@example{i}.org'))
+                assert wait_for(lambda: len(results) == 3)
+                assert server.messages == 3
+                queue.add(create_plain_mail('Hi', 'Hello'), Emailable('last@example.org'))
+                assert wait_for(lambda: len(results) == 4)
+            finally:
+                queue.close()
+                consumer.join(timeout=5)
+    assert not consumer.is_alive()
+    assert all(not res.failed for res in results)
@@ -0,0 +1,64 @@
+from __future__ import annotations
+import pickle
+import pytest
+from bulk_mailer.general.ratelimit import Limit, RateLimiter
+
+
+def test_limit_must_be_positive():
+    with pytest.raises(ValueError):
+        Limit(0, 1)
+
+
+def test_burst_then_rate():
+    limiter = RateLimiter(messages=[Limit(10, 1, burst=2)], adaptive=False)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(0.1, abs=0.01)
+    # booked sends are debt that the next ones wait for
+    assert limiter.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_ready_in_books_nothing():
+    limiter = RateLimiter(recipients=[Limit(100, 1)], adaptive=False)
+    assert limiter.ready_in(recipients=100) == 0
+    assert limiter.ready_in(recipients=100) == 0
+    limiter.reserve(recipients=100)
+    assert limiter.ready_in(recipients=50) == pytest.approx(0.5, abs=0.01)
+
+
+def test_fixed_delay():
+    limiter = RateLimiter.fixed_delay(2)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(2, abs=0.01)
+
+
+def test_throttling_cuts_rate_and_success_restores_it():
+    limiter = RateLimiter(messages=[Limit(10, 1)], decrease=0.5, increase=0.1, min_factor=0.2)
+    limiter.feedback([451])
+    assert limiter.factor == 0.5
+    limiter.feedback([421])
+    limiter.feedback([452])
+    assert limiter.factor == 0.2
+    limiter.feedback([550])
+    assert limiter.factor == pytest.approx(0.3)
+    for _ in range(20):
+        limiter.feedback([])
+    assert limiter.factor == 1
+    assert limiter.is_fresh()
+    limiter.reserve()
+    assert not limiter.is_fresh()
+
+
+def test_not_adaptive_ignores_throttling():
+    limiter = RateLimiter(messages=[Limit(10, 1)], adaptive=False)
+    limiter.feedback([421])
+    assert limiter.factor == 1
+
+
+def test_split_shares_the_rates():
+    limiter = RateLimiter(messages=[Limit(10, 1)], data_bytes=[Limit(1000, 60, burst=100)]).split(4)
+    messages, _, data_bytes = limiter.limits
+    assert (messages[0].count, messages[0].burst) == (2.5, 2.5)
+    assert (data_bytes[0].count, data_bytes[0].per_secs, data_bytes[0].burst) == (250, 60, 25)
+    # and can be passed to worker processes
+    assert pickle.loads(pickle.dumps(limiter)).reserve() == 0
@@ -0,0 +1,44 @@
+from __future__ import annotations
+import socket
+from collections import Counter
+import pytest
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for, plain_queue
+from bulk_mailer.general.mailer import Mailer, SMTP_CONFIG
+from bulk_mailer.general.pool import SessionPolicy
+from bulk_mailer.general.relays import Relay, RelayBalancer
+
+
+def closed_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_balancer_follows_weights():
+    heavy = Relay(SMTP_CONFIG('a', 25), weight=2, name='heavy')
+    light = Relay(SMTP_CONFIG('b', 25), weight=1, name='light')
+    balancer = RelayBalancer([heavy, light])
+    chosen = Counter(balancer.choose().name for _ in range(30))
+    assert chosen == {'heavy': 20, 'light': 10}
+    assert balancer.choose(exclude=[heavy, light]) is None
+
+
+def test_relay_that_is_down_is_passed_over():
+    down = Relay(SMTP_CONFIG('a', 25), name='down')
+    up = Relay(SMTP_CONFIG('b', 25), name='up')
+    down.mark_down('failed')
+    assert {RelayBalancer([down, up]).choose().name for _ in range(5)} == {'up'}
+
+
+# eagerly, the relay fails when the mailer opens it; lazily, when the first e-mail is sent through it
+@pytest.mark.parametrize('lazy', [False, True])
+def test_failover_to_working_relay(server: FakeSMTPServer, lazy: bool):
+    down = Relay(SMTP_CONFIG('127.0.0.1', closed_port(), ssl=False), name='down')
+    up = Relay(config_for(server), name='up')
+    with Mailer([down, up], SENDER, detailed_log=False, session=SessionPolicy(lazy=lazy)) as mailer:
+        summary = mailer.send_queue(plain_queue(5))
+    assert summary.accepted == 5
+    assert server.messages == 5
+    assert up.stats.messages == 5
+    assert down.stats.errors >= 1
@@ -0,0 +1,38 @@
+from __future__ import annotations
+import logging
+import pytest
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for, plain_queue as queue
+from bulk_mailer.general.mailer import Mailer
+from bulk_mailer.general.retry import RetryPolicy
+
+
+def test_transient_refusal_is_retried(caplog: pytest.LogCaptureFixture):
+    with FakeSMTPServer(greylist=True) as server:
+        with Mailer(config_for(server), SENDER, retry=RetryPolicy(base_delay=0.01)) as mailer:
+            with caplog.at_level(logging.INFO, logger='send_mail'):
+                summary = mailer.send_queue(queue(3))
+    assert (summary.accepted, summary.rejected) == (3, 0)
+    assert server.messages == 3
+    # the first attempts are deferred, not rejected
+    assert not [r for r in caplog.records if r.name == 'send_mail' and r.levelno >= logging.ERROR]
+    assert any('deferred' in r.getMessage() for r in caplog.records)
+
+
+def test_transient_refusal_fails_after_last_attempt(caplog: pytest.LogCaptureFixture):
+    with FakeSMTPServer(greylist=True) as server:
+        with Mailer(config_for(server), SENDER, retry=RetryPolicy(max_attempts=1)) as mailer:
+            with caplog.at_level(logging.INFO, logger='send_mail'):
+                summary = mailer.send_queue(queue(2))
+    assert (summary.accepted, summary.rejected) == (0, 2)
+    assert summary.codes[451] == 2
+    assert [r for r in caplog.records if r.name == 'send_mail' and r.levelno >= logging.ERROR]
+
+
+def test_dropped_connection_is_reconnected():
+    with FakeSMTPServer(disconnect_rate=0.2, seed=1) as server:
+        with Mailer(config_for(server), SENDER, detailed_log=False, retry=RetryPolicy(base_delay=0.01)) as mailer:
+            summary = mailer.send_queue(queue(20))
+    assert (summary.accepted, summary.rejected) == (20, 0)
+    assert server.disconnects > 0
+    assert server.messages == 20
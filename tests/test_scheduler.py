@@ -0,0 +1,53 @@
+from __future__ import annotations
+import time
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for
+from bulk_mailer.entities import Emailable
+from bulk_mailer.general.mailer import Mailer
+from bulk_mailer.general.envelope import Envelope
+from bulk_mailer.general.ratelimit import Limit
+from bulk_mailer.general.result import SendResult
+from bulk_mailer.general.scheduler import DomainPolicy, DomainScheduler, envelope_domain
+from bulk_mailer.utils import create_plain_mail
+
+
+def envelopes(domains: str) -> list[Envelope]:
+    return [Envelope(b'Subject: Hi\r\n\r\nHello\r\n', Emailable(f'user{i}@{d}.org')) for i, d in enumerate(domains)]
+
+
+def sent(env: Envelope) -> SendResult:
+    return SendResult(env, set(env.all_recipients), {}, False)
+
+
+def test_domains_are_interleaved():
+    order = [envelope_domain(env)[0] for env in DomainScheduler().schedule(envelopes('aaaabbbbcc'))]
+    assert ''.join(order) == 'abcabcabab'
+
+
+def test_domain_at_its_cap_is_passed_over():
+    scheduler = DomainScheduler({'a.org': DomainPolicy(max_concurrent=1)})
+    schedule = scheduler.schedule(envelopes('aab'))
+    first, second = next(schedule), next(schedule)
+    assert [envelope_domain(first), envelope_domain(second)] == ['a.org', 'b.org']
+    scheduler.done(sent(first))
+    assert envelope_domain(next(schedule)) == 'a.org'
+
+
+def test_idle_limited_domains_are_forgotten():
+    scheduler = DomainScheduler(default=DomainPolicy(messages=[Limit(1000, 1)]))
+    for env in scheduler.schedule(envelopes([f'd{i}' for i in range(50)])):
+        scheduler.done(sent(env))
+    # the buckets refill within milliseconds; then the domains are the same as new ones, and are dropped
+    time.sleep(0.05)
+    assert [envelope_domain(env) for env in scheduler.schedule(envelopes(['new']))] == ['new.org']
+    assert len(scheduler._domains) <= 1
+
+
+def test_mailer_sends_every_scheduled_mail(server: FakeSMTPServer):
+    queue = [Envelope(create_plain_mail('Hi', 'Hello'), Emailable(f'user{i}@{"ab"[i % 2]}.org')) for i in range(10)]
+    scheduler = DomainScheduler({'a.org': DomainPolicy(max_concurrent=1, messages=[Limit(100, 1)])})
+    with Mailer(config_for(server), SENDER, detailed_log=False, connections=3, scheduler=scheduler) as mailer:
+        summary = mailer.send_queue(queue)
+    assert summary.accepted == 10
+    assert server.messages == 10
+    assert not scheduler._dispatched
@@ -0,0 +1,58 @@
+from __future__ import annotations
+import pytest
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for, plain_queue
+from bulk_mailer.entities import Emailable
+from bulk_mailer.general.mailer import Mailer, prepare_mail
+from bulk_mailer.general.envelope import Envelope
+from bulk_mailer.general.pool import prefetch
+from bulk_mailer.utils import create_plain_mail
+
+
+def test_prepare_does_not_modify_the_message():
+    msg = create_plain_mail('Subject', 'Body')
+    env = Envelope(msg, Emailable('to@example.org'), bcc=Emailable('hidden@example.org'))
+    first = prepare_mail(env, SENDER)
+    second = prepare_mail(env, SENDER)
+    assert first.data == second.data
+    assert first.data.count(b'\nTo: ') == 1
+    assert b'hidden@example.org' not in first.data
+    assert first.to_addrs == ['to@example.org', 'hidden@example.org']
+    assert 'To' not in msg
+
+
+def test_prefetch_raises_after_earlier_items():
+    def source():
+        yield 1
+        yield 2
+        raise RuntimeError('broken source')
+    items = prefetch(source(), 4)
+    assert next(items) == 1
+    assert next(items) == 2
+    with pytest.raises(RuntimeError, match='broken source'):
+        next(items)
+
+
+def test_lookahead_keeps_queue_order(server: FakeSMTPServer):
+    mails = plain_queue(30)
+    with Mailer(config_for(server), SENDER, detailed_log=False, connections=3, lookahead=8, serializers=2) as mailer:
+        results = list(mailer.send_queue_iter(mails))
+    assert [res.envelope for res in results] == mails
+    assert all(not res.failed for res in results)
+    assert server.messages == 30
+
+
+@pytest.mark.parametrize('smtputf8', [True, False])
+def test_internationalized_recipient(smtputf8: bool):
+    mails = [Envelope(create_plain_mail('Grüße', 'Hallo'), Emailable('jörg@bücher.de', 'Jörg')), *plain_queue(1)]
+    with FakeSMTPServer(smtputf8=smtputf8) as server:
+        with Mailer(config_for(server), SENDER, detailed_log=False) as mailer:
+            summary = mailer.send_queue(mails)
+    if smtputf8:
+        assert (summary.accepted, summary.rejected) == (2, 0)
+        assert server.messages == 2
+    else:
+        # only the e-mail to the internationalized address fails
+        assert (summary.accepted, summary.rejected) == (1, 1)
+        assert summary.codes[553] == 1
+        assert server.messages == 1
@@ -0,0 +1,47 @@
+from __future__ import annotations
+import time
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for, plain_queue
+from bulk_mailer.general.mailer import Mailer
+from bulk_mailer.general.pool import SessionPolicy
+
+
+def test_lazy_session_is_not_opened_for_an_empty_queue(server: FakeSMTPServer):
+    with Mailer(config_for(server), SENDER, detailed_log=False, connections=3) as mailer:
+        mailer.send_queue([])
+    time.sleep(0.05)
+    assert server.sessions == 0
+
+
+def test_eager_session_is_opened_right_away(server: FakeSMTPServer):
+    with Mailer(config_for(server), SENDER, detailed_log=False, session=SessionPolicy(lazy=False)):
+        time.sleep(0.05)
+        assert server.sessions == 1
+
+
+def test_session_is_renewed_before_the_server_limit():
+    with FakeSMTPServer(max_messages=10) as server:
+        with Mailer(config_for(server), SENDER, detailed_log=False, connections=2, session=SessionPolicy(max_messages=10)) as mailer:
+            summary = mailer.send_queue(plain_queue(45))
+            assert mailer.metrics.counters['rotations'] >= 3
+    assert summary.accepted == 45
+    assert server.messages == 45
+    assert server.disconnects == 0
+
+
+def test_idle_session_is_kept_alive(server: FakeSMTPServer):
+    with Mailer(config_for(server), SENDER, detailed_log=False, session=SessionPolicy(keepalive=0.05)) as mailer:
+        mailer.send_queue(plain_queue(1))
+        time.sleep(0.3)
+    assert server.noops > 0
+    assert server.sessions == 1
+
+
+def test_oversized_mail_is_refused_and_queue_continues():
+    mails = plain_queue(2) + plain_queue(1, 'x' * 5000) + plain_queue(2)
+    with FakeSMTPServer(max_size=2000) as server:
+        with Mailer(config_for(server), SENDER, detailed_log=False) as mailer:
+            summary = mailer.send_queue(mails)
+    assert (summary.accepted, summary.rejected) == (4, 1)
+    assert summary.codes[552] == 1
+    assert server.messages == 4
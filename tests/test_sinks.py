@@ -0,0 +1,79 @@
+from __future__ import annotations
+import json
+import logging
+import sqlite3
+from pathlib import Path
+import pytest
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for, plain_queue
+from bulk_mailer.entities import Emailable
+from bulk_mailer.general.mailer import Mailer
+from bulk_mailer.general.envelope import Envelope
+from bulk_mailer.general.result import SendResult
+from bulk_mailer.general.sinks import JsonlSink, LogSampler, ResultSink, ResultSummary, SqliteSink, open_sink
+from bulk_mailer.general.suppression import SuppressionList
+
+
+ANN, BOB, CID = Emailable('ann@example.org'), Emailable('bob@example.org'), Emailable('cid@example.org')
+
+
+def mixed_result() -> SendResult:
+    env = Envelope(b'Subject: Hi\r\n\r\nHello\r\n', [ANN, BOB, CID], key='k1')
+    return SendResult(env, {ANN}, {BOB: (550, b'No such user')}, False, suppressed={CID})
+
+
+def test_incomplete_sink_cannot_be_created():
+    class Incomplete(ResultSink):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_jsonl_sink_writes_outcomes(tmp_path: Path):
+    path = tmp_path / 'results.jsonl'
+    with open_sink(path) as sink:
+        assert isinstance(sink, JsonlSink)
+        sink.write(mixed_result())
+    record = json.loads(path.read_text())
+    assert record['key'] == 'k1'
+    assert record['ok'] == ['ann@example.org']
+    assert record['failed'] == {'bob@example.org': [550, 'No such user']}
+    assert record['suppressed'] == ['cid@example.org']
+
+
+def test_sqlite_sink_writes_a_row_per_recipient(tmp_path: Path):
+    path = tmp_path / 'results.db'
+    with open_sink(path) as sink:
+        assert isinstance(sink, SqliteSink)
+        sink.write(mixed_result())
+    with sqlite3.connect(path) as db:
+        rows = sorted(db.execute('SELECT address, status, code FROM results'))
+    assert rows == [('ann@example.org', 'accepted', None), ('bob@example.org', 'rejected', 550), ('cid@example.org', 'suppressed', None)]
+
+
+def test_summary_counts_outcomes():
+    summary = ResultSummary()
+    summary.add(mixed_result())
+    summary.add(SendResult(Envelope(b'', ANN), set(), {}, True))
+    assert (summary.envelopes, summary.accepted, summary.rejected, summary.suppressed, summary.cancelled) == (2, 1, 1, 1, 1)
+    assert summary.codes == {550: 1}
+
+
+def test_sampler_limits_records_per_interval(caplog: pytest.LogCaptureFixture):
+    sampler = LogSampler(limit=3, interval=60)
+    assert [sampler.allow() for _ in range(5)] == [True, True, True, False, False]
+    with caplog.at_level(logging.INFO):
+        sampler.flush()
+    assert '2 log records have been left out' in caplog.text
+
+
+def test_suppressed_recipients_are_logged_sampled(server: FakeSMTPServer, tmp_path: Path, caplog: pytest.LogCaptureFixture):
+    queue = plain_queue(20)
+    with SuppressionList(tmp_path / 'suppressed.db') as suppression:
+        suppression.update(env.to[0] for env in queue[:15])
+        with Mailer(config_for(server), SENDER, detailed_log=False, suppression=suppression, log_limit=5) as mailer:
+            with caplog.at_level(logging.INFO):
+                summary = mailer.send_queue(queue)
+    assert (summary.accepted, summary.suppressed) == (5, 15)
+    assert server.messages == 5
+    assert caplog.text.count('suppressed recipients') <= 5
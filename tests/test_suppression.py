@@ -0,0 +1,77 @@
+from __future__ import annotations
+import logging
+from pathlib import Path
+import pytest
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for, plain_queue
+from bulk_mailer.entities import Emailable
+from bulk_mailer.general.mailer import Mailer
+from bulk_mailer.general.suppression import BloomFilter, SuppressionList, address_hash
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(address_hash(f'user{i}@example.org'))
+    assert all(address_hash(f'user{i}@example.org') in bloom for i in range(1000))
+    false_positives = sum(address_hash(f'other{i}@example.org') in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_addresses_are_normalized(tmp_path: Path):
+    with SuppressionList(tmp_path / 'suppressed.db') as suppression:
+        assert suppression.add('Ann@Example.org', 'unsubscribed')
+        assert not suppression.add(Emailable('ann@example.org'))
+        assert 'ann@EXAMPLE.org' in suppression
+        assert Emailable('ANN@example.org') in suppression
+        assert 'bob@example.org' not in suppression
+        assert suppression.reason('ann@example.org') == 'unsubscribed'
+        assert suppression.remove('ann@example.org')
+        assert 'ann@example.org' not in suppression
+        assert len(suppression) == 0
+
+
+def test_only_bounced_addresses_are_added(tmp_path: Path):
+    failed = {
+        Emailable('gone@example.org'): (550, b'5.1.1 No such user'),
+        Emailable('later@example.org'): (451, b'4.7.1 Greylisted'),
+        Emailable('big@example.org'): (552, b'5.3.4 Message too big'),
+        Emailable('bad@example.org'): (554, b'5.6.0 Invalid message'),
+    }
+    with SuppressionList(tmp_path / 'suppressed.db') as suppression:
+        assert suppression.add_bounces(failed) == 1
+        assert 'gone@example.org' in suppression
+        assert suppression.reason('gone@example.org') == '550 5.1.1 No such user'
+        assert len(suppression) == 1
+
+
+def test_bloom_filter_is_rebuilt_after_crash(tmp_path: Path, caplog: pytest.LogCaptureFixture):
+    path = tmp_path / 'suppressed.db'
+    with SuppressionList(path) as suppression:
+        suppression.update(f'user{i}@example.org' for i in range(100))
+    with caplog.at_level(logging.INFO):
+        suppression = SuppressionList(path)
+    assert not any('Building' in r.getMessage() for r in caplog.records)
+    suppression.add('late@example.org')
+    # the list is not closed, so the filter is not stored again
+    suppression._db.close()
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        suppression = SuppressionList(path)
+    with suppression:
+        assert any('Building' in r.getMessage() for r in caplog.records)
+        assert len(suppression) == 101
+        assert 'late@example.org' in suppression
+        assert 'user42@example.org' in suppression
+        assert 'other@example.org' not in suppression
+
+
+def test_suppressed_recipients_are_not_sent_to(server: FakeSMTPServer, tmp_path: Path):
+    mails = plain_queue(4)
+    with SuppressionList(tmp_path / 'suppressed.db') as suppression:
+        suppression.add('user1@example.org')
+        with Mailer(config_for(server), SENDER, detailed_log=False, suppression=suppression) as mailer:
+            summary = mailer.send_queue(mails)
+    assert (summary.accepted, summary.rejected, summary.suppressed) == (3, 0, 1)
+    assert server.messages == 3
@@ -0,0 +1,52 @@
+from __future__ import annotations
+from email import message_from_bytes
+from email.policy import default
+import pytest
+from fake_smtp import FakeSMTPServer
+from conftest import config_for
+from bulk_mailer.entities import Emailable, Person
+from bulk_mailer.general.mailer import Mailer
+from bulk_mailer.general.envelope import Envelope
+from bulk_mailer.utils import create_plain_mail
+from bulk_mailer import personal
+from bulk_mailer.personal import MessageTemplate
+
+
+SENDER = Emailable('sender@example.org')
+EVE = Person('Eve\r\nBcc: victim@example.org\r\nX-Evil: 1', 'L', 'eve@example.org')
+
+
+def test_render_fills_placeholders():
+    template = MessageTemplate('Hello {first_name}', 'Dear {name},\nthanks, {extra}')
+    data = template.render(Person('Jörg', 'Müller', 'j@example.org'), {'extra': 'x'})
+    msg = message_from_bytes(data, policy=default)
+    assert msg['Subject'] == 'Hello Jörg'
+    assert msg.get_content().rstrip() == 'Dear Jörg Müller,\nthanks, x'
+
+
+def test_render_refuses_line_breaks_in_headers():
+    with pytest.raises(ValueError):
+        MessageTemplate('Hello {first_name}', 'Hi').render(EVE)
+
+
+def test_line_breaks_in_subject_skip_only_that_mail(server: FakeSMTPServer):
+    people = [Person('Ann', 'L', 'ann@example.org'), EVE, Person('Bob', 'L', 'bob@example.org')]
+    queue = personal.StreamingMailQueue(detailed_log=False)
+    queue.add_for(people, MessageTemplate('Hello {first_name}', 'Hi'))
+    with personal.Mailer(config_for(server), SENDER, detailed_log=False) as mailer:
+        mailer.send_queue(queue)
+    assert queue.invalid == 1
+    assert server.messages == 2
+
+
+def test_line_breaks_in_address_name_fail_only_that_mail(server: FakeSMTPServer):
+    mails = [
+        Envelope(create_plain_mail('Hi', 'Hello'), Emailable('ann@example.org')),
+        Envelope(create_plain_mail('Hi', 'Hello'), Emailable('eve@example.org', 'Eve\r\nBcc: victim@example.org')),
+        Envelope(MessageTemplate('Hi', 'Hello').render(Emailable('x@example.org')), Emailable('eve@example.org', 'Eve\nX-Evil: 1')),
+    ]
+    with Mailer(config_for(server), SENDER, detailed_log=False) as mailer:
+        summary = mailer.send_queue(mails)
+    assert (summary.accepted, summary.rejected) == (1, 2)
+    assert summary.codes[554] == 2
+    assert server.messages == 1
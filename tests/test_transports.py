@@ -0,0 +1,53 @@
+from __future__ import annotations
+from pathlib import Path
+import pytest
+from fake_smtp import FakeSMTPServer
+from conftest import SENDER, config_for
+from bulk_mailer.entities import Emailable
+from bulk_mailer.general.mailer import Mailer
+from bulk_mailer.general.envelope import Envelope
+from bulk_mailer.general.transports import EmlTransport, MaildirTransport, MboxTransport, NullTransport, Transport, read_spool
+from bulk_mailer.utils import create_plain_mail
+
+
+def mails() -> list[Envelope]:
+    return [
+        Envelope(create_plain_mail('First', 'From the start\n.\nto the end'), Emailable('ann@example.org'), key='a'),
+        Envelope(create_plain_mail('Second', 'Hello'), Emailable('bob@example.org'), bcc=Emailable('cid@example.org')),
+    ]
+
+
+def test_incomplete_transport_cannot_be_created():
+    class Incomplete(Transport):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_null_transport_counts_and_discards():
+    transport = NullTransport()
+    with Mailer(transport, SENDER, detailed_log=False) as mailer:
+        summary = mailer.send_queue(mails())
+    assert summary.accepted == 3
+    assert transport.messages == 2
+
+
+@pytest.mark.parametrize('kind', ['eml', 'maildir', 'mbox'])
+def test_spool_round_trip(kind: str, tmp_path: Path, server: FakeSMTPServer):
+    path = tmp_path / 'spool'
+    transport = {'eml': EmlTransport, 'maildir': MaildirTransport, 'mbox': MboxTransport}[kind](path)
+    with transport, Mailer(transport, SENDER, detailed_log=False) as mailer:
+        expected = [mailer.prepare(env) for env in mails()]
+        mailer.send_queue(mails())
+
+    spooled = list(read_spool(path))
+    # the messages come back byte for byte, with their envelopes
+    assert [m.data for m in spooled] == [m.data for m in expected]
+    assert [m.to_addrs for m in spooled] == [['ann@example.org'], ['bob@example.org', 'cid@example.org']]
+    assert [m.from_addr for m in spooled] == [SENDER.email_address] * 2
+    assert spooled[0].env.key == 'a'
+
+    with Mailer(config_for(server), SENDER, detailed_log=False) as mailer:
+        summary = mailer.send_spool(path)
+    assert summary.accepted == 3
+    assert (server.messages, server.recipients) == (2, 3)